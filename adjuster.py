@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+from threading import Lock
+from typing import Callable, Iterable, Optional
+
+from check import AdjustType
+
+PRICE_FIELDS = ["open", "high", "low", "close"]
+
+
+def _parse_split(value) -> float:
+    """
+        Returns split ratio (new/old) from EOD's "4.000000/1.000000" format
+    """
+    if isinstance(value, str):
+        new, _, old = value.partition("/")
+        return float(new) / float(old or 1)
+    return float(value)
+
+
+def compute_adj_factors(
+    bars: pd.DataFrame,
+    dividends: Optional[pd.DataFrame] = None,
+    splits: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """
+    compute cumulative hfq factors for every corporate action
+
+    :param bars: raw bars with code, timestamp, close
+    :param dividends: code, timestamp(ex-date), dividend
+    :param splits: code, timestamp, split (new/old ratio or "new/old" str)
+    :return: code, timestamp, dividend, split, factor sorted by code, timestamp
+    """
+    events = []
+    if dividends is not None and not dividends.empty:
+        events.append(dividends[["code", "timestamp", "dividend"]].assign(split=1.0))
+    if splits is not None and not splits.empty:
+        sp = splits[["code", "timestamp", "split"]].copy()
+        sp["split"] = sp["split"].map(_parse_split)
+        events.append(sp.assign(dividend=0.0))
+    columns = ["code", "timestamp", "dividend", "split", "factor"]
+    if not events:
+        return pd.DataFrame(columns=columns)
+
+    events = pd.concat(events, ignore_index=True)
+    events["timestamp"] = pd.to_datetime(events["timestamp"])
+    events = (
+        events.groupby(["code", "timestamp"], as_index=False)
+        .agg(dividend=("dividend", "sum"), split=("split", "prod"))
+        .sort_values("timestamp")
+    )
+
+    # close of the last bar before each ex-date
+    closes = bars[["code", "timestamp", "close"]].rename(columns={"close": "prev_close"})
+    closes = closes.assign(timestamp=pd.to_datetime(closes["timestamp"])).sort_values("timestamp")
+    events = pd.merge_asof(
+        events, closes, on="timestamp", by="code",
+        direction="backward", allow_exact_matches=False
+    )
+
+    prev_close = events["prev_close"].to_numpy(dtype=float)
+    dividend = events["dividend"].to_numpy(dtype=float)
+    valid = np.isfinite(prev_close) & (prev_close > dividend)
+    div_factor = np.ones(len(events))
+    div_factor[valid] = prev_close[valid] / (prev_close[valid] - dividend[valid])
+    events["factor"] = div_factor * events["split"].to_numpy(dtype=float)
+
+    events = events.sort_values(["code", "timestamp"], ignore_index=True)
+    events["factor"] = events.groupby("code")["factor"].cumprod()
+    return events[columns]
+
+
+def apply_adj_factors(
+    df: pd.DataFrame,
+    factors: pd.DataFrame,
+    adjust: AdjustType,
+    price_fields: list = PRICE_FIELDS,
+) -> pd.DataFrame:
+    """
+    adjust price fields of raw bars in place
+
+    hfq: raw * factor(t)
+    qfq: raw * factor(t) / factor(latest)
+    """
+    if adjust not in ("qfq", "hfq"):
+        raise ValueError(f"unknown adjust type: {adjust}")
+    if df.empty or factors.empty:
+        return df
+    fields = [f for f in price_fields if f in df.columns]
+    if not fields:
+        return df
+
+    keys = pd.DataFrame({
+        "code": df["code"].to_numpy(),
+        "timestamp": pd.to_datetime(df["timestamp"]).to_numpy(),
+        "_pos": np.arange(len(df)),
+    }).sort_values("timestamp", kind="stable")
+    f = factors[["code", "timestamp", "factor"]].sort_values("timestamp", kind="stable")
+    merged = pd.merge_asof(keys, f, on="timestamp", by="code", direction="backward")
+
+    factor = np.ones(len(df))
+    factor[merged["_pos"].to_numpy()] = merged["factor"].fillna(1.0).to_numpy()
+    if adjust == "qfq":
+        latest = f.groupby("code")["factor"].last()
+        factor /= df["code"].map(latest).fillna(1.0).to_numpy(dtype=float)
+
+    df[fields] = df[fields].to_numpy(dtype=float) * factor[:, None]
+    return df
+
+
+class AdjFactorCache:
+    """
+    per-code factor series kept in memory, loaded on demand and invalidated
+    per code when new corporate actions are stored
+    """
+
+    def __init__(self):
+        self._factors = dict()
+        self._lock = Lock()
+
+    def get(self, table: str, codes: Iterable[str], loader: Callable[[list], pd.DataFrame]) -> pd.DataFrame:
+        codes = list(dict.fromkeys(codes))
+        with self._lock:
+            missing = [code for code in codes if (table, code) not in self._factors]
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                for code in missing:
+                    self._factors[(table, code)] = loaded[loaded["code"] == code] if not loaded.empty else loaded
+        with self._lock:
+            frames = [self._factors[(table, code)] for code in codes if (table, code) in self._factors]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=["code", "timestamp", "factor"])
+        return pd.concat(frames, ignore_index=True)
+
+    def invalidate(self, table: str, codes: Optional[Iterable[str]] = None):
+        with self._lock:
+            if codes is None:
+                for key in [key for key in self._factors if key[0] == table]:
+                    del self._factors[key]
+                return
+            for code in codes:
+                self._factors.pop((table, code), None)
+
+
+adj_factor_cache = AdjFactorCache()
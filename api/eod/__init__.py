@@ -1,3 +1,2 @@
-from .data import (set_envar, get_eod_data, get_dividends,  # noqa
-                   get_exchange_symbols, get_exchanges,  # noqa
-                   get_currencies, get_indexes)
\ No newline at end of file
+from .base import (EODRequester, get_exchanges,  # noqa
+                   get_currencies, get_indexes)
@@ -1,27 +1,95 @@
 from typing import Union, Optional 
 
 from io import StringIO
+from datetime import timedelta
 import pandas as pd 
-import requests_cache
+import requests
 
-from utils import _sanitize_dates, _format_date
+from utils import _sanitize_dates, _format_date, get_latest_trade_date
 from check import StartEndType, IntervalType
-from conf import EOD_API_KEY, EXPIRE_AFTER, EOD_BASE_URL
-from core.requester import Requester, TextFormat
+from conf import EOD_API_KEY, EOD_BASE_URL, HTTP_CACHE_PATH, HTTP_CACHE_MAX_BYTES, DEFAULT_INTERVAL
+from core.requester import Requester, TextFormat, JsonFormat
+from core.http_cache import ResponseCache
 from typing import Tuple, Dict
+from concurrent.futures import ThreadPoolExecutor
+
+# longest range, in days, the intraday api serves per request
+INTRADAY_MAX_DAYS = {"1m": 120, "5m": 600, "1h": 7200}
+_window_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="eod-intraday")
+
+
+def _utc_seconds(value: StartEndType) -> int:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+    return int(ts.timestamp())
+
+
+def intraday_bounds(start: StartEndType = None, end: StartEndType = None,
+                    interval: IntervalType = "1m") -> Tuple[int, int]:
+    """
+    Returns (start, end) as unix seconds; numbers are unix seconds already,
+    naive datetimes and strings are UTC like the stored bars, whatever the
+    host's timezone, aware ones are converted. end defaults to now, start
+    to DEFAULT_INTERVAL bars before end
+    """
+    end_ts = int(pd.Timestamp.now(tz="UTC").timestamp()) if end is None else _utc_seconds(end)
+    if start is None:
+        step = {"1m": 60, "5m": 300, "1h": 3600}.get(interval, 86400)
+        return end_ts - (DEFAULT_INTERVAL - 1) * step, end_ts
+    start_ts = _utc_seconds(start)
+    if start_ts > end_ts:
+        raise ValueError("end must not be before start")
+    return start_ts, end_ts
+
+
+def intraday_windows(start_ts: int, end_ts: int, interval: IntervalType) -> list:
+    """
+    split [start_ts, end_ts] into request windows no longer than the api max;
+    window edges sit on multiples of the max range so the windows between
+    the first and the last repeat exactly across runs, and hit the cache
+    """
+    span = INTRADAY_MAX_DAYS[interval] * 86400
+    windows = []
+    lo = start_ts
+    while lo <= end_ts:
+        hi = min((lo // span + 1) * span - 1, end_ts)
+        windows.append((lo, hi))
+        lo = hi + 1
+    return windows
+
 
 class EODRequester(Requester):
     format = TextFormat()
-    session = requests_cache.CachedSession(cache_name='cache', backend='sqlite', expire_after=EXPIRE_AFTER)
-    base_url: str = EOD_BASE_URL, 
+    session = requests.Session()
+    cache = ResponseCache(HTTP_CACHE_PATH, max_bytes=HTTP_CACHE_MAX_BYTES)
+    base_url: str = EOD_BASE_URL
     api_key: str=EOD_API_KEY
+
+    def _cache_expiry(self, url, params=None) -> Optional[float]:
+        """
+            ranges ending before the latest trade date never change, keep them forever
+        """
+        to = (params or {}).get("to")
+        if isinstance(to, str):
+            to = pd.Timestamp(to)
+        elif isinstance(to, (int, float)):
+            # intraday windows are bounded by unix seconds
+            to = pd.Timestamp(to, unit="s")
+        if to is not None and to.date() < get_latest_trade_date():
+            return None
+        return super()._cache_expiry(url, params)
     
     def eod_get_historical_data(self, symbol: str, exchange: str, start: StartEndType,
-                   end: StartEndType, interval:IntervalType) -> Tuple[str, Dict[str, str]]:
+                   end: StartEndType, interval:IntervalType,
+                   timeout: Optional[float] = None) -> Tuple[str, Dict[str, str]]:
         """
             **create_params**
-                will create parameters to pass into request session
+                will create parameters to pass into request session,
+                `timeout` overrides the connect and read timeouts of conf
         """
+        request = dict(conn_timeout=timeout, read_timeout=timeout) if timeout is not None else dict()
         symbol_exchange: str = f"{symbol}.{exchange}"
         # Takes date, datetime, str , or int and returns a valid date objects or TimeStamps
         start, end = _sanitize_dates(start, end)
@@ -34,38 +102,78 @@ class EODRequester(Requester):
             "to": _format_date(end),
             "period": interval
         }
-        return self._get(url, params)
+        latest = pd.Timestamp(get_latest_trade_date())
+        if interval == "d" and start < latest <= end:
+            # split off the tail so the history before it is cached for good
+            head = self._get(url, dict(params, to=_format_date(latest - timedelta(days=1))), **request)
+            tail = self._get(url, dict(params, **{"from": _format_date(latest)}), **request)
+            frames = [df for df in (head, tail) if df is not None]
+            return pd.concat(frames) if frames else None
+        return self._get(url, params, **request)
     
-    def eod_get_intraday_data(self, symbol: str, exchange: str, start: StartEndType,
-                   end: StartEndType, interval: IntervalType):
-        possible_intervals = ['5m', '1h', '1m']
-        
-        endpoint = 'intraday'
-
-        if symbol.strip() == "" or symbol is None:
+    def eod_get_intraday_data(self, symbol: str, exchange: str, start: StartEndType = None,
+                   end: StartEndType = None, interval: IntervalType = "1m") -> Optional[pd.DataFrame]:
+        """
+            Returns intraday bars indexed by their utc Timestamp, fetched in
+            windows of at most the api's range per request, in parallel
+        """
+        if symbol is None or symbol.strip() == "":
             raise ValueError("Ticker is empty. You need to add ticker to args")
-        if interval not in possible_intervals:
-            raise ValueError("Interval must be in ['5m', '1h', '1m'] values")
-        
-        uri = f'{symbol}'
-        query_string = ''
+        if interval not in INTRADAY_MAX_DAYS:
+            raise ValueError(f"Interval must be in {list(INTRADAY_MAX_DAYS)} values")
+        url: str = self.base_url + f"/intraday/{symbol}.{exchange}"
+        start_ts, end_ts = intraday_bounds(start, end, interval)
+        params = [
+            {"api_token": self.api_key, "interval": interval, "from": lo, "to": hi}
+            for lo, hi in intraday_windows(start_ts, end_ts, interval)
+        ]
+        if len(params) == 1:
+            frames = [self._get(url, params[0])]
+        else:
+            frames = list(_window_pool.map(lambda p: self._get(url, p), params))
+        frames = [df for df in frames if df is not None and not df.empty]
+        if not frames:
+            return None
+        df = pd.concat(frames)
+        return df[~df.index.duplicated(keep="last")].sort_index()
 
-        query_string += '&interval=' + str(interval)
-        
-        if from_unix_time is not None: 
-            query_string += '&from=' + str(from_unix_time)
-        if to_unix_time is not None: 
-            query_string += '&to=' + str(to_unix_time)
+    def eod_get_fundamental_data(self, symbol: str, exchange: str, filter: Optional[str] = None) -> Optional[dict]:
+        """
+            Returns the fundamentals json document, `filter` selects a section e.g. "Financials::Balance_Sheet"
+        """
+        url: str = self.base_url + f"/fundamentals/{symbol}.{exchange}"
+        params: dict = {"api_token": self.api_key}
+        if filter:
+            params["filter"] = filter
+        return self._get(url, params, fmt=JsonFormat())
 
-        
-        return self._rest_get_method(api_key = api_token, endpoint = endpoint, querystring = query_string, uri = uri)
+    def eod_get_dividends(self, symbol: str, exchange: str, start: StartEndType = "2000-01-01",
+                   end: StartEndType = "2050-01-01") -> pd.DataFrame:
+        """
+            Returns dividends indexed by ex-date, column `Dividends`
+        """
+        start, end = _sanitize_dates(start, end)
+        url: str = self.base_url + f"/div/{symbol}.{exchange}"
+        params: dict = {
+            "api_token": self.api_key,
+            "from": _format_date(start),
+            "to": _format_date(end),
+        }
+        return self._get(url, params)
 
-    def eod_get_fundamental_data(self, symbol: str, exchange: str, start: StartEndType,
-                   end: StartEndType,):
-        endpoint = '/fundamentals/'
-        url: str = self.base_url + endpoint
-    
-print(EODRequester().get("AAPL", "US"))
+    def eod_get_splits(self, symbol: str, exchange: str, start: StartEndType = "2000-01-01",
+                   end: StartEndType = "2050-01-01") -> pd.DataFrame:
+        """
+            Returns splits indexed by date, column `Stock Splits` formatted as "new/old"
+        """
+        start, end = _sanitize_dates(start, end)
+        url: str = self.base_url + f"/splits/{symbol}.{exchange}"
+        params: dict = {
+            "api_token": self.api_key,
+            "from": _format_date(start),
+            "to": _format_date(end),
+        }
+        return self._get(url, params)
 
 
 
@@ -0,0 +1,294 @@
+"""
+a long only backtest over date x code panels: float64 (days, codes) arrays of
+prices, NaN where a code has no bar, and entry/exit signal arrays of the same
+shape. The loop runs over days only, every step is a handful of array ops
+over all codes, so a 5000 code universe costs about what one code does:
+
+    panels = panels_from_bars(tg_context.get_data(EodUSStock1dKdata, start="2015-01-01"))
+    entries = panels["close"] > rolling_mean(panels["close"], 20)
+    result = backtest(panels, entries, ~entries, stop_loss=0.08, take_profit=0.2)
+
+a signal on day t is filled at the open of t + 1; stops are checked against
+the low and high of every day a position is held, the stop-loss first when
+both are touched. `sweep` runs a strategy over a parameter grid in a process
+pool with the panels in shared memory
+"""
+from functools import partial
+from itertools import product
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from check import TradeActions
+from core.metrics import metrics
+from core.processor import SweepResults, SweepRunner
+
+PRICE_FIELDS = ["open", "high", "low", "close"]
+# exits as codes in the trade arrays, labelled with TradeActions in the trade log
+_CLOSE, _STOP_LOSS, _TAKE_PROFIT = 1, 2, 3
+EXIT_ACTIONS = np.array([None, TradeActions.CLOSE, TradeActions.STOP_LOSS, TradeActions.TAKE_PROFIT], dtype=object)
+# backtest arguments a sweep takes from the parameters instead of handing them to the strategy
+BACKTEST_PARAMS = ("stop_loss", "take_profit", "position_size", "commission", "min_commission",
+                   "sell_tax", "lot_size", "cash")
+
+Signal = Union[np.ndarray, pd.DataFrame]
+
+
+def panels_from_bars(df: pd.DataFrame, fields: Iterable[str] = PRICE_FIELDS) -> Dict[str, pd.DataFrame]:
+    """
+        Returns a dates x codes frame per field of long bars (code, timestamp, fields)
+    """
+    day_ids, dates = pd.factorize(pd.to_datetime(df["timestamp"]), sort=True)
+    code_ids, codes = pd.factorize(df["code"].to_numpy(dtype=object), sort=True)
+    panels = dict()
+    for field in fields:
+        values = np.full((len(dates), len(codes)), np.nan)
+        values[day_ids, code_ids] = pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=np.float64)
+        panels[field] = pd.DataFrame(values, index=pd.DatetimeIndex(dates), columns=pd.Index(codes))
+    return panels
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+        Returns the mean of the last `window` rows along axis 0, NaN until there are that many
+    """
+    values = np.asarray(values, dtype=np.float64)
+    csum = np.nancumsum(np.r_[np.zeros((1,) + values.shape[1:]), values], axis=0)
+    count = np.cumsum(np.r_[np.zeros((1,) + values.shape[1:]), np.isfinite(values)], axis=0)
+    total = csum[window:] - csum[:-window]
+    n = count[window:] - count[:-window]
+    out = np.full(values.shape, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out[window - 1:] = np.where(n == window, total / n, np.nan)
+    return out
+
+
+def ffill(values: np.ndarray) -> np.ndarray:
+    """
+        Returns values with NaN replaced by the last finite value above, along axis 0
+    """
+    finite = np.isfinite(values)
+    rows = np.where(finite, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return values[rows, np.arange(values.shape[1])]
+
+
+def _array(value, shape=None) -> np.ndarray:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        value = value.to_numpy()
+    value = np.asarray(value)
+    if shape is not None and value.shape != shape:
+        raise ValueError(f"panel of shape {value.shape}, expected {shape}")
+    return value
+
+
+class BacktestResult:
+    """
+    `positions` (shares held after each day) and `pnl` (mark to market profit
+    of each code on each day, fees in) are (days, codes) arrays, `equity` and
+    `cash` one value per day, `trades` one row per closed round trip
+    """
+
+    def __init__(self, dates, codes, positions: np.ndarray, pnl: np.ndarray, equity: np.ndarray,
+                 cash: np.ndarray, trades: pd.DataFrame, initial: float):
+        self.dates = pd.DatetimeIndex(dates) if dates is not None else pd.RangeIndex(len(equity))
+        self.codes = pd.Index(codes) if codes is not None else pd.RangeIndex(positions.shape[1])
+        self.positions = positions
+        self.pnl = pnl
+        self.equity = equity
+        self.cash = cash
+        self.trades = trades
+        self.initial = initial
+
+    def positions_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.positions, index=self.dates, columns=self.codes)
+
+    def pnl_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.pnl, index=self.dates, columns=self.codes)
+
+    def equity_curve(self) -> pd.Series:
+        return pd.Series(self.equity, index=self.dates, name="equity")
+
+    def stats(self, periods: int = 252) -> Dict[str, float]:
+        """
+            Returns total return, annualized return and volatility, sharpe, max drawdown and trade counts
+        """
+        equity = self.equity
+        returns = np.diff(np.r_[self.initial, equity]) / np.r_[self.initial, equity[:-1]]
+        years = max(len(equity) / periods, 1 / periods)
+        total = equity[-1] / self.initial - 1 if len(equity) else 0.0
+        std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+        peak = np.maximum.accumulate(np.r_[self.initial, equity])
+        pnl = self.trades["pnl"].to_numpy()
+        return dict(
+            total_return=float(total),
+            annual_return=float((1 + total) ** (1 / years) - 1) if total > -1 else -1.0,
+            annual_volatility=float(std * np.sqrt(periods)),
+            sharpe=float(returns.mean() / std * np.sqrt(periods)) if std > 0 else 0.0,
+            max_drawdown=float((np.r_[self.initial, equity] / peak - 1).min()),
+            trades=int(len(pnl)),
+            win_rate=float((pnl > 0).mean()) if len(pnl) else 0.0,
+            stop_losses=int((self.trades["action"] == TradeActions.STOP_LOSS).sum()),
+            take_profits=int((self.trades["action"] == TradeActions.TAKE_PROFIT).sum()),
+        )
+
+
+@metrics.timed("backtest")
+def backtest(panels: Mapping[str, Signal], entries: Signal, exits: Optional[Signal] = None,
+             stop_loss: float = None, take_profit: float = None, cash: float = 1_000_000.0,
+             position_size: float = None, commission: float = 0.0003, min_commission: float = 5.0,
+             sell_tax: float = 0.0, lot_size: Union[int, np.ndarray] = 100) -> BacktestResult:
+    """
+    panels needs close and takes open, high, low (close stands in for a
+    missing one); entries is a bool panel, or a float score panel where
+    finite > 0 means enter and higher scores get the cash first; exits a
+    bool panel. stop_loss / take_profit are fractions of the entry price,
+    position_size the cash put into one entry, cash / 20 by default;
+    commission is charged on both sides with min_commission per order,
+    sell_tax on sells, shares are bought in multiples of lot_size
+    """
+    close = _array(panels["close"]).astype(np.float64)
+    shape = close.shape
+    days, width = shape
+    first = next(iter(panels.values()))
+    dates = first.index if isinstance(first, pd.DataFrame) else None
+    codes = first.columns if isinstance(first, pd.DataFrame) else None
+    open_ = _array(panels["open"], shape).astype(np.float64) if "open" in panels else close
+    high = _array(panels["high"], shape).astype(np.float64) if "high" in panels else close
+    low = _array(panels["low"], shape).astype(np.float64) if "low" in panels else close
+
+    entries = _array(entries, shape)
+    score = entries.astype(np.float64)
+    want_in = np.isfinite(score) & (score > 0)
+    want_out = np.zeros(shape, dtype=bool) if exits is None else _array(exits, shape).astype(bool)
+    lot = np.broadcast_to(_array(lot_size), (width,)).astype(np.int64)
+    position_size = position_size or cash / 20
+    marks = ffill(close)
+    initial = cash
+
+    shares = np.zeros(width, dtype=np.int64)
+    entry_px = np.zeros(width)
+    entry_fee = np.zeros(width)
+    entry_day = np.zeros(width, dtype=np.int64)
+    pending_in = np.zeros(width, dtype=bool)
+    pending_out = np.zeros(width, dtype=bool)
+    pending_score = np.zeros(width)
+    positions = np.zeros(shape, dtype=np.int64)
+    flows = np.zeros(shape)
+    equity = np.empty(days)
+    cash_curve = np.empty(days)
+    trades: List[tuple] = []
+
+    def fee(notional: np.ndarray) -> np.ndarray:
+        return np.where(notional > 0, np.maximum(notional * commission, min_commission), 0.0)
+
+    def sell(t: int, which: np.ndarray, price: np.ndarray, action: int):
+        nonlocal cash
+        idx = np.flatnonzero(which)
+        if not len(idx):
+            return
+        px = price[idx]
+        notional = shares[idx] * px
+        fees = fee(notional) + notional * sell_tax
+        cash += float((notional - fees).sum())
+        flows[t, idx] += notional - fees
+        trades.append((idx, entry_day[idx], np.full(len(idx), t), entry_px[idx], px, shares[idx].copy(),
+                       notional - fees - shares[idx] * entry_px[idx] - entry_fee[idx], np.full(len(idx), action)))
+        shares[idx] = 0
+
+    for t in range(days):
+        o, h, l = open_[t], high[t], low[t]
+        # o and l are NaN where the code does not trade, every comparison on them is False
+        tradable = np.isfinite(o)
+        held = shares > 0
+        sell(t, pending_out & held & tradable, o, _CLOSE)
+
+        buy = pending_in & (shares == 0) & tradable
+        idx = np.flatnonzero(buy)
+        if len(idx):
+            idx = idx[np.argsort(-pending_score[idx], kind="stable")]
+            px = o[idx]
+            alloc = min(position_size, cash)
+            n = (np.floor(alloc / (px * (1 + commission)) / lot[idx]) * lot[idx]).astype(np.int64)
+            cost = n * px + fee(n * px)
+            # cash goes to the best scores first, the rest of the day's entries wait for a new signal
+            ok = (n > 0) & (np.cumsum(np.where(n > 0, cost, 0.0)) <= cash)
+            idx, px, n, cost = idx[ok], px[ok], n[ok], cost[ok]
+            cash -= float(cost.sum())
+            flows[t, idx] -= cost
+            shares[idx] = n
+            entry_px[idx] = px
+            entry_fee[idx] = cost - n * px
+            entry_day[idx] = t
+
+        if stop_loss is not None:
+            stop_px = entry_px * (1 - stop_loss)
+            # a gap through the stop fills at the open
+            sell(t, (shares > 0) & (l <= stop_px), np.minimum(o, stop_px), _STOP_LOSS)
+        if take_profit is not None:
+            target_px = entry_px * (1 + take_profit)
+            sell(t, (shares > 0) & (h >= target_px), np.maximum(o, target_px), _TAKE_PROFIT)
+
+        held = shares > 0
+        pending_out = want_out[t] & held
+        pending_in = want_in[t] & ~held
+        pending_score = score[t]
+        positions[t] = shares
+        cash_curve[t] = cash
+        equity[t] = cash + float(np.nansum(shares * marks[t]))
+
+    value = np.nan_to_num(positions * marks)
+    pnl = np.diff(np.r_[np.zeros((1, width)), value], axis=0) + flows
+    return BacktestResult(dates, codes, positions, pnl, equity, cash_curve, _trade_log(trades, dates, codes), initial)
+
+
+def _trade_log(trades: List[tuple], dates, codes) -> pd.DataFrame:
+    columns = ["code", "entry_day", "exit_day", "entry_price", "exit_price", "shares", "pnl", "action"]
+    if not trades:
+        parts = [np.array([], dtype=np.int64)] * len(columns)
+    else:
+        parts = [np.concatenate(part) for part in zip(*trades)]
+    df = pd.DataFrame(dict(zip(columns, parts)))
+    df["action"] = EXIT_ACTIONS[df["action"].to_numpy(dtype=np.int64)]
+    if codes is not None:
+        df["code"] = np.asarray(codes, dtype=object)[df["code"].to_numpy(dtype=np.int64)]
+    if dates is not None:
+        dates = pd.DatetimeIndex(dates)
+        df["entry_day"] = dates[df["entry_day"].to_numpy(dtype=np.int64)]
+        df["exit_day"] = dates[df["exit_day"].to_numpy(dtype=np.int64)]
+    return df.rename(columns={"entry_day": "entry_date", "exit_day": "exit_date"})
+
+
+def param_grid(**axes: Iterable) -> List[dict]:
+    """
+        Returns every combination of the axes, param_grid(fast=[5, 10], slow=[20, 60])
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in product(*axes.values())]
+
+
+def _sweep_one(strategy: Callable, options: dict, arrays: Dict[str, np.ndarray], param: dict) -> dict:
+    kwargs = dict(options)
+    kwargs.update({name: param[name] for name in BACKTEST_PARAMS if name in param})
+    signals = {name: value for name, value in param.items() if name not in BACKTEST_PARAMS}
+    entries, exits = strategy(arrays, **signals)
+    return backtest(arrays, entries, exits, **kwargs).stats()
+
+
+def sweep(strategy: Callable, panels: Mapping[str, Signal], params: Iterable[dict], processes: int = None,
+          run: str = None, results: SweepResults = None, **options) -> pd.DataFrame:
+    """
+    Returns the stats of a backtest per parameter set, one row each.
+    strategy(panels, **params) returns (entries, exits) and must be a module
+    level function; stop_loss, take_profit and the other backtest arguments in
+    a parameter set go to the backtest instead, options to every backtest.
+    With a run name the stats also stream into results (SweepResults() by
+    default) and a rerun of the same name only runs what is missing
+    """
+    arrays = {name: _array(panel).astype(np.float64) for name, panel in panels.items()}
+    if run is not None and results is None:
+        results = SweepResults()
+    runner = SweepRunner(partial(_sweep_one, strategy, options), arrays, processes, results)
+    rows = runner.run(params, run)
+    return pd.DataFrame([dict(param, **stats) for _, param, stats in rows])
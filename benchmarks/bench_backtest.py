@@ -0,0 +1,148 @@
+"""
+the vectorized backtest over date x code panels next to a bar by bar, code
+by code event loop with the same rules, and a parameter sweep run in
+process and in a shared memory pool
+
+    python -m benchmarks.bench_backtest --codes 2000 --days 1000
+"""
+import argparse
+import json
+import math
+
+from benchmarks.common import synthetic_bars, synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+
+from backtester import backtest, panels_from_bars, param_grid, rolling_mean, sweep  # noqa: E402
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+
+COMMISSION, MIN_COMMISSION, LOT = 0.0003, 5.0, 100
+
+
+def ma_cross(panels, fast: int = 5, slow: int = 20):
+    close = panels["close"]
+    fast_ma, slow_ma = rolling_mean(close, fast), rolling_mean(close, slow)
+    return fast_ma > slow_ma, fast_ma < slow_ma
+
+
+def naive_backtest(panels, entries, exits, stop_loss, take_profit, cash, position_size) -> np.ndarray:
+    """
+        Returns the equity curve of the same rules, one bar of one code at a time
+    """
+    o, h, l, c = (np.asarray(panels[f]) for f in ("open", "high", "low", "close"))
+    days, width = c.shape
+    fee = lambda notional: max(notional * COMMISSION, MIN_COMMISSION) if notional > 0 else 0.0
+    shares, entry = [0] * width, [0.0] * width
+    pending_in, pending_out = [False] * width, [False] * width
+    last = [math.nan] * width
+    equity = []
+    for t in range(days):
+        for j in range(width):
+            if pending_out[j] and shares[j] and not math.isnan(o[t, j]):
+                cash += shares[j] * o[t, j] - fee(shares[j] * o[t, j])
+                shares[j] = 0
+        for j in range(width):
+            if pending_in[j] and not shares[j] and not math.isnan(o[t, j]):
+                px = o[t, j]
+                n = int(math.floor(min(position_size, cash) / (px * (1 + COMMISSION)) / LOT) * LOT)
+                cost = n * px + fee(n * px)
+                if n > 0 and cost <= cash:
+                    cash -= cost
+                    shares[j], entry[j] = n, px
+                elif n > 0:
+                    # same as the vectorized fill, nothing after the first entry cash runs out on
+                    for k in range(j + 1, width):
+                        pending_in[k] = False
+        for j in range(width):
+            if shares[j]:
+                stop, target = entry[j] * (1 - stop_loss), entry[j] * (1 + take_profit)
+                if l[t, j] <= stop:
+                    px = min(o[t, j], stop)
+                elif h[t, j] >= target:
+                    px = max(o[t, j], target)
+                else:
+                    continue
+                cash += shares[j] * px - fee(shares[j] * px)
+                shares[j] = 0
+        value = 0.0
+        for j in range(width):
+            if not math.isnan(c[t, j]):
+                last[j] = c[t, j]
+            if shares[j]:
+                value += shares[j] * last[j]
+            pending_out[j] = bool(exits[t, j]) and shares[j] > 0
+            pending_in[j] = bool(entries[t, j]) and not shares[j]
+        equity.append(cash + value)
+    return np.asarray(equity)
+
+
+def run(args) -> dict:
+    codes = synthetic_codes(args.codes)
+    frames = panels_from_bars(synthetic_bars(codes, args.days))
+    panels = {field: frame.to_numpy() for field, frame in frames.items()}
+    options = dict(stop_loss=0.08, take_profit=0.2, cash=10_000_000.0, position_size=50_000.0)
+    entries, exits = ma_cross(panels)
+    stages = []
+
+    with Stage("backtest") as timed:
+        for _ in range(args.repeat):
+            result = timed.timed(backtest, panels, entries, exits, **options)
+            timed.items += entries.size
+    timed.unit = "cells"
+    stages.append(timed)
+
+    small = {field: panel[:, :args.naive_codes] for field, panel in panels.items()}
+    e, x = entries[:, :args.naive_codes], exits[:, :args.naive_codes]
+    with Stage("backtest_small") as fast:
+        fast_equity = fast.timed(backtest, small, e, x, **options).equity
+        fast.items = e.size
+    fast.unit = "cells"
+    stages.append(fast)
+    with Stage("event_loop") as naive:
+        naive_equity = naive.timed(naive_backtest, small, e, x, **options)
+        naive.items = e.size
+    naive.unit = "cells"
+    stages.append(naive)
+    assert np.allclose(fast_equity, naive_equity, rtol=1e-9), "equity curves differ"
+
+    grid = param_grid(fast=[5, 10], slow=[20, 60], stop_loss=[0.05, 0.1], take_profit=[0.2])
+    options.pop("stop_loss"), options.pop("take_profit")
+    with Stage("sweep_serial") as serial:
+        table = serial.timed(sweep, ma_cross, panels, grid, processes=1, **options)
+        serial.items = len(table)
+    serial.unit = "runs"
+    stages.append(serial)
+    with Stage("sweep_pool") as pooled:
+        shared = pooled.timed(sweep, ma_cross, panels, grid, processes=args.processes, **options)
+        pooled.items = len(shared)
+    pooled.unit = "runs"
+    stages.append(pooled)
+    assert np.allclose(table["total_return"], shared["total_return"]), "sweeps differ"
+
+    return dict(
+        params=dict(codes=args.codes, days=args.days, trades=len(result.trades),
+                    total_return=round(result.stats()["total_return"], 4), processes=args.processes),
+        stages={stage.name: stage.report() for stage in stages},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--naive-codes", type=int, default=100, help="codes the event loop is timed on")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
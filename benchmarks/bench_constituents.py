@@ -0,0 +1,104 @@
+"""
+index constituents: the recorder against a local EOD stub, then point in
+time lookups per bar from the interval store next to filtering the
+membership table with pandas per bar, and the date x code mask of a
+backtest
+
+    python -m benchmarks.bench_constituents --codes 1500 --size 500 --days 6000
+"""
+import argparse
+import json
+
+from benchmarks.common import synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from api.eod.base import EODRequester  # noqa: E402
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+from benchmarks.stub_server import StubServer  # noqa: E402
+from constituent_store import ConstituentStore  # noqa: E402
+from recorders.eod.eod_us_stock.eod_us_index_constituents import EodUSIndexConstituentsRecorder  # noqa: E402
+
+
+def naive_members(df: pd.DataFrame, on: pd.Timestamp) -> np.ndarray:
+    live = (df["valid_from"] <= on) & (df["valid_to"].isna() | (df["valid_to"] > on))
+    return np.sort(df.loc[live, "code"].unique())
+
+
+def run(args) -> dict:
+    codes = synthetic_codes(args.codes)
+    index = f"SPX{args.size}"
+    stages = []
+
+    with StubServer(codes, args.days) as server:
+        requester = EODRequester()
+        requester.base_url = server.url
+        requester.cache = None
+        server.index_fundamentals(index)
+        store = ConstituentStore("EOD")
+        recorder = EodUSIndexConstituentsRecorder(requester, store)
+        with Stage("record") as record:
+            record.items = record.timed(recorder.run, [index])
+        record.unit = "intervals"
+        stages.append(record)
+
+    dates = pd.bdate_range(server.index_start, server.index_end)
+    with Stage("load") as load:
+        membership = load.timed(store.membership, index)
+        load.items = len(membership)
+    load.unit = "intervals"
+    stages.append(load)
+
+    with Stage("members") as members:
+        for day in dates:
+            members.items += len(members.timed(membership.members, day))
+    stages.append(members)
+
+    table = store.read(index)
+    with Stage("members_pandas") as naive:
+        for day in dates[::args.naive_step]:
+            naive.items += len(naive.timed(naive_members, table, day))
+    stages.append(naive)
+    for day in dates[::args.naive_step * 50]:
+        assert (membership.members(day) == naive_members(table, day)).all(), f"members differ on {day}"
+
+    windows = dates[::21]
+    with Stage("members_over") as over:
+        for start, end in zip(windows[:-1], windows[1:]):
+            over.items += len(over.timed(membership.members_over, start, end))
+    stages.append(over)
+
+    with Stage("mask") as mask:
+        panel = mask.timed(membership.mask, dates)
+        mask.items = panel.size
+    mask.unit = "cells"
+    stages.append(mask)
+    assert (panel.sum(axis=1).to_numpy() == [len(membership.members(d)) for d in dates]).all(), "mask differs"
+
+    return dict(
+        params=dict(codes=args.codes, size=args.size, days=len(dates), intervals=len(membership),
+                    spans=len(membership.breakpoints)),
+        stages={stage.name: stage.report() for stage in stages},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=1500)
+    parser.add_argument("--size", type=int, default=500, help="index members")
+    parser.add_argument("--days", type=int, default=6000)
+    parser.add_argument("--naive-step", type=int, default=10, help="time the pandas lookup on every n-th day")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+EOD csv parsing, previous python-engine parse vs. core.requester.read_csv
+
+    python -m benchmarks.bench_csv_parse --corpus path/to/saved/responses
+    python -m benchmarks.bench_csv_parse --files 500 --rows 2500
+
+without --corpus a synthetic corpus in the EOD layout is generated
+"""
+import argparse
+import asyncio
+import glob
+import os
+from io import StringIO
+
+import pandas as pd
+
+from benchmarks.common import Timer, synthetic_bars, synthetic_codes, use_temp_home
+
+use_temp_home()
+
+from core.requester import read_csv, async_parse  # noqa: E402
+
+EOD_COLUMNS = ["Date", "Open", "High", "Low", "Close", "Adjusted_close", "Volume"]
+
+
+def load_corpus(path: str) -> list:
+    corpus = []
+    for name in sorted(glob.glob(os.path.join(path, "*.csv"))):
+        with open(name, "rb") as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def synthetic_corpus(files: int, rows: int) -> list:
+    bars = synthetic_bars(synthetic_codes(files), rows)
+    corpus = []
+    for _, df in bars.groupby("code", sort=False):
+        df = df.rename(columns={"timestamp": "Date", "adjusted_close": "Adjusted_close"})
+        df = df.rename(columns=str.capitalize)[EOD_COLUMNS]
+        df["Date"] = df["Date"].dt.strftime("%Y-%m-%d")
+        corpus.append(df.to_csv(index=False, float_format="%.4f").encode())
+    return corpus
+
+
+def python_engine(content: bytes) -> pd.DataFrame:
+    return pd.read_csv(StringIO(content.decode()), engine="python", skipfooter=0, parse_dates=[0], index_col=0)
+
+
+async def parse_all_async(corpus: list):
+    return await asyncio.gather(*(async_parse(read_csv, content) for content in corpus))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=None)
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=2500)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.files, args.rows)
+    size = sum(len(content) for content in corpus)
+
+    with Timer() as old:
+        expected = [python_engine(content) for content in corpus]
+    with Timer() as new:
+        parsed = [read_csv(content) for content in corpus]
+    with Timer() as offloaded:
+        asyncio.run(parse_all_async(corpus))
+
+    for a, b in zip(expected, parsed):
+        pd.testing.assert_frame_equal(a, b, check_dtype=False, check_index_type=False)
+
+    print(f"{len(corpus)} responses, {size / 2**20:.1f}MB")
+    for name, timer in (("python engine", old), ("read_csv", new), ("read_csv in parse pool", offloaded)):
+        print(f"{name:<24}{timer.elapsed:8.3f}s  {size / 2**20 / timer.elapsed:8.1f}MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+fundamentals against a local EOD stub: fetch + flatten + write of every
+symbol, the no-op refetch, a point in time cross section screen from the
+store next to the same screen re-parsed from the raw json documents, and
+bytes on disk next to the json
+
+    python -m benchmarks.bench_fundamentals --codes 500 --days 2500
+"""
+import argparse
+import json
+
+from benchmarks.common import synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from api.eod.base import EODRequester  # noqa: E402
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+from benchmarks.bench_ticks import _disk_bytes  # noqa: E402
+from benchmarks.stub_server import StubServer  # noqa: E402
+from fundamental_store import STATEMENTS, FundamentalStore  # noqa: E402
+from recorders.eod.eod_us_stock.eod_us_stock_fundamentals import EodUSStockFundamentalsRecorder  # noqa: E402
+
+# netIncome is in the income statement and the cash flow
+SCREEN_FIELDS = ["totalRevenue", "income_statement.netIncome", "totalAssets", "freeCashFlow"]
+
+
+def screen_json(docs: dict, on: pd.Timestamp) -> pd.DataFrame:
+    """
+        Returns the as-of cross section of SCREEN_FIELDS by walking the json documents
+    """
+    on = on.strftime("%Y-%m-%d")
+    rows = {}
+    for code, raw in docs.items():
+        financials = json.loads(raw)["Financials"]
+        row = {}
+        for key, statement in financials.items():
+            filed = [p for p in statement["quarterly"].values() if p["filing_date"] <= on]
+            for period in sorted(filed, key=lambda p: p["date"]):
+                for column in SCREEN_FIELDS:
+                    pinned, _, field = column.rpartition(".")
+                    if pinned and pinned != STATEMENTS[key]:
+                        continue
+                    if period.get(field) is not None:
+                        row[column] = float(period[field])
+        rows[code] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def run(args) -> dict:
+    codes = synthetic_codes(args.codes)
+    stages = []
+
+    with StubServer(codes, args.days, latency=args.latency) as server:
+        requester = EODRequester()
+        requester.base_url = server.url
+        requester.cache = None
+        docs = {code: server.symbols[code].fundamentals for code in codes}
+        on = pd.Timestamp(str(server.symbols[codes[0]].dates[-1])) - pd.Timedelta(days=args.lookback)
+
+        store = FundamentalStore("EOD")
+        recorder = EodUSStockFundamentalsRecorder(requester, store, workers=args.workers)
+        with Stage("ingest") as ingest:
+            ingest.items = ingest.timed(recorder.run, codes)
+        stages.append(ingest)
+
+        with Stage("refetch") as refetch:
+            # the same documents again, nothing changed so nothing is written
+            refetch.timed(recorder.run, codes)
+            refetch.items = len(codes)
+        refetch.unit = "codes"
+        stages.append(refetch)
+
+    with Stage("screen_store") as screen:
+        for _ in range(args.repeat):
+            stored = screen.timed(store.as_of, on, SCREEN_FIELDS)
+            screen.items += stored.size
+    stages.append(screen)
+
+    with Stage("screen_json") as naive:
+        for _ in range(args.repeat):
+            parsed = naive.timed(screen_json, docs, on)
+            naive.items += parsed.size
+    stages.append(naive)
+    assert np.allclose(stored.loc[parsed.index, parsed.columns].to_numpy(), parsed.to_numpy()), "screens disagree"
+    try:
+        store.as_of(on, ["netIncome"])
+        raise AssertionError("an ambiguous field went through")
+    except ValueError:
+        pass
+    both = store.as_of(on, ["income_statement.netIncome", "cash_flow.netIncome"])
+    assert (both["income_statement.netIncome"] != both["cash_flow.netIncome"]).any(), "statements mixed up"
+
+    rows = len(store.read())
+    disk = _disk_bytes(store.root)
+    raw = sum(len(doc) for doc in docs.values())
+    return dict(
+        params=dict(codes=args.codes, days=args.days, as_of=str(on.date())),
+        stages={stage.name: stage.report() for stage in stages},
+        storage=dict(rows=rows, bytes=disk, bytes_per_row=round(disk / rows, 2), json_bytes=raw),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=500)
+    parser.add_argument("--days", type=int, default=2500, help="history per symbol, sets the number of quarters")
+    parser.add_argument("--lookback", type=int, default=200, help="screen this many days before the last bar")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print_report(result)
+    storage = result["storage"]
+    print(f"storage: {storage['rows']} rows, {storage['bytes'] / 1024 ** 2:.1f} MB "
+          f"({storage['bytes_per_row']} bytes/row), json {storage['json_bytes'] / 1024 ** 2:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+per-code get_data loop, compiled statement cache vs. building and compiling
+an ORM query on every call (the previous get_data)
+
+    python -m benchmarks.bench_get_data --codes 8000 --days 20
+"""
+import argparse
+
+from benchmarks.common import Timer, synthetic_bars, synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import pandas as pd  # noqa: E402
+
+from context import tg_context  # noqa: E402
+from domain.eod.eod_us_stock_1d_kdata import EodUSStock1dKdata, EodUSStockKdataBase  # noqa: E402
+from querier import build_statement, compile_query  # noqa: E402
+
+
+def orm_get_data(schema, code):
+    session = tg_context._schema_get_session(schema)
+    query = session.query(schema).filter(schema.code == code).order_by(schema.timestamp.asc())
+    return pd.read_sql(query.statement, query.session.bind)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=20)
+    args = parser.parse_args()
+
+    schema = EodUSStock1dKdata
+    tg_context.register_schema("eod", EodUSStockKdataBase)
+    codes = synthetic_codes(args.codes)
+    tg_context.save(synthetic_bars(codes, args.days), schema, sub_size=100_000)
+
+    with Timer() as orm:
+        for code in codes:
+            orm_get_data(schema, code)
+
+    build_statement.cache_clear()
+    compile_query.cache_clear()
+    with Timer() as cached:
+        for code in codes:
+            tg_context.get_data(schema, code=code)
+
+    print(f"codes={args.codes} days={args.days}")
+    print(f"orm query per call:       {orm.elapsed:8.3f}s  {orm.elapsed / len(codes) * 1e6:8.1f}us/code")
+    print(f"cached compiled query:    {cached.elapsed:8.3f}s  {cached.elapsed / len(codes) * 1e6:8.1f}us/code")
+    print(f"speedup:                  {orm.elapsed / cached.elapsed:8.2f}x")
+    print(f"statement cache:          {build_statement.cache_info()}")
+    print(f"compiled cache:           {compile_query.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+end-to-end ingest against a local EOD stub: EODRequester -> handler chain ->
+Context.save -> get_data, with throughput, latency percentiles and peak RSS
+per stage, compared with a stored baseline
+
+    python -m benchmarks.bench_ingest --codes 200 --days 1000
+    python -m benchmarks.bench_ingest --save-baseline
+
+baselines are machine specific, save one on the box the comparison runs on
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.common import synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from api.eod.base import EODRequester  # noqa: E402
+from benchmarks.stub_server import StubServer  # noqa: E402
+from context import tg_context  # noqa: E402
+from core.handler import AbstractHandler, DfAdder, DfDropDuplicated, DfRenamer  # noqa: E402
+from core.http_cache import ResponseCache  # noqa: E402
+from domain.eod.eod_us_stock_1d_kdata import EodUSStock1dKdata, EodUSStockKdataBase  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "bench_ingest.json")
+RENAME_MAP = {
+    "Date": "timestamp",
+    "Open": "open",
+    "High": "high",
+    "Low": "low",
+    "Close": "close",
+    "Adjusted_close": "adjusted_close",
+    "Volume": "volume",
+}
+# (metric, True when higher is better)
+COMPARED = (("throughput", True), ("p50_ms", False), ("p99_ms", False), ("rss_growth_mb", False))
+# absolute slack on top of the tolerance, sub-ms latencies and a few MB of RSS are noise
+SLACK = {"p50_ms": 1.0, "p99_ms": 2.0, "rss_growth_mb": 16.0}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class Stage:
+    """
+    latencies of one stage, `items` is what throughput is counted in
+    """
+
+    def __init__(self, name: str, unit: str = "rows"):
+        self.name = name
+        self.unit = unit
+        self.latencies = []
+        self.items = 0
+
+    def __enter__(self):
+        self._rss = _peak_rss_mb()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self._start
+        self.peak_rss = _peak_rss_mb()
+        self.rss_growth = self.peak_rss - self._rss
+
+    def timed(self, fun, *args, **kwargs):
+        start = time.perf_counter()
+        result = fun(*args, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def report(self) -> dict:
+        latencies = np.asarray(self.latencies) * 1e3
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+        return dict(
+            calls=len(self.latencies),
+            items=self.items,
+            unit=self.unit,
+            seconds=round(self.elapsed, 4),
+            throughput=round(self.items / self.elapsed, 1) if self.elapsed else 0.0,
+            p50_ms=round(float(p50), 3),
+            p90_ms=round(float(p90), 3),
+            p99_ms=round(float(p99), 3),
+            peak_rss_mb=round(self.peak_rss, 1),
+            rss_growth_mb=round(self.rss_growth, 1),
+        )
+
+
+class IndexResetter(AbstractHandler):
+    def handle(self, data):
+        return super().handle(data.reset_index())
+
+
+class IdMaker(AbstractHandler):
+    def handle(self, data):
+        data["id"] = data["code"] + "_" + data["timestamp"].dt.strftime("%Y-%m-%d")
+        return super().handle(data)
+
+
+def kdata_chain(code: str, exchange: str = "US") -> AbstractHandler:
+    head = IndexResetter()
+    head.set_next(DfRenamer(RENAME_MAP)) \
+        .set_next(DfAdder({"code": code, "exchange": exchange})) \
+        .set_next(IdMaker()) \
+        .set_next(DfDropDuplicated(["id"]))
+    return head
+
+
+def run(args) -> dict:
+    codes = synthetic_codes(args.codes)
+    schema = EodUSStock1dKdata
+    tg_context.register_schema("eod", EodUSStockKdataBase)
+    start = "2015-01-01"
+    end = pd.bdate_range(start, periods=args.days)[-1].strftime("%Y-%m-%d")
+    stages = []
+
+    with StubServer(codes, args.days, start=start, latency=args.latency) as server:
+        requester = EODRequester()
+        requester.base_url = server.url
+        requester.cache = None
+
+        with Stage("fetch") as fetch:
+            raw = dict()
+            for code in codes:
+                raw[code] = fetch.timed(requester.eod_get_historical_data, code, "US", start, end, "d")
+                fetch.items += len(raw[code])
+        stages.append(fetch)
+
+        requester.cache = ResponseCache(os.path.join(tempfile.mkdtemp(), "bench_cache.sqlite"))
+        with Stage("fetch_store") as store:
+            for code in codes:
+                store.items += len(store.timed(requester.eod_get_historical_data, code, "US", start, end, "d"))
+        stages.append(store)
+        with Stage("fetch_cached") as cached:
+            for code in codes:
+                cached.items += len(cached.timed(requester.eod_get_historical_data, code, "US", start, end, "d"))
+        stages.append(cached)
+        requester.cache.close()
+
+    with Stage("handle") as handle:
+        frames = []
+        for code in codes:
+            df = handle.timed(kdata_chain(code).handle, raw[code])
+            handle.items += len(df)
+            frames.append(df)
+    stages.append(handle)
+    del raw
+
+    with Stage("save") as save:
+        for i in range(0, len(frames), args.batch):
+            batch = pd.concat(frames[i: i + args.batch], ignore_index=True)
+            save.timed(tg_context.save, batch, schema, sub_size=100_000)
+            save.items += len(batch)
+        save.timed(tg_context.flush)
+    stages.append(save)
+    del frames
+
+    with Stage("get_data") as read:
+        for code in codes:
+            read.items += len(read.timed(tg_context.get_data, schema, code=code))
+    stages.append(read)
+
+    with Stage("get_data_domain") as domain:
+        for code in codes:
+            domain.items += len(domain.timed(tg_context.get_data, schema, code=code, return_type="domain"))
+    stages.append(domain)
+
+    return dict(
+        params=dict(codes=args.codes, days=args.days, latency=args.latency, batch=args.batch),
+        stages={stage.name: stage.report() for stage in stages},
+    )
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """
+        Returns (stage, metric, baseline, current) of every metric worse than tolerance allows
+    """
+    regressions = []
+    for name, current in result["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            old, new = base[metric], current[metric]
+            if higher_is_better:
+                worse = new < old * (1 - tolerance)
+            else:
+                worse = new > old * (1 + tolerance) + SLACK.get(metric, 0.0)
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def print_report(result: dict):
+    print(f"params: {result['params']}")
+    print(f"{'stage':<16}{'calls':>7}{'items':>10}{'sec':>9}{'items/s':>12}"
+          f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'rss MB':>9}{'+MB':>7}")
+    for name, r in result["stages"].items():
+        print(f"{name:<16}{r['calls']:>7}{r['items']:>10}{r['seconds']:>9.3f}{r['throughput']:>12.1f}"
+              f"{r['p50_ms']:>9.3f}{r['p90_ms']:>9.3f}{r['p99_ms']:>9.3f}"
+              f"{r['peak_rss_mb']:>9.1f}{r['rss_growth_mb']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stub sleeps per request")
+    parser.add_argument("--batch", type=int, default=50, help="symbols per Context.save call")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--json", help="also write the result to this path")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("no baseline, run with --save-baseline first")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["params"] != result["params"]:
+        print(f"baseline was taken with {baseline['params']}, not compared")
+        return
+    regressions = compare(result, baseline, args.tolerance)
+    for name, metric, old, new in regressions:
+        print(f"REGRESSION {name}.{metric}: {old} -> {new}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+intraday ingest and reads at 1m against a local EOD stub: the recorder's
+windowed, per symbol parallel fetch into the day partitioned store, a
+rewrite read back across parts and compacted, then whole day and single
+symbol range reads, and the bytes per bar on disk.
+Runs with the host timezone set to --tz, naive bounds are UTC all the same
+
+    python -m benchmarks.bench_intraday --codes 500 --days 5 --tz Asia/Shanghai
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.common import synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import pandas as pd  # noqa: E402
+
+from api.eod.base import EODRequester, intraday_bounds  # noqa: E402
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+from benchmarks.stub_server import StubServer  # noqa: E402
+from intraday_store import IntradayStore  # noqa: E402
+from recorders.eod.eod_us_stock.eod_us_stock_intraday_kdata import EodUSStockIntradayRecorder  # noqa: E402
+
+
+def run(args) -> dict:
+    codes = synthetic_codes(args.codes)
+    days = pd.bdate_range(args.start, periods=args.days)
+    start, end = days[0], days[-1] + pd.Timedelta(hours=23, minutes=59)
+    stages = []
+
+    with StubServer(codes, 1, latency=args.latency) as server:
+        requester = EODRequester()
+        requester.base_url = server.url
+        requester.cache = None
+        # warm the stub's per day renders, the server side cost is not ours
+        for code in codes:
+            server.intraday_csv(code, {"interval": args.interval, "from": int(start.timestamp()),
+                                       "to": int(end.timestamp())})
+
+        bounds = (int(start.tz_localize("UTC").timestamp()), int(end.tz_localize("UTC").timestamp()))
+        assert intraday_bounds(start, end) == bounds, f"bounds {intraday_bounds(start, end)} not UTC {bounds}"
+        served = server.intraday_csv(codes[0], {"interval": args.interval, "from": bounds[0], "to": bounds[1]})
+        fetched = requester.eod_get_intraday_data(codes[0], "US", start, end, args.interval)
+        assert len(fetched) == served.count("\n") - 1, f"fetched {len(fetched)} bars of {served.count(chr(10)) - 1}"
+
+        with Stage("fetch") as fetch:
+            for code in codes:
+                fetch.items += len(fetch.timed(requester.eod_get_intraday_data, code, "US", start, end, args.interval))
+        stages.append(fetch)
+
+        store = IntradayStore(args.interval)
+        recorder = EodUSStockIntradayRecorder(args.interval, requester, store, workers=args.workers)
+        with Stage("ingest") as ingest:
+            ingest.items = ingest.timed(recorder.run, codes, start, end, batch_size=args.batch)
+        stages.append(ingest)
+
+    with Stage("rewrite") as rewrite:
+        # the same bars again as new parts, the path of a refetched day
+        bars = store.read()
+        rewrite.items = rewrite.timed(store.write, bars)
+    stages.append(rewrite)
+    rows = len(bars)
+    del bars
+
+    with Stage("read_uncompacted") as uncompacted:
+        for day in days:
+            uncompacted.items += len(uncompacted.timed(store.read, None, day, day + pd.Timedelta(hours=23, minutes=59)))
+    stages.append(uncompacted)
+    assert uncompacted.items == rows, f"read {uncompacted.items} of {rows} bars across parts"
+
+    with Stage("compact") as compact:
+        compact.items = compact.timed(store.compact)
+    compact.unit = "days"
+    stages.append(compact)
+
+    with Stage("read_day") as read_day:
+        for day in days:
+            read_day.items += len(read_day.timed(store.read, None, day, day + pd.Timedelta(hours=23, minutes=59)))
+    stages.append(read_day)
+
+    with Stage("read_symbol") as read_symbol:
+        for code in codes[:args.symbol_reads]:
+            read_symbol.items += len(read_symbol.timed(store.read, [code], start, end))
+    stages.append(read_symbol)
+
+    disk = sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(store.root) for name in names)
+    return dict(
+        params=dict(codes=args.codes, days=args.days, interval=args.interval, tz=args.tz,
+                    latency=args.latency, batch=args.batch, workers=args.workers),
+        stages={stage.name: stage.report() for stage in stages},
+        storage=dict(rows=rows, bytes=disk, bytes_per_row=round(disk / rows, 2) if rows else 0.0),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=500)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--start", default="2024-01-02")
+    parser.add_argument("--interval", choices=["1m", "5m", "1h"], default="1m")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stub sleeps per request")
+    parser.add_argument("--batch", type=int, default=100, help="symbols per store write")
+    parser.add_argument("--workers", type=int, default=16, help="symbols fetched in parallel")
+    parser.add_argument("--symbol-reads", type=int, default=50)
+    parser.add_argument("--tz", default="Asia/Shanghai", help="host timezone to run under")
+    parser.add_argument("--json", help="also write the result to this path")
+    args = parser.parse_args()
+    os.environ["TZ"] = args.tz
+    time.tzset()
+
+    result = run(args)
+    print_report(result)
+    storage = result["storage"]
+    print(f"storage: {storage['rows']} rows, {storage['bytes'] / 1024 ** 2:.1f} MB, "
+          f"{storage['bytes_per_row']} bytes/row")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+phase lookups of the market clock over arrays of intraday timestamps next
+to working out the phase of each timestamp from its local time, and the
+polls a day of following the market takes with and without the clock
+
+    python -m benchmarks.bench_market_clock --stamps 1000000
+"""
+import argparse
+import json
+
+from benchmarks.common import use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+from market_clock import ACTIVE_PHASES, SESSIONS, MarketClock  # noqa: E402
+
+
+def naive_phase(clock: MarketClock, days: set, ts: int) -> str:
+    """
+        Returns the phase of epoch seconds ts from its local date and time
+    """
+    local = pd.Timestamp(ts, unit="s", tz="UTC").tz_convert(clock.tz)
+    if np.datetime64(local.date(), "D") not in days:
+        return "closed"
+    minute = local.hour * 60 + local.minute
+    phase = "closed"
+    for start, name in SESSIONS[clock.market]["phases"]:
+        hours, minutes = start.split(":")
+        if minute >= int(hours) * 60 + int(minutes):
+            phase = name
+    return phase
+
+
+def run(args) -> dict:
+    stages = []
+    with Stage("build") as build:
+        clock = build.timed(MarketClock, args.exchange)
+        build.items = len(clock.bounds)
+    build.unit = "bounds"
+    stages.append(build)
+    days = set(clock.days)
+
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2020-01-01", tz="UTC").timestamp()
+    stamps = (start + rng.integers(0, 4 * 365 * 86400, args.stamps)).astype(np.int64)
+
+    with Stage("state") as state:
+        for _ in range(args.repeat):
+            table = state.timed(clock.state, stamps)
+            state.items += len(table)
+    state.unit = "stamps"
+    stages.append(state)
+
+    with Stage("phase") as phase:
+        for _ in range(args.repeat):
+            phases = phase.timed(clock.phase, stamps)
+            phase.items += len(phases)
+    phase.unit = "stamps"
+    stages.append(phase)
+
+    sample = stamps[:args.naive]
+    with Stage("phase_naive") as naive:
+        slow = [naive.timed(naive_phase, clock, days, int(ts)) for ts in sample]
+        naive.items = len(slow)
+    naive.unit = "stamps"
+    stages.append(naive)
+    assert (phases[:args.naive] == np.array(slow, dtype=object)).all(), "phases differ"
+
+    # one week of following at one poll a minute: wake-ups with and without the clock
+    week = np.arange(start, start + 7 * 86400, 60).astype(np.int64)
+    active = clock.is_active(week, ACTIVE_PHASES)
+    polls = int(active.sum()) + int(np.count_nonzero(np.diff(active.astype(np.int8)) == 1))
+
+    return dict(
+        params=dict(exchange=args.exchange, stamps=args.stamps, trading_days=len(clock.days),
+                    week_polls_continuous=len(week), week_polls_clock=polls),
+        stages={stage.name: stage.report() for stage in stages},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exchange", default="US")
+    parser.add_argument("--stamps", type=int, default=1_000_000)
+    parser.add_argument("--naive", type=int, default=5_000, help="timestamps the per stamp lookup is timed on")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+return_type="dict"/"domain" pulls, cursor rows vs. ORM instances
+
+    python -m benchmarks.bench_rows --codes 500 --days 2000
+"""
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks.common import Timer, synthetic_bars, synthetic_codes, use_temp_home
+
+use_temp_home()
+
+from context import tg_context  # noqa: E402
+from domain.eod.eod_us_stock_1d_kdata import EodUSStock1dKdata, EodUSStockKdataBase  # noqa: E402
+
+
+def orm_dicts(schema):
+    session = tg_context._schema_get_session(schema)
+    rows = [item.__dict__ for item in session.query(schema).order_by(schema.timestamp.asc()).all()]
+    session.expunge_all()
+    return rows
+
+
+def measure(name, fun):
+    gc.collect()
+    tracemalloc.start()
+    with Timer() as timer:
+        rows = fun()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<24}{len(rows):>10} rows {timer.elapsed:8.3f}s"
+        f"  held {held / 2**20:8.1f}MB  peak {peak / 2**20:8.1f}MB"
+    )
+    del rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--days", type=int, default=1000)
+    args = parser.parse_args()
+
+    schema = EodUSStock1dKdata
+    tg_context.register_schema("eod", EodUSStockKdataBase)
+    tg_context.save(synthetic_bars(synthetic_codes(args.codes), args.days), schema, sub_size=100_000)
+
+    measure("orm instances", lambda: orm_dicts(schema))
+    measure("dict", lambda: tg_context.get_data(schema, return_type="dict"))
+    measure("domain (Bar)", lambda: tg_context.get_data(schema, return_type="domain"))
+
+
+if __name__ == "__main__":
+    main()
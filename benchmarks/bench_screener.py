@@ -0,0 +1,129 @@
+"""
+screens over the materialized cross section next to pulling the window
+with get_data and screening code by code in pandas; plus building the
+cross section, loading its snapshot, a nightly save in many small batches
+and the one snapshot write that ends it
+
+    python -m benchmarks.bench_screener --codes 3000 --days 120
+"""
+import argparse
+import json
+import os
+
+from benchmarks.common import synthetic_bars, synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+from context import tg_context  # noqa: E402
+from domain.eod.eod_us_stock_1d_kdata import EodUSStock1dKdata, EodUSStockKdataBase  # noqa: E402
+from screener import cross_section_cache, screen  # noqa: E402
+
+SCREENS = [
+    "close > ma(close, 20) and volume > 1e6",
+    "ret(close, 5) > 0.05 & rank(volume) > 0.8",
+    "close > max(ref(high, 1), 20) and std(ret(close), 20) < 0.03",
+]
+
+
+def naive_screen(schema, days: int) -> pd.Index:
+    """
+        Returns the codes passing SCREENS[0] the way it is done without the cache
+    """
+    latest = tg_context.get_data(schema, columns=["timestamp"], order="-timestamp", limit=1)["timestamp"].iloc[0]
+    start = (pd.Timestamp(latest) - pd.offsets.BDay(days)).strftime("%Y-%m-%d")
+    df = tg_context.get_data(schema, start=start, columns=["code", "timestamp", "close", "volume"])
+    passed = []
+    for code, bars in df.groupby("code"):
+        last = bars.iloc[-1]
+        if last["timestamp"] == latest and last["close"] > bars["close"].tail(20).mean() and last["volume"] > 1e6:
+            passed.append(code)
+    return pd.Index(passed)
+
+
+def run(args) -> dict:
+    schema = EodUSStock1dKdata
+    tg_context.register_schema("eod", EodUSStockKdataBase)
+    codes = synthetic_codes(args.codes)
+    bars = synthetic_bars(codes, args.days + 1)
+    last_day = bars["timestamp"].max()
+    tg_context.save(bars[bars["timestamp"] < last_day], schema, sub_size=100_000)
+    stages = []
+
+    cache = cross_section_cache
+    cache.days = args.window
+    with Stage("build") as build:
+        section = build.timed(cache.get, schema)
+        build.items = section.values["close"].size
+    build.unit = "cells"
+    stages.append(build)
+
+    with Stage("load") as load:
+        for _ in range(args.repeat):
+            cache._sections.clear()
+            load.items += load.timed(cache.get, schema).values["close"].size
+    load.unit = "cells"
+    stages.append(load)
+
+    # the nightly save of one more day in small batches, Context.save buffers it for the cross section
+    night = bars[bars["timestamp"] == last_day]
+    with Stage("nightly_save") as nightly:
+        for i in range(0, len(night), args.save_batch):
+            batch = night.iloc[i:i + args.save_batch]
+            nightly.timed(tg_context.save, batch, schema, sub_size=100_000)
+            nightly.items += len(batch)
+    stages.append(nightly)
+    snapshot = os.path.getmtime(cache.path(schema.__tablename__))
+
+    with Stage("flush") as flush:
+        flush.items = flush.timed(tg_context.flush)
+    flush.unit = "snapshots"
+    stages.append(flush)
+    assert flush.items == 1, "snapshot not written once"
+    assert os.path.getmtime(cache.path(schema.__tablename__)) != snapshot, "snapshot unchanged"
+    cache._sections.clear()
+    assert cache.get(schema).dates[-1] == np.datetime64(last_day.date(), "D"), "cross section not updated"
+
+    for i, expr in enumerate(SCREENS):
+        with Stage(f"screen_{i}") as timed:
+            for _ in range(args.repeat):
+                timed.items += len(timed.timed(screen, expr, schema, cache=cache))
+        timed.unit = "codes"
+        stages.append(timed)
+
+    with Stage("screen_naive") as naive:
+        for _ in range(max(1, args.repeat // 5)):
+            passed = naive.timed(naive_screen, schema, args.window)
+            naive.items += len(passed)
+    naive.unit = "codes"
+    stages.append(naive)
+    fast = screen(SCREENS[0], schema, cache=cache).index
+    assert set(fast) == set(passed), f"screens differ: {len(fast)} vs {len(passed)}"
+
+    return dict(
+        params=dict(codes=args.codes, days=args.days, window=args.window, passed=len(passed)),
+        stages={stage.name: stage.report() for stage in stages},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=3000)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--window", type=int, default=60, help="trade days in the cross section")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--save-batch", type=int, default=50, help="bars per Context.save of the nightly day")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+a backtest parameter sweep through SweepRunner: in process, in a pool that
+pickles the panels into every task, in a pool attached to shared memory
+streaming into the results table, and a rerun of the stored run
+
+    python -m benchmarks.bench_sweep --codes 200 --days 250 --processes 4
+"""
+import argparse
+import json
+import os
+from functools import partial
+from multiprocessing import Pool
+
+from benchmarks.common import synthetic_bars, synthetic_codes, use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+
+from backtester import _sweep_one, panels_from_bars, param_grid, sweep  # noqa: E402
+from benchmarks.bench_backtest import ma_cross  # noqa: E402
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+from core.processor import SweepResults  # noqa: E402
+
+OPTIONS = dict(cash=10_000_000.0, position_size=50_000.0)
+
+
+def _pickled_one(task) -> dict:
+    arrays, param = task
+    return _sweep_one(ma_cross, OPTIONS, arrays, param)
+
+
+def pickled_sweep(panels, grid, processes: int) -> list:
+    """
+        Returns the stats of every task with the panels sent along with each one
+    """
+    with Pool(processes) as pool:
+        return pool.map(_pickled_one, [(panels, param) for param in grid])
+
+
+def run(args) -> dict:
+    codes = synthetic_codes(args.codes)
+    panels = {field: frame.to_numpy() for field, frame in panels_from_bars(synthetic_bars(codes, args.days)).items()}
+    grid = param_grid(fast=range(2, 2 + args.fast), slow=range(20, 20 + 5 * args.slow, 5),
+                      stop_loss=[0.05, 0.1], take_profit=[0.1, 0.2])
+    results = SweepResults(os.path.join(os.environ["TIGER_QUANT_HOME"], "data", "bench_sweeps.sqlite"))
+    stages = []
+
+    with Stage("serial") as serial:
+        table = serial.timed(sweep, ma_cross, panels, grid, processes=1, **OPTIONS)
+        serial.items = len(table)
+    stages.append(serial)
+
+    with Stage("pool_pickled") as pickled:
+        rows = pickled.timed(pickled_sweep, panels, grid, args.processes)
+        pickled.items = len(rows)
+    stages.append(pickled)
+
+    with Stage("pool_shared") as shared:
+        streamed = shared.timed(sweep, ma_cross, panels, grid, processes=args.processes, run="bench",
+                                results=results, **OPTIONS)
+        shared.items = len(streamed)
+    stages.append(shared)
+
+    with Stage("rerun_stored") as rerun:
+        again = rerun.timed(sweep, ma_cross, panels, grid, processes=args.processes, run="bench",
+                            results=results, **OPTIONS)
+        rerun.items = len(grid)
+    stages.append(rerun)
+
+    stored = results.read("bench")
+    for stage in stages:
+        stage.unit = "runs"
+    assert np.allclose(table["total_return"], streamed["total_return"]), "sweeps differ"
+    assert np.allclose(table["total_return"], [row["total_return"] for row in rows]), "pickled sweep differs"
+    assert np.allclose(table["total_return"], stored["total_return"]), "stored results differ"
+    assert np.allclose(table["total_return"], again["total_return"]), "rerun does not return the stored tasks"
+
+    return dict(
+        params=dict(codes=args.codes, days=args.days, combos=len(grid), processes=args.processes,
+                    cpus=os.cpu_count(), panel_mb=round(sum(p.nbytes for p in panels.values()) / 2 ** 20, 1)),
+        stages={stage.name: stage.report() for stage in stages},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--fast", type=int, default=5, help="fast windows in the grid")
+    parser.add_argument("--slow", type=int, default=4, help="slow windows in the grid")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+tick segment store: appends in small live batches, day reads before and
+after compaction, and bytes per tick, per codec
+
+    python -m benchmarks.bench_ticks --codes 20 --days 3 --ticks 200000
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks.common import use_temp_home
+
+use_temp_home()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.bench_ingest import Stage, print_report  # noqa: E402
+from benchmarks.common import synthetic_codes  # noqa: E402
+from core.compress import DEFAULT_CODEC  # noqa: E402
+from tick_store import TickStore  # noqa: E402
+
+
+def synthetic_ticks(days: pd.DatetimeIndex, ticks: int, seed: int = 0) -> pd.DataFrame:
+    """
+        Returns `ticks` ticks per day over the regular us session, in arrival order
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for day in days:
+        open_ns = (day + pd.Timedelta(hours=14, minutes=30)).value
+        ts = open_ns + np.sort(rng.integers(0, int(6.5 * 3600 * 1e9), ticks))
+        frames.append(pd.DataFrame({
+            "ts": ts,
+            "price": np.round(100 * np.exp(np.cumsum(rng.normal(0, 1e-4, ticks))), 2),
+            "size": rng.integers(1, 500, ticks),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _disk_bytes(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def run(args, codec: str) -> dict:
+    codes = synthetic_codes(args.codes)
+    days = pd.bdate_range(args.start, periods=args.days)
+    ticks = synthetic_ticks(days, args.ticks)
+    store = TickStore(root=tempfile.mkdtemp(prefix=f"ticks_{codec}_"), codec=codec)
+    stages = []
+
+    with Stage("append") as append:
+        for code in codes:
+            for batch in np.array_split(np.arange(len(ticks)), args.batches * args.days):
+                append.items += append.timed(store.append, code, ticks.iloc[batch])
+    stages.append(append)
+
+    with Stage("read_day_segs") as segmented:
+        for code in codes:
+            for day in days:
+                segmented.items += len(segmented.timed(store.read_day, code, day)["ts"])
+    stages.append(segmented)
+
+    with Stage("compact") as compact:
+        compact.items = compact.timed(store.compact)
+    compact.unit = "days"
+    stages.append(compact)
+
+    with Stage("read_day") as read_day:
+        for code in codes:
+            for day in days:
+                read_day.items += len(read_day.timed(store.read_day, code, day)["ts"])
+    stages.append(read_day)
+
+    with Stage("read_range") as read_range:
+        for code in codes:
+            read_range.items += len(read_range.timed(store.read, code, days[0], days[-1] + pd.Timedelta(days=1)))
+    stages.append(read_range)
+
+    rows = len(ticks) * len(codes)
+    disk = _disk_bytes(store.root)
+    return dict(
+        params=dict(codec=codec, codes=args.codes, days=args.days, ticks=args.ticks, batches=args.batches),
+        stages={stage.name: stage.report() for stage in stages},
+        storage=dict(rows=rows, bytes=disk, bytes_per_row=round(disk / rows, 2)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=20)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--ticks", type=int, default=200_000, help="ticks per symbol and day")
+    parser.add_argument("--batches", type=int, default=20, help="appends (segments) per symbol and day")
+    parser.add_argument("--start", default="2024-01-02")
+    parser.add_argument("--codecs", nargs="+", default=sorted({"none", DEFAULT_CODEC}))
+    args = parser.parse_args()
+
+    for codec in args.codecs:
+        result = run(args, codec)
+        print_report(result)
+        storage = result["storage"]
+        print(f"storage: {storage['rows']} ticks, {storage['bytes'] / 1024 ** 2:.1f} MB, "
+              f"{storage['bytes_per_row']} bytes/tick\n")
+
+
+if __name__ == "__main__":
+    main()
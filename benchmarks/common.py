@@ -0,0 +1,56 @@
+"""
+helpers shared by the benchmark scripts, run them from the repo root:
+
+    python -m benchmarks.bench_get_data
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def use_temp_home(prefix: str = "tiger_quant_bench_") -> str:
+    """
+    point conf.HOME_PATH at a scratch directory, call before importing conf
+    """
+    home = os.environ.get("TIGER_QUANT_HOME") or tempfile.mkdtemp(prefix=prefix)
+    os.environ["TIGER_QUANT_HOME"] = home
+    os.makedirs(os.path.join(home, "data"), exist_ok=True)
+    return home
+
+
+def synthetic_codes(n: int) -> list:
+    return [f"S{i:05d}" for i in range(n)]
+
+
+def synthetic_bars(codes: list, days: int, start: str = "2015-01-01", seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    timestamps = pd.bdate_range(start, periods=days)
+    n = len(codes) * days
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (len(codes), days)), axis=1)).ravel()
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    df = pd.DataFrame({
+        "code": np.repeat(codes, days),
+        "exchange": "US",
+        "timestamp": np.tile(timestamps.to_numpy(), len(codes)),
+        "open": close + rng.normal(0, 0.005, n) * close,
+        "high": close + spread,
+        "low": close - spread,
+        "close": close,
+        "adjusted_close": close,
+        "volume": rng.integers(1_000, 5_000_000, n).astype(float),
+    })
+    df["open"] = df["open"].clip(df["low"], df["high"])
+    df["id"] = df["code"] + "_" + df["timestamp"].dt.strftime("%Y-%m-%d")
+    return df
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,288 @@
+"""
+local stand-in for the EOD api, serves deterministic synthetic data so the
+ingest path can be benchmarked without the network:
+
+    /api/eod/{SYMBOL}.{EX}?from=&to=       daily bars csv
+    /api/div/{SYMBOL}.{EX}                 dividends csv
+    /api/splits/{SYMBOL}.{EX}              splits csv
+    /api/fundamentals/{SYMBOL}.{EX}        json
+    /api/fundamentals/{INDEX}.INDX         json, historical constituents of an index over the codes
+    /api/intraday/{SYMBOL}.{EX}?interval=&from=&to=   intraday bars csv (unix seconds)
+
+    with StubServer(synthetic_codes(100), days=500) as server:
+        requester.base_url = server.url
+"""
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import synthetic_bars
+
+CSV_HEADER = "Date,Open,High,Low,Close,Adjusted_close,Volume\n"
+INTRADAY_HEADER = "Timestamp,Gmtoffset,Datetime,Open,High,Low,Close,Volume\n"
+INTRADAY_STEP = {"1m": 60, "5m": 300, "1h": 3600}
+# regular us session in utc seconds of day, 14:30 - 21:00
+SESSION = (14 * 3600 + 1800, 21 * 3600)
+# line items per statement, values come back as strings like the real api
+STATEMENT_FIELDS = {
+    "Income_Statement": ["totalRevenue", "costOfRevenue", "grossProfit", "operatingIncome", "netIncome",
+                         "ebit", "ebitda", "researchDevelopment", "incomeTaxExpense", "interestExpense"],
+    "Balance_Sheet": ["totalAssets", "totalLiab", "totalStockholderEquity", "cash", "netDebt",
+                      "inventory", "netReceivables", "longTermDebt", "commonStockSharesOutstanding", "goodWill"],
+    "Cash_Flow": ["totalCashFromOperatingActivities", "capitalExpenditures", "freeCashFlow", "dividendsPaid",
+                  "depreciation", "changeInWorkingCapital", "issuanceOfCapitalStock", "netBorrowings",
+                  # EOD repeats some line items across statements
+                  "netIncome"],
+}
+
+
+def intraday_day_lines(code: str, day: int, step: int) -> list:
+    """
+        Returns the csv lines of one symbol's session bars on a utc day (days since epoch)
+    """
+    if (day + 3) % 7 >= 5:
+        # 1970-01-01 was a thursday
+        return []
+    ts = day * 86400 + np.arange(SESSION[0], SESSION[1], step)
+    rng = np.random.default_rng([day, zlib.crc32(code.encode())])
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.001, len(ts))))
+    spread = np.abs(rng.normal(0, 0.0005, len(ts))) * close
+    open_ = np.clip(close + rng.normal(0, 0.0003, len(ts)) * close, close - spread, close + spread)
+    frame = pd.DataFrame({
+        "Timestamp": ts,
+        "Gmtoffset": 0,
+        "Datetime": pd.to_datetime(ts, unit="s").strftime("%Y-%m-%d %H:%M:%S"),
+        "Open": open_.round(4),
+        "High": (close + spread).round(4),
+        "Low": (close - spread).round(4),
+        "Close": close.round(4),
+        "Volume": rng.integers(100, 50_000, len(ts)),
+    })
+    return frame.to_csv(index=False, header=False).splitlines(keepends=True)
+
+
+def fundamentals_doc(code: str, dates) -> dict:
+    """
+        Returns an EOD shaped fundamentals document with quarterly and yearly statements over dates
+    """
+    rng = np.random.default_rng(zlib.crc32(code.encode()))
+    first, last = (pd.Timestamp(str(dates[0])), pd.Timestamp(str(dates[-1]))) if len(dates) else (None, None)
+    quarters = pd.date_range(first, last, freq="QE") if first is not None else []
+    scale = {key: rng.uniform(1e8, 1e10, len(fields)) for key, fields in STATEMENT_FIELDS.items()}
+    financials = {}
+    for key, fields in STATEMENT_FIELDS.items():
+        financials[key] = {"currency_symbol": "USD", "quarterly": {}, "yearly": {}}
+        for i, period in enumerate(quarters):
+            growth = 1.02 ** i * rng.normal(1, 0.05, len(fields))
+            row = {"date": period.strftime("%Y-%m-%d"),
+                   "filing_date": (period + pd.Timedelta(days=int(rng.integers(25, 45)))).strftime("%Y-%m-%d"),
+                   "currency_symbol": "USD"}
+            row.update({field: f"{value:.2f}" for field, value in zip(fields, scale[key] * growth)})
+            # the real api leaves items out as null
+            row[fields[-1]] = None if i % 5 == 0 else row[fields[-1]]
+            financials[key]["quarterly"][row["date"]] = row
+            if period.month == 12:
+                yearly = dict(row, filing_date=(period + pd.Timedelta(days=60)).strftime("%Y-%m-%d"))
+                financials[key]["yearly"][row["date"]] = yearly
+    return {
+        "General": {"Code": code, "Exchange": "US", "Name": f"{code} Corp", "Sector": "Technology"},
+        "Highlights": {"MarketCapitalization": float(rng.uniform(1e9, 1e12)), "PERatio": float(rng.uniform(5, 60)),
+                       "DividendYield": float(rng.uniform(0, 0.05)), "EPS": float(rng.uniform(-2, 20)),
+                       "MostRecentQuarter": last.strftime("%Y-%m-%d") if last is not None else None},
+        "SharesStats": {"SharesOutstanding": 1_000_000},
+        "Financials": financials,
+    }
+
+
+def index_components(codes: list, start: str, end: str, size: int, churn: float = 0.04,
+                     seed: int = 0) -> dict:
+    """
+    Returns EOD shaped HistoricalTickerComponents: `size` members drawn from
+    codes, `churn` of them swapped at every quarterly rebalance
+    """
+    rng = np.random.default_rng(seed)
+    size = min(size, len(codes))
+    rebalances = pd.date_range(start, end, freq="QS")
+    members = dict.fromkeys(rng.choice(codes, size, replace=False), None)
+    since = dict.fromkeys(members, pd.Timestamp(start))
+    rows = []
+    for day in rebalances[1:]:
+        out = rng.choice(list(members), int(size * churn), replace=False)
+        pool = [code for code in codes if code not in members]
+        incoming = rng.choice(pool, min(len(out), len(pool)), replace=False)
+        for code in out:
+            rows.append((code, since.pop(code), day))
+            del members[code]
+        for code in incoming:
+            members[code], since[code] = None, day
+    rows += [(code, since[code], None) for code in members]
+    return {
+        str(i): {"Code": code, "Exchange": "US", "StartDate": s.strftime("%Y-%m-%d"),
+                 "EndDate": e.strftime("%Y-%m-%d") if e is not None else None,
+                 "IsActiveNow": int(e is None), "IsDelisted": 0}
+        for i, (code, s, e) in enumerate(rows)
+    }
+
+
+class SymbolData:
+    """
+    pre-rendered csv lines of one symbol, sliced by date per request
+    """
+    __slots__ = ("dates", "lines", "dividends", "splits", "fundamentals")
+
+    def __init__(self, code: str, df: pd.DataFrame):
+        dates = df["timestamp"].dt.strftime("%Y-%m-%d").to_numpy(dtype=str)
+        frame = pd.DataFrame({
+            "Date": dates,
+            "Open": df["open"].round(4),
+            "High": df["high"].round(4),
+            "Low": df["low"].round(4),
+            "Close": df["close"].round(4),
+            "Adjusted_close": df["adjusted_close"].round(4),
+            "Volume": df["volume"].astype(np.int64),
+        })
+        self.dates = dates
+        self.lines = frame.to_csv(index=False, header=False).splitlines(keepends=True)
+        # a dividend every ~quarter and one split, enough to exercise the factor path
+        div_dates = dates[60::63]
+        self.dividends = "Date,Dividends\n" + "".join(f"{d},0.25\n" for d in div_dates)
+        split = dates[len(dates) // 2] if len(dates) else None
+        self.splits = "Date,Stock Splits\n" + (f"{split},2.000000/1.000000\n" if split else "")
+        self.fundamentals = json.dumps(fundamentals_doc(code, dates))
+
+    def bars_csv(self, start: str = None, end: str = None) -> str:
+        lo = 0 if not start else int(np.searchsorted(self.dates, start, side="left"))
+        hi = len(self.dates) if not end else int(np.searchsorted(self.dates, end, side="right"))
+        return CSV_HEADER + "".join(self.lines[lo:hi])
+
+
+class StubServer:
+    """
+    ThreadingHTTPServer on a free local port, `latency` seconds are slept per
+    request to stand in for the round trip
+    """
+
+    def __init__(self, codes: list, days: int, start: str = "2015-01-01", latency: float = 0.0):
+        bars = synthetic_bars(codes, days, start=start)
+        self.symbols = {
+            code: SymbolData(code, bars.iloc[idx])
+            for code, idx in bars.groupby("code", sort=False).indices.items()
+        }
+        self.latency = latency
+        self.requests = 0
+        # (code, day, step) -> csv lines, filled on first request
+        self._intraday = dict()
+        dates = bars["timestamp"]
+        self.index_start, self.index_end = str(dates.min().date()), str(dates.max().date())
+        self._indexes = dict()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # one send per response, no nagle / delayed-ack stall between headers and body
+            wbufsize = 1 << 16
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, body, content_type = stub.route(self.path)
+                payload = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def route(self, path: str):
+        """
+            Returns (status, body, content type) for a request path
+        """
+        url = urlparse(path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "api":
+            return 404, "not found", "text/plain"
+        endpoint, (symbol, exchange) = parts[1], (parts[2].rsplit(".", 1) + [""])[:2]
+        if endpoint == "fundamentals" and exchange == "INDX":
+            return 200, self.index_fundamentals(symbol), "application/json"
+        data = self.symbols.get(symbol)
+        if data is None:
+            return 404, "Ticker Not Found.", "text/plain"
+        if endpoint == "eod":
+            return 200, data.bars_csv(query.get("from"), query.get("to")), "text/csv"
+        if endpoint == "div":
+            return 200, data.dividends, "text/csv"
+        if endpoint == "splits":
+            return 200, data.splits, "text/csv"
+        if endpoint == "fundamentals":
+            return 200, data.fundamentals, "application/json"
+        if endpoint == "intraday":
+            return 200, self.intraday_csv(symbol, query), "text/csv"
+        return 404, "not found", "text/plain"
+
+    def index_fundamentals(self, index: str) -> str:
+        """
+            Returns the fundamentals json of index, its size taken from a trailing number (SPX500 -> 500)
+        """
+        body = self._indexes.get(index)
+        if body is None:
+            digits = "".join(ch for ch in index if ch.isdigit())
+            size = int(digits) if digits else 100
+            components = index_components(list(self.symbols), self.index_start, self.index_end, size,
+                                          seed=zlib.crc32(index.encode()))
+            body = json.dumps({"General": {"Code": index, "Type": "INDEX"},
+                               "HistoricalTickerComponents": components})
+            self._indexes[index] = body
+        return body
+
+    def intraday_csv(self, code: str, query: dict) -> str:
+        step = INTRADAY_STEP.get(query.get("interval", "5m"), 300)
+        lo, hi = int(query.get("from", 0)), int(query.get("to", time.time()))
+        lines = []
+        for day in range(lo // 86400, hi // 86400 + 1):
+            key = (code, day, step)
+            day_lines = self._intraday.get(key)
+            if day_lines is None:
+                day_lines = self._intraday[key] = intraday_day_lines(code, day, step)
+            if day_lines and (day * 86400 < lo or (day + 1) * 86400 > hi + 1):
+                day_lines = [line for line in day_lines if lo <= int(line.split(",", 1)[0]) <= hi]
+            lines.extend(day_lines)
+        return INTRADAY_HEADER + "".join(lines)
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="eod-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
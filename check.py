@@ -23,6 +23,7 @@ IntervalType = Literal[
     "tick",
     "1m",
     "5m",
+    "1h",
     "d",
     "w",
     "m",
@@ -36,6 +37,11 @@ ReturnType = Literal[
     "dict"
 ]
 
+AdjustType = Literal[
+    "qfq",
+    "hfq"
+]
+
 
 ExchangeType = Literal[
     "SZ",
@@ -94,3 +100,4 @@ class MarketPhase:
     CONT_TRADE = "continuous-trading"  # 0930 - 1130, 1300 - 1453
     CONT_TRADE_PRE_CLOSE = "continuous-trading-pre-close"  # 1453 - 1457
     PRE_CLOSE_CALL = "pre-close-bidding"  # 1457 - 1500
+    POST_CLOSE = "post-close"  # US extended hours 1600 - 2000
@@ -0,0 +1,149 @@
+"""
+missing trade days of stored bars, as the fewest contiguous date ranges to
+refetch
+
+every (code, day) is keyed as code_id * len(calendar) + calendar position,
+so the expected keys of the whole universe minus the stored ones is one
+sorted set difference, and consecutive missing keys of a code collapse
+into ranges with a diff; nothing loops over codes or days in python
+"""
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from logger import LOG
+from utils import get_latest_trade_date, trade_dates
+
+CN_EXCHANGES = ("SH", "SZ", "BJ")
+
+
+def exchange_trade_cal(exchange: str) -> Optional[list]:
+    """
+        Returns the trade calendar ("YYYY-MM-DD" dates) of exchange, None for weekdays when there is none
+    """
+    if exchange in CN_EXCHANGES:
+        try:
+            from trade_cal import cn_trade_cal
+        except Exception as e:
+            # trade_cal refuses to load once its calendar is out of date
+            LOG.warning(f"no usable {exchange} trade calendar ({e}), using weekdays")
+            return None
+        return cn_trade_cal
+    return None
+
+
+def _empty() -> pd.DataFrame:
+    return pd.DataFrame({
+        "code": pd.Series([], dtype=object),
+        "start": pd.Series([], dtype="datetime64[ns]"),
+        "end": pd.Series([], dtype="datetime64[ns]"),
+        "days": pd.Series([], dtype=np.int64),
+    })
+
+
+def scan_gaps(
+    codes,
+    timestamps,
+    trade_cal: Optional[list] = None,
+    start=None,
+    end=None,
+    join_within: int = 0,
+    infer_holidays: bool = False,
+) -> pd.DataFrame:
+    """
+    Returns (code, start, end, days) ranges of the trade days missing from
+    each code's bars, sorted by code and start
+
+    a code is expected on every trade day from `start` (default its first
+    bar) to `end` (default its last bar); ranges separated by at most
+    `join_within` stored days are joined, refetching a few stored bars to
+    save requests; with `infer_holidays` (a weekday calendar over many codes)
+    days none of the codes has a bar on are taken as market holidays, except
+    past the newest bar
+    """
+    code_ids, names = pd.factorize(np.asarray(codes), sort=True)
+    if not len(code_ids):
+        return _empty()
+    days = pd.to_datetime(np.asarray(timestamps)).to_numpy("datetime64[D]")
+    first = np.full(len(names), np.datetime64("NaT"), "datetime64[D]")
+    last = first.copy()
+    # per code first / last day off one sort
+    order = np.lexsort((days, code_ids))
+    sc, sd = code_ids[order], days[order]
+    bounds = np.flatnonzero(np.r_[True, sc[1:] != sc[:-1], True])
+    first[sc[bounds[:-1]]] = sd[bounds[:-1]]
+    last[sc[bounds[1:] - 1]] = sd[bounds[1:] - 1]
+    if start is not None:
+        first[:] = np.datetime64(pd.Timestamp(start).date(), "D")
+    if end is not None:
+        last[:] = np.datetime64(pd.Timestamp(end).date(), "D")
+
+    cal = trade_dates(min(first.min(), sd.min()), max(last.max(), sd.max()), trade_cal)
+    if infer_holidays:
+        cal = cal[np.isin(cal, sd) | (cal > sd.max())]
+    if not len(cal):
+        return _empty()
+    n = len(cal)
+    lo = np.searchsorted(cal, first, side="left")
+    hi = np.searchsorted(cal, last, side="right")
+    lengths = np.maximum(hi - lo, 0)
+    total = int(lengths.sum())
+    # expected keys: code_id * n + every calendar position in [lo, hi)
+    owner = np.repeat(np.arange(len(names)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    expected = owner * n + (np.arange(total) - np.repeat(offsets, lengths) + np.repeat(lo, lengths))
+
+    pos = np.searchsorted(cal, sd)
+    on = pos < n
+    on[on] = cal[pos[on]] == sd[on]
+    stored = sc[on].astype(np.int64) * n + pos[on]
+    # already sorted, drop repeats without np.unique's hashing
+    stored = stored[np.r_[True, stored[1:] != stored[:-1]]]
+    missing = np.setdiff1d(expected, stored, assume_unique=True)
+    if not len(missing):
+        return _empty()
+
+    mcode, mpos = np.divmod(missing, n)
+    # a new range starts at a code change or a jump of more than join_within + 1 positions
+    starts = np.r_[True, (mcode[1:] != mcode[:-1]) | (np.diff(mpos) > join_within + 1)]
+    first_idx = np.flatnonzero(starts)
+    last_idx = np.r_[first_idx[1:] - 1, len(missing) - 1]
+    gaps = pd.DataFrame({
+        "code": names[mcode[first_idx]],
+        "start": cal[mpos[first_idx]].astype("datetime64[ns]"),
+        "end": cal[mpos[last_idx]].astype("datetime64[ns]"),
+        "days": mpos[last_idx] - mpos[first_idx] + 1,
+    })
+    return gaps
+
+
+def refetch_jobs(gaps: pd.DataFrame) -> List[dict]:
+    """
+        Returns one recorder job (code, start_date, end_date) per gap range, largest first
+    """
+    gaps = gaps.sort_values("days", ascending=False, kind="stable")
+    return [
+        dict(code=code, start_date=start.date().isoformat(), end_date=end.date().isoformat())
+        for code, start, end in zip(gaps["code"], gaps["start"], gaps["end"])
+    ]
+
+
+def stored_gaps(schema, codes: Optional[list] = None, exchange: str = "US", end=None,
+                join_within: int = 0) -> pd.DataFrame:
+    """
+        Returns the gaps of the bars stored in schema, up to `end` (default the latest trade date)
+    """
+    # context validates through cleaners, import it late
+    from context import tg_context
+
+    df = tg_context.get_data(schema, code=codes, columns=["code", "timestamp"])
+    if df is None or df.empty:
+        return _empty()
+    trade_cal = exchange_trade_cal(exchange)
+    end = end if end is not None else get_latest_trade_date(trade_cal)
+    gaps = scan_gaps(df["code"].to_numpy(), df["timestamp"].to_numpy(), trade_cal, end=end,
+                     join_within=join_within, infer_holidays=trade_cal is None)
+    LOG.info(f"{schema.__tablename__}: {len(gaps)} gap ranges, {int(gaps['days'].sum())} trade days missing "
+             f"over {gaps['code'].nunique()} codes")
+    return gaps
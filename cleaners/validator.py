@@ -0,0 +1,164 @@
+"""
+vectorized quality checks of bar frames (code, timestamp, open, high, low,
+close[, volume]) of any number of codes: one sort by (code, timestamp) and
+a handful of numpy passes over the whole batch, no per row python
+
+    report = validate_bars(df)
+    if not report.ok:
+        LOG.warning(report.summary())
+        df = fix_bars(df, report)
+"""
+from typing import Dict, Iterable, Literal, Optional
+
+import numpy as np
+import pandas as pd
+
+from conf import VALIDATE_MAX_RETURN
+from core.metrics import metrics
+from logger import LOG
+from cleaners.gaps import scan_gaps
+from utils import between, gte, trade_dates
+
+CheckType = Literal["price", "ohlc", "volume", "duplicate", "calendar", "outlier"]
+
+# price:     open/high/low/close missing or not positive
+# ohlc:      low <= open, close <= high violated (within precision)
+# volume:    volume negative or missing
+# duplicate: an earlier row with the same (code, timestamp), the last one wins like in Context.save
+# calendar:  timestamp not on the trade calendar
+# outlier:   |log return| from the code's previous bar above max_return
+CHECKS = ("price", "ohlc", "volume", "duplicate", "calendar", "outlier")
+FLAGS: Dict[str, int] = {name: 1 << i for i, name in enumerate(CHECKS)}
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+# rows fix_bars drops rather than repairs
+DROPPED = FLAGS["price"] | FLAGS["volume"] | FLAGS["duplicate"]
+
+
+class ValidationReport:
+    """
+    `flags` holds only the failing rows (index labels of the checked frame,
+    code, timestamp and a bit per failed check), `gaps` the missing trade
+    dates of every code between its first and last bar as ranges
+    """
+
+    def __init__(self, rows: int, flags: pd.DataFrame, gaps: pd.DataFrame, counts: Dict[str, int]):
+        self.rows = rows
+        self.flags = flags
+        self.gaps = gaps
+        self.counts = counts
+
+    @property
+    def ok(self) -> bool:
+        return not any(self.counts.values())
+
+    def failing(self, check: CheckType) -> pd.Index:
+        """
+            Returns the index labels of the rows failing check
+        """
+        return self.flags.index[(self.flags["flags"].to_numpy() & FLAGS[check]) != 0]
+
+    def summary(self) -> str:
+        failed = ", ".join(f"{name}={count}" for name, count in self.counts.items() if count)
+        return f"{self.rows} bars checked, " + (failed if failed else "no violations")
+
+    def to_dict(self) -> dict:
+        return dict(rows=self.rows, counts=self.counts, failing=len(self.flags), gap_ranges=len(self.gaps))
+
+    def __repr__(self) -> str:
+        return f"ValidationReport({self.summary()})"
+
+
+@metrics.timed("validate_bars")
+def validate_bars(
+    df: pd.DataFrame,
+    checks: Iterable[CheckType] = CHECKS,
+    precision: float = 1e-4,
+    max_return: float = VALIDATE_MAX_RETURN,
+    trade_cal: Optional[list] = None,
+) -> ValidationReport:
+    """
+        Returns the violations of `checks` in df, `trade_cal` ("YYYY-MM-DD" dates) defaults to weekdays
+    """
+    checks = set(checks)
+    n = len(df)
+    flags = np.zeros(n, dtype=np.uint8)
+    gaps = scan_gaps([], [])
+    if not n:
+        return ValidationReport(0, df.iloc[:0][["code", "timestamp"]].assign(flags=flags), gaps,
+                                dict.fromkeys(CHECKS, 0))
+
+    prices = df[PRICE_COLUMNS].astype(float)
+    missing = (prices.isna() | (prices <= 0)).any(axis=1).to_numpy()
+    if "price" in checks:
+        flags[missing] |= FLAGS["price"]
+    if "ohlc" in checks:
+        o, h, l, c = (prices[col] for col in PRICE_COLUMNS)
+        consistent = gte(h, l, precision) & between(o, l, h, precision) & between(c, l, h, precision)
+        flags[~consistent.to_numpy() & ~missing] |= FLAGS["ohlc"]
+    if "volume" in checks and "volume" in df.columns:
+        volume = pd.to_numeric(df["volume"], errors="coerce").to_numpy(dtype=float)
+        flags[~(volume >= 0)] |= FLAGS["volume"]
+
+    if checks & {"duplicate", "calendar", "outlier"}:
+        code_ids, code_names = pd.factorize(df["code"], sort=True)
+        ts = pd.to_datetime(df["timestamp"]).to_numpy("datetime64[ns]")
+        # stable, so of equal keys the later row stays later
+        order = np.lexsort((ts, code_ids))
+        sc, st = code_ids[order], ts[order]
+        same = sc[1:] == sc[:-1]
+        dup = same & (st[1:] == st[:-1])
+        if "duplicate" in checks:
+            flags[order[:-1][dup]] |= FLAGS["duplicate"]
+        # the surviving row of every (code, timestamp)
+        keep = np.r_[~dup, True]
+
+        if "outlier" in checks:
+            close = prices["close"].to_numpy()[order][keep]
+            kc = sc[keep]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                moves = np.abs(np.diff(np.log(close)))
+            jump = (kc[1:] == kc[:-1]) & (moves > max_return)
+            flags[order[keep][1:][jump]] |= FLAGS["outlier"]
+
+        if "calendar" in checks:
+            days = st.astype("datetime64[D]")
+            cal = trade_dates(days.min(), days.max(), trade_cal)
+            pos = np.minimum(np.searchsorted(cal, days), len(cal) - 1)
+            on = cal[pos] == days if len(cal) else np.zeros(len(days), dtype=bool)
+            flags[order[~on]] |= FLAGS["calendar"]
+            live = keep & on
+            gaps = scan_gaps(code_names[sc[live]], days[live], trade_cal)
+
+    counts = {name: int(np.count_nonzero(flags & FLAGS[name])) for name in CHECKS}
+    counts["gaps"] = int(gaps["days"].sum()) if len(gaps) else 0
+    bad = np.flatnonzero(flags)
+    flagged = pd.DataFrame({
+        "code": df["code"].to_numpy()[bad],
+        "timestamp": df["timestamp"].to_numpy()[bad],
+        "flags": flags[bad],
+    }, index=df.index[bad])
+    return ValidationReport(n, flagged, gaps, counts)
+
+
+def fix_bars(df: pd.DataFrame, report: Optional[ValidationReport] = None, **kwargs) -> pd.DataFrame:
+    """
+    Returns a repaired copy: rows with bad prices or volume and all but the
+    last of duplicates are dropped, high/low are widened to cover open and
+    close; calendar and outlier rows are left as they are, there is nothing
+    to repair them from
+    """
+    if not df.index.is_unique:
+        raise ValueError("fix_bars needs a unique index")
+    report = report or validate_bars(df, **kwargs)
+    if report.ok:
+        return df
+    flags = report.flags["flags"]
+    df = df.drop(index=flags.index[(flags.to_numpy() & DROPPED) != 0])
+    ohlc = report.failing("ohlc").intersection(df.index)
+    if len(ohlc):
+        df = df.copy()
+        prices = df.loc[ohlc, PRICE_COLUMNS].astype(float)
+        df.loc[ohlc, "high"] = prices.max(axis=1)
+        df.loc[ohlc, "low"] = prices.min(axis=1)
+    LOG.info(f"fixed bars: {len(report.flags)} failing, {report.rows - len(df)} dropped, {len(ohlc)} ohlc repaired")
+    return df
@@ -2,12 +2,19 @@ import os
 from pathlib import Path 
 import datetime
 # PATH
-HOME_PATH = os.path.join(Path.home(), "tiger_quant")
+HOME_PATH = os.environ.get("TIGER_QUANT_HOME", os.path.join(Path.home(), "tiger_quant"))
 DATA_PATH = os.path.join(HOME_PATH, "data")
 
 # LOG 
 LOG_LEVEL = "DEBUG"
 LOG_DIR = os.path.join(HOME_PATH, "log")
+# records go through a queue and are written by a background listener
+LOG_QUEUE = True
+# file log format, "text" or "json"
+LOG_FORMAT = "text"
+# at most LOG_DEDUP_BURST records per call site and message every LOG_DEDUP_WINDOW seconds, 0 disables
+LOG_DEDUP_WINDOW = 10
+LOG_DEDUP_BURST = 5
 
 # CSV PATH 
 CSV_PATH = os.path.join(HOME_PATH, "csv")
@@ -19,10 +26,19 @@ CSV_PATH = os.path.join(HOME_PATH, "csv")
 NONE_VALUE = ["-", ]
 
 
+# VALIDATE
+# Context.save runs cleaners.validator on bar frames: None, "report" or "fix"
+VALIDATE_ON_SAVE = None
+# absolute log return between consecutive bars flagged as an outlier
+VALIDATE_MAX_RETURN = 0.5
+
 # REQUEST 
 CONN_TIMEOUT = 0.3
 READ_TIMEOUT = 0.3
 PROXY = None
+# "c", or "pyarrow" when installed
+CSV_ENGINE = "c"
+PARSE_WORKERS = 4
 
 # MULTIPROCESSING 
 PRODUCER_NO = 1
@@ -38,4 +54,70 @@ EOD_API_KEY= "62516a7aea19f0.48231987"
 
 
 EXPIRE_AFTER = datetime.timedelta(days=1)
+
+# METRICS
+METRICS_ENABLED = os.environ.get("TIGER_QUANT_METRICS", "0") == "1"
+METRICS_PATH = os.path.join(DATA_PATH, "metrics")
+
+# INTRADAY
+# parquet codec and rows per row group of the day files
+INTRADAY_COMPRESSION = "zstd"
+INTRADAY_ROW_GROUP = 16 * 1024
+# compact a day once it holds this many parts
+INTRADAY_COMPACT_MIN_PARTS = 2
+# parts a followed day collects between compactions, one per poll
+INTRADAY_FOLLOW_COMPACT_PARTS = 30
+
+# MARKET CALENDAR
+# the market clock's trading days run through MARKET_CALENDAR_END and it
+# refuses to start past it: extend the end and the closures every year.
+# CN takes trade_cal's days where it has them, US weekdays minus the NYSE
+# rule holidays; both drop the weekday closures listed here
+MARKET_CALENDAR_END = {"CN": "2026-12-31", "US": "2026-12-31"}
+MARKET_CLOSURES = {
+    "CN": [
+        "2024-01-01", "2024-02-09", "2024-02-12", "2024-02-13", "2024-02-14", "2024-02-15",
+        "2024-02-16", "2024-04-04", "2024-04-05", "2024-05-01", "2024-05-02", "2024-05-03",
+        "2024-06-10", "2024-09-16", "2024-09-17", "2024-10-01", "2024-10-02", "2024-10-03",
+        "2024-10-04", "2024-10-07",
+        "2025-01-01", "2025-01-28", "2025-01-29", "2025-01-30", "2025-01-31", "2025-02-03",
+        "2025-02-04", "2025-04-04", "2025-05-01", "2025-05-02", "2025-05-05", "2025-06-02",
+        "2025-10-01", "2025-10-02", "2025-10-03", "2025-10-06", "2025-10-07", "2025-10-08",
+        "2026-01-01", "2026-01-02", "2026-02-16", "2026-02-17", "2026-02-18", "2026-02-19",
+        "2026-02-20", "2026-02-23", "2026-04-06", "2026-05-01", "2026-05-04", "2026-05-05",
+        "2026-06-19", "2026-09-25", "2026-10-01", "2026-10-02", "2026-10-05", "2026-10-06",
+        "2026-10-07",
+    ],
+    # closures outside the NYSE holiday rules
+    "US": [
+        "2001-09-11", "2001-09-12", "2001-09-13", "2001-09-14", "2004-06-11", "2007-01-02",
+        "2012-10-29", "2012-10-30", "2018-12-05", "2025-01-09",
+    ],
+}
+
+# TICKS
+# segment codec, None for core.compress's default; "none" keeps the columns mmap-able without a copy
+TICK_CODEC = None
+# compact a symbol day once it holds this many segments
+TICK_COMPACT_MIN_SEGMENTS = 2
+
+# FUNDAMENTALS
+# parquet codec and rows per row group of the per statement files
+FUNDAMENTALS_COMPRESSION = "zstd"
+FUNDAMENTALS_ROW_GROUP = 16 * 1024
+
+# SCREENER
+# trade days kept in the materialized cross sections screens run on
+SCREENER_DAYS = 60
+# saved bars buffered per table before they are merged into its cross section
+SCREENER_PENDING_ROWS = 1_000_000
+
+# SWEEP
+# sqlite file parameter sweep results stream into, and rows per write
+SWEEP_PATH = os.path.join(DATA_PATH, "sweeps.sqlite")
+SWEEP_FLUSH_ROWS = 200
+
+# HTTP CACHE
+HTTP_CACHE_PATH = os.path.join(DATA_PATH, "http_cache.sqlite")
+HTTP_CACHE_MAX_BYTES = 2 * 1024 ** 3
 DEFAULT_INTERVAL = 300 
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""
+index constituents as membership intervals, one parquet file per index:
+
+    <DATA_PATH>/constituents/<provider>/GSPC.parquet
+
+    code | index | valid_from | valid_to
+
+a code is a member on valid_from <= day < valid_to, an open valid_to (null)
+means still a member. Membership holds the intervals of one index in memory
+as a sorted breakpoint array and the member set of every span between two
+breakpoints (index rebalances are rare, so these are few), `members` is one
+binary search and a slice, `members_over` a binary search over the interval
+starts, `mask` a date x code panel for backtests; nothing loads the
+membership table per bar
+"""
+import os
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from check import ProviderType, StartEndType
+from conf import DATA_PATH
+from core.metrics import metrics
+from logger import LOG
+
+SCHEMA = pa.schema([
+    ("code", pa.string()),
+    ("index", pa.string()),
+    ("valid_from", pa.date32()),
+    ("valid_to", pa.date32()),
+])
+# stands in for an open valid_to in memory
+OPEN_END = np.datetime64("9999-12-31", "D")
+
+
+def _day(value: StartEndType) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+def _days(values) -> np.ndarray:
+    return pd.to_datetime(np.asarray(values)).to_numpy("datetime64[D]")
+
+
+def normalize_intervals(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the intervals (code, index, valid_from, valid_to) of df with the
+    overlapping or touching ones of a code merged and empty ones dropped,
+    sorted by (index, code, valid_from)
+    """
+    starts = _days(df["valid_from"])
+    ends = _days(df["valid_to"])
+    ends = np.where(np.isnat(ends), OPEN_END, ends)
+    keep = ends > starts
+    index_ids, indexes = pd.factorize(df["index"].astype(str).to_numpy()[keep], sort=True)
+    code_ids, codes = pd.factorize(df["code"].astype(str).to_numpy()[keep], sort=True)
+    lo, hi = starts[keep].astype(np.int64), ends[keep].astype(np.int64)
+    order = np.lexsort((lo, code_ids, index_ids))
+    group = (index_ids[order].astype(np.int64) * max(len(codes), 1) + code_ids[order])
+    lo, hi = lo[order], hi[order]
+    if not len(lo):
+        return pd.DataFrame({name: pd.Series([], dtype=dtype) for name, dtype in (
+            ("code", object), ("index", object), ("valid_from", "datetime64[ns]"), ("valid_to", "datetime64[ns]"))})
+    # furthest end so far within the code, an interval starting past it opens a new run
+    reach = pd.Series(hi).groupby(group).cummax().to_numpy()
+    new = np.r_[True, (group[1:] != group[:-1]) | (lo[1:] > reach[:-1])]
+    first = np.flatnonzero(new)
+    valid_to = np.maximum.reduceat(hi, first).astype("datetime64[D]")
+    return pd.DataFrame({
+        "code": np.asarray(codes, dtype=object)[code_ids[order][first]],
+        "index": np.asarray(indexes, dtype=object)[index_ids[order][first]],
+        "valid_from": lo[first].astype("datetime64[D]").astype("datetime64[ns]"),
+        "valid_to": np.where(valid_to == OPEN_END, np.datetime64("NaT"), valid_to).astype("datetime64[ns]"),
+    })
+
+
+def intervals_from_snapshots(index: str, snapshots: Mapping[StartEndType, Iterable[str]]) -> pd.DataFrame:
+    """
+    Returns membership intervals from dated constituent lists: a code is a
+    member from the first snapshot listing it until the next one that does
+    not, still open after the last snapshot
+    """
+    dates = sorted(_day(d) for d in snapshots)
+    if not dates:
+        return normalize_intervals(pd.DataFrame(columns=SCHEMA.names))
+    lists = {_day(d): list(codes) for d, codes in snapshots.items()}
+    codes = np.concatenate([np.asarray(lists[d], dtype=object) for d in dates])
+    pos = np.repeat(np.arange(len(dates)), [len(lists[d]) for d in dates])
+    code_ids, names = pd.factorize(codes)
+    # (code, snapshot) sorted, a run breaks where a code skips a snapshot
+    order = np.lexsort((pos, code_ids))
+    c, p = code_ids[order], pos[order]
+    starts = np.r_[True, (c[1:] != c[:-1]) | (p[1:] != p[:-1] + 1)]
+    first = np.flatnonzero(starts)
+    last = np.r_[first[1:] - 1, len(c) - 1]
+    ends = p[last] + 1
+    cal = np.array(dates + [OPEN_END], dtype="datetime64[D]")
+    return normalize_intervals(pd.DataFrame({
+        "code": names[c[first]],
+        "index": index,
+        "valid_from": cal[p[first]],
+        "valid_to": np.where(ends < len(dates), cal[np.minimum(ends, len(dates))], np.datetime64("NaT")),
+    }))
+
+
+def intervals_from_eod(index: str, components: Mapping) -> pd.DataFrame:
+    """
+        Returns membership intervals from EOD's HistoricalTickerComponents of an index
+    """
+    rows = list(components.values()) if isinstance(components, dict) else list(components or [])
+    df = pd.DataFrame({
+        "code": [row.get("Code") for row in rows],
+        "index": index,
+        "valid_from": pd.to_datetime([row.get("StartDate") for row in rows], errors="coerce"),
+        "valid_to": pd.to_datetime([row.get("EndDate") for row in rows], errors="coerce"),
+    })
+    # members since before the history starts come without a start date
+    df["valid_from"] = df["valid_from"].fillna(pd.Timestamp("1900-01-01"))
+    return normalize_intervals(df.dropna(subset=["code"]))
+
+
+class Membership:
+    """
+    in memory lookups over the intervals of one index
+    """
+
+    def __init__(self, intervals: pd.DataFrame):
+        intervals = normalize_intervals(intervals)
+        ids, self.names = pd.factorize(intervals["code"], sort=True)
+        self.names = np.asarray(self.names, dtype=object)
+        starts = intervals["valid_from"].to_numpy("datetime64[D]")
+        ends = intervals["valid_to"].to_numpy("datetime64[D]")
+        ends = np.where(np.isnat(ends), OPEN_END, ends)
+        self.ids, self.starts, self.ends = ids, starts, ends
+        # interval starts sorted, for range queries
+        self._by_start = np.argsort(starts, kind="stable")
+        self._sorted_starts = starts[self._by_start]
+        # breakpoints, and per span [bp[k], bp[k + 1]) its member ids as one flat array
+        self.breakpoints = np.unique(np.r_[starts, ends[ends != OPEN_END]])
+        lo = np.searchsorted(self.breakpoints, starts)
+        hi = np.searchsorted(self.breakpoints, ends)
+        counts = hi - lo
+        span = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        member = np.repeat(ids, counts)
+        order = np.lexsort((member, span))
+        self._members = member[order]
+        self._offsets = np.r_[0, np.cumsum(np.bincount(span, minlength=len(self.breakpoints)))]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def members(self, on: StartEndType) -> np.ndarray:
+        """
+            Returns the sorted codes that were members on `on`
+        """
+        k = int(np.searchsorted(self.breakpoints, _day(on), side="right")) - 1
+        if k < 0:
+            return self.names[:0]
+        return self.names[self._members[self._offsets[k]:self._offsets[k + 1]]]
+
+    def members_over(self, start: StartEndType, end: StartEndType) -> np.ndarray:
+        """
+            Returns the sorted codes that were members on any day in [start, end]
+        """
+        k = int(np.searchsorted(self._sorted_starts, _day(end), side="right"))
+        candidates = self._by_start[:k]
+        live = candidates[self.ends[candidates] > _day(start)]
+        return self.names[np.unique(self.ids[live])]
+
+    def is_member(self, code: str, on: StartEndType) -> bool:
+        members = self.members(on)
+        pos = int(np.searchsorted(members, code))
+        return pos < len(members) and members[pos] == code
+
+    def mask(self, dates, codes: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Returns a dates x codes bool frame of membership, codes default to
+        every code ever a member; made for masking signal panels
+        """
+        days = _days(dates)
+        columns = self.names if codes is None else np.asarray(list(codes), dtype=object)
+        col = pd.Index(columns).get_indexer(self.names)[self.ids]
+        keep = col >= 0
+        lo = np.searchsorted(days, self.starts[keep])
+        hi = np.searchsorted(days, self.ends[keep])
+        # +1 where an interval opens, -1 where it closes, running sum over the dates
+        steps = np.zeros((len(days) + 1, len(columns)), dtype=np.int32)
+        np.add.at(steps, (lo, col[keep]), 1)
+        np.add.at(steps, (hi, col[keep]), -1)
+        live = np.cumsum(steps[:-1], axis=0) > 0
+        return pd.DataFrame(live, index=pd.DatetimeIndex(dates), columns=columns)
+
+    def to_frame(self, index: str) -> pd.DataFrame:
+        return pd.DataFrame({
+            "code": self.names[self.ids],
+            "index": index,
+            "valid_from": self.starts,
+            "valid_to": np.where(self.ends == OPEN_END, np.datetime64("NaT"), self.ends),
+        })
+
+
+class ConstituentStore:
+    """
+    membership intervals of every index of one provider; Membership objects
+    are cached until their file changes
+    """
+
+    def __init__(self, provider: ProviderType = "EOD", root: str = None):
+        self.root = root or os.path.join(DATA_PATH, "constituents", provider.lower())
+        os.makedirs(self.root, exist_ok=True)
+        self._cache: Dict[str, Tuple[float, Membership]] = dict()
+
+    def path(self, index: str) -> str:
+        return os.path.join(self.root, f"{index}.parquet")
+
+    def indexes(self) -> List[str]:
+        return sorted(name[:-8] for name in os.listdir(self.root) if name.endswith(".parquet"))
+
+    @metrics.timed("constituents_write")
+    def write(self, index: str, intervals: pd.DataFrame) -> int:
+        """
+        replace the whole membership history of index; returns the intervals stored
+        """
+        df = normalize_intervals(intervals.assign(index=index))
+        table = pa.table({
+            "code": pa.array(df["code"].astype(str).to_numpy(), pa.string()),
+            "index": pa.array([index] * len(df), pa.string()),
+            "valid_from": pa.array(df["valid_from"].to_numpy("datetime64[D]"), pa.date32()),
+            "valid_to": pa.array(df["valid_to"].to_numpy("datetime64[D]"), pa.date32()),
+        }, schema=SCHEMA)
+        path = self.path(index)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+        self._cache.pop(index, None)
+        LOG.info(f"constituents {index}: {len(df)} intervals over {df['code'].nunique()} codes")
+        return len(df)
+
+    def read(self, index: str) -> pd.DataFrame:
+        df = pq.read_table(self.path(index)).to_pandas()
+        for col in ("valid_from", "valid_to"):
+            df[col] = pd.to_datetime(df[col])
+        return df
+
+    def membership(self, index: str) -> Membership:
+        """
+            Returns the cached lookups of index, rebuilt when its file changed
+        """
+        mtime = os.path.getmtime(self.path(index))
+        cached = self._cache.get(index)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, Membership(self.read(index)))
+            self._cache[index] = cached
+        return cached[1]
+
+    def members(self, index: str, on: StartEndType) -> np.ndarray:
+        return self.membership(index).members(on)
+
+    def members_over(self, index: str, start: StartEndType, end: StartEndType) -> np.ndarray:
+        return self.membership(index).members_over(start, end)
+
+    def mask(self, index: str, dates, codes: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        return self.membership(index).mask(dates, codes)
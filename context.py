@@ -1,17 +1,23 @@
 import os 
 import pandas as pd 
-import tqdm 
+from tqdm import tqdm 
 import datetime
 from typing import Union
-from sqlalchemy import create_engine 
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from functools import partial 
 
 from logger import LOG
-from conf import DATA_PATH
-from check import ReturnType, ProviderType
+from conf import DATA_PATH, VALIDATE_ON_SAVE
+from check import ReturnType, ProviderType, AdjustType
 from utils import _sanitize_dates
+from adjuster import adj_factor_cache, apply_adj_factors
+from querier import F, Predicate, Query, all_of, row_type
+from domain.bar import Bar, BAR_REQUIRED_FIELDS
+from core.metrics import metrics
+from cleaners.validator import CHECKS, fix_bars, validate_bars
+from screener import cross_section_cache
 
 
 
@@ -26,7 +32,7 @@ class Singleton(type):
                 cls._instances[cls] = instance
             return cls._instances[cls]
 
-class Context(Singleton):
+class Context(metaclass=Singleton):
     _engine_map = dict()
     _session_map = dict()
     _schema_map = dict()
@@ -35,6 +41,7 @@ class Context(Singleton):
         assert provider is not None or db_full_name is not None 
         if not provider:
             provider = db_full_name.split("_")[0]
+        provider = provider.lower()
         if self._engine_map.get(provider):
             return self._engine_map[provider]
         db_path = os.path.join(DATA_PATH, "{}.db?check_same_thread=False".format(provider))
@@ -71,7 +78,7 @@ class Context(Singleton):
             self._schema_map[tb_full_name] = cls 
             provider = tb_full_name.split("_")[0]
             session = self._get_session(tb_full_name)
-            session.configure(bind=engine)
+            session.bind = engine
         base.metadata.create_all(engine)
     
     def unregister_schema(
@@ -91,6 +98,7 @@ class Context(Singleton):
                 del self._schema_map[tb_full_name]
         base.metadata.drop_all(engine, tables=tb_list)
 
+    @metrics.timed("context_get_data")
     def get_data(
         self,
         schema,
@@ -105,56 +113,119 @@ class Context(Singleton):
         filters: list = None, 
         return_type: ReturnType= "df",
         index: list|str = None,
-        time_field: str = "timestamp"
+        time_field: str = "timestamp",
+        adjust: AdjustType = None
         ):
         assert schema is not None 
+        if adjust and return_type != "df":
+            raise ValueError("adjust is only supported with return_type='df'")
         session = self._schema_get_session(schema)
-        if columns:
-        # support str
-            for i, col in enumerate(columns):
-                if isinstance(col, str):
-                    columns[i] = eval("schema.{}".format(col))
 
-            query = session.query(*columns)
+        where = all_of(
+            self._code_predicate(code),
+            self._time_predicate(start, end, on, time_field),
+            F("exchange").isin(exchanges) if exchanges else None,
+        )
+        # querier predicates are part of the cached statement, raw sqlalchemy
+        # clauses are appended to it
+        sql_filters = []
+        for filter in filters or []:
+            if isinstance(filter, Predicate):
+                where = all_of(where, filter)
+            else:
+                sql_filters.append(filter)
+        if order is None:
+            order = time_field
+        sql_order = None
+        if not isinstance(order, (str, list, tuple)):
+            sql_order, order = order, None
+
+        if return_type != "df" and not columns:
+            columns = self._row_columns(schema)
+        query = Query(schema, columns=columns, where=where, order=order, limit=limit)
+        # only queries made of querier parts hit the compiled statement cache
+        cacheable = not sql_filters and sql_order is None
+        stmt = None
+        if not cacheable:
+            stmt = query.statement
+            if sql_filters:
+                stmt = stmt.where(*sql_filters)
+            if sql_order is not None:
+                stmt = stmt.order_by(sql_order)
+        params = query.params()
+
+        if return_type == "df":
+            if cacheable:
+                df = query.read_df(session.bind)
+            else:
+                df = pd.read_sql(stmt, session.bind, params=params)
+            if adjust:
+                df = self._adjust(schema, df, adjust)
+            if index:
+                df = df.set_index(index)
+            return df
+        # rows come straight from the cursor as tuples, no ORM instances
+        compiled = query.compiled(session.bind.dialect) if cacheable else None
+        if compiled is not None:
+            rows = compiled.fetch_rows(session.bind, params)
         else:
-            query = session.query(schema)
+            rows = [tuple(row) for row in session.connection().execute(
+                query.statement if stmt is None else stmt, params)]
+        columns = query.columns
+        if return_type == "dict":
+            return [dict(zip(columns, row)) for row in rows]
+        elif return_type == "domain":
+            if set(columns) <= set(Bar.__slots__):
+                if columns == Bar.__slots__[:len(columns)]:
+                    return [Bar(*row) for row in rows]
+                return [Bar(**dict(zip(columns, row))) for row in rows]
+            make = row_type(schema.__name__, columns)._make
+            return [make(row) for row in rows]
 
-        if code: 
-            if isinstance(code, str):
-                query = query.filter(schema.code == code)
-            if isinstance(code, list):
-                query = query.filter(schema.code.in_(code))
+    def _row_columns(self, schema) -> list:
+        """
+            Returns table columns, in Bar order for kdata schemas
+        """
+        names = schema.__table__.columns.keys()
+        if BAR_REQUIRED_FIELDS <= set(names) and set(names) <= set(Bar.__slots__):
+            return [name for name in Bar.__slots__ if name in names]
+        return names
 
-        time_col = eval("schema.{}".format(time_field))
+    def _code_predicate(self, code):
+        if not code:
+            return None
+        if isinstance(code, str):
+            return F("code") == code
+        return F("code").isin(code)
 
-        if start: 
+    def _time_predicate(self, start, end, on, time_field):
+        if start:
             start_date, end_date = _sanitize_dates(start, end)
-            query = query.filter(time_col >= start_date)
-            query = query.filter(time_col <= end_date)
-            
-        elif on: 
-            date = _sanitize_dates(date, date)[0]
-            query = query.filter(time_col == date)
-        
-        if exchanges:
-            query = query.filter(schema.exchange.in_(exchanges))
-        if filters:
-            for filter in filters:
-                query = query.filter(filter)
-        if order is not None:
-            query = query.order_by(order)
-        else:
-            query = query.order_by(time_col.asc())
-        if limit:
-            query = query.limit(limit)
+            return F(time_field).between(start_date, end_date)
+        if on:
+            return F(time_field) == pd.to_datetime(on)
+        return None
 
-        if return_type == "df":
-            df = pd.read_sql(query.statement, query.session.bind, index_col=index)
+    def _adj_factor_schema(self, schema):
+        provider = schema.__tablename__.split("_")[0]
+        factor_schema = self._schema_map.get(f"{provider}_adj_factor")
+        if factor_schema is None:
+            raise ValueError(f"adj factor schema of {provider} is not registered")
+        return factor_schema
+
+    def _adjust(self, schema, df: pd.DataFrame, adjust: AdjustType) -> pd.DataFrame:
+        if df.empty:
             return df
-        elif return_type == "domain":
-            return query.all()
-        elif return_type == "dict":
-            return [item.__dict__ for item in query.all()]
+        if "code" not in df.columns or "timestamp" not in df.columns:
+            raise ValueError("adjust requires code and timestamp columns")
+        factor_schema = self._adj_factor_schema(schema)
+        loader = lambda codes: self.get_data(
+            factor_schema, code=codes, columns=["code", "timestamp", "factor"]
+        )
+        factors = adj_factor_cache.get(
+            factor_schema.__tablename__, df["code"].unique().tolist(), loader
+        )
+        return apply_adj_factors(df, factors, adjust)
 
     def del_data(self, schema, filters: list = None):
         """
@@ -199,17 +270,21 @@ class Context(Singleton):
             yield df.iloc[sub_size*step: sub_size * (step+ 1)]
 
     
+    @metrics.timed("context_save")
     def save(
         self,
         df: pd.DataFrame,
         schema: DeclarativeMeta,
         force_update: bool = False,
         sub_size: int = 5000,
-        drop_duplicates: bool = False
+        drop_duplicates: bool = False,
+        validate: str = VALIDATE_ON_SAVE,
     ) -> object:
         tb_full_name = schema.__tablename__
         if df is None or df.empty:
             return 
+        if validate and BAR_REQUIRED_FIELDS <= set(df.columns):
+            df = self._validate(df, tb_full_name, fix=validate == "fix")
         if drop_duplicates and df.duplicated(subset='id').any():
             LOG.warning(f'remove duplicated:{df[df.duplicated()]}')
         df = df.drop_duplicates(subset='id', keep='last')
@@ -220,8 +295,8 @@ class Context(Singleton):
             return 
         df = df[list(cols)]
         session = self._get_session(tb_full_name)
-        engine = self._get_engine(tb_full_name)
-        iter_df = partial(self._iter_df, sub_size)
+        engine = self._get_engine(db_full_name=tb_full_name)
+        iter_df = partial(self._iter_df, sub_size=sub_size)
         for sub_df in iter_df(df):
             ids = sub_df["id"].tolist()
             if force_update:
@@ -230,16 +305,43 @@ class Context(Singleton):
                 else:
                     sql = f"delete from `{tb_full_name}` where id in {tuple(ids)}"
 
-                session.execute(sql)
+                session.execute(text(sql))
                 session.commit()
             else: 
-                db_ids = self._get_ids(schema, ids)
+                with metrics.timer("sql_existing_ids", table=tb_full_name):
+                    db_ids = self._get_ids(schema, ids)
                 if db_ids:
                     sub_df = sub_df[~sub_df["id"].isin(db_ids)]
                 session.commit() 
 
             if sub_df is not None and not sub_df.empty:
-                sub_df.to_sql(tb_full_name, engine, index=False, if_exists="append")
+                with metrics.timer("sql_insert", table=tb_full_name):
+                    sub_df.to_sql(tb_full_name, engine, index=False, if_exists="append")
+                metrics.incr("rows_saved", len(sub_df), table=tb_full_name)
+
+        if tb_full_name.endswith("_adj_factor") and "code" in df.columns:
+            adj_factor_cache.invalidate(tb_full_name, df["code"].unique().tolist())
+        if BAR_REQUIRED_FIELDS <= set(df.columns):
+            # buffered for materialized screener cross sections, a no-op for tables without one
+            cross_section_cache.update(tb_full_name, df)
+
+    def flush(self) -> int:
+        """
+        persist what saves buffered for derived caches, call once at the end
+        of an ingest run; returns the screener snapshots written
+        """
+        return cross_section_cache.flush()
+
+    @staticmethod
+    def _validate(df: pd.DataFrame, tb_full_name: str, fix: bool) -> pd.DataFrame:
+        if not df.index.is_unique:
+            df = df.reset_index(drop=True)
+        # a batch rarely spans a code's whole history, calendar gaps are left to the gap scanner
+        report = validate_bars(df, checks=[c for c in CHECKS if c != "calendar"])
+        if report.ok:
+            return df
+        LOG.warning(f"{tb_full_name}: {report.summary()}")
+        return fix_bars(df, report) if fix else df
 
 
 
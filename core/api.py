@@ -2,7 +2,7 @@ import os
 from sqlalchemy import create_engine 
 from sqlalchemy.orm import sessionmaker
 
-from cacher import engine_cacher, session_cacher
+from core.cacher import engine_cacher, session_cacher
 from conf import DATA_PATH
 
 def get_engine(provider):
@@ -1,45 +1,300 @@
-
+import sys
+import time
+from collections import OrderedDict
 from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Literal, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.metrics import metrics
+
+EvictionPolicy = Literal["lru", "lfu"]
+DEFAULT_NAMESPACE = "default"
+_MISSING = object()
+
+
 class Singleton(type):
     _instances = {}
     _lock: Lock = Lock()
     def __call__(cls, *args, **kwargs):
-        with cls._lock: 
+        with cls._lock:
             if cls not in cls._instances:
                 instance = super(Singleton, cls).__call__(*args, **kwargs)
                 cls._instances[cls] = instance
             return cls._instances[cls]
 
-class Cacher(Metaclass=Singleton):
+
+def sizeof(value) -> int:
+    """
+        Returns the approximate size of a cached value in bytes
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class Entry:
+    __slots__ = ("value", "size", "expires_at", "hits")
+
+    def __init__(self, value, size: int, expires_at: Optional[float]):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.hits = 0
+
+
+class Namespace:
+    """
+    one bounded store: at most `max_entries` values and `max_bytes` bytes
+    (as measured by `sizeof`), entries older than `ttl` seconds are dropped
+    on access, `policy` picks the victim when a bound is hit.
+
+    LFU keeps keys in per frequency buckets, so hits and evictions are O(1)
+    for both policies. `on_evict(key, value)` runs outside the lock for
+    evicted, expired and replaced values (e.g. to dispose an engine).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        policy: EvictionPolicy = "lru",
+        sizeof: Callable[[Any], int] = sizeof,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"unknown eviction policy {policy}")
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.policy = policy
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.bytes = 0
+        self._lock = Lock()
+        self._data: "OrderedDict[Hashable, Entry]" = OrderedDict()
+        # lfu: frequency -> keys in insertion order
+        self._buckets: Dict[int, OrderedDict] = dict()
+        self._min_freq = 0
+        self.stats = dict(hits=0, misses=0, sets=0, evictions=0, expired=0)
+
+    def __len__(self):
+        return len(self._data)
+
+    def _touch(self, key, entry: Entry):
+        entry.hits += 1
+        if self.policy == "lru":
+            self._data.move_to_end(key)
+            return
+        freq = entry.hits
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        self._buckets.setdefault(freq + 1, OrderedDict())[key] = None
+
+    def _unlink(self, key) -> Entry:
+        entry = self._data.pop(key)
+        self.bytes -= entry.size
+        if self.policy == "lfu":
+            freq = entry.hits + 1
+            bucket = self._buckets[freq]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[freq]
+                if self._min_freq == freq:
+                    self._min_freq = min(self._buckets, default=0)
+        return entry
+
+    def _victim(self):
+        if self.policy == "lru":
+            return next(iter(self._data))
+        return next(iter(self._buckets[self._min_freq]))
+
+    def _full(self, incoming: int) -> bool:
+        """
+            Returns True when one more entry of `incoming` bytes would not fit
+        """
+        if self.max_entries is not None and len(self._data) >= self.max_entries:
+            return True
+        return self.max_bytes is not None and self.bytes + incoming > self.max_bytes
+
+    def get(self, key, default=None):
+        dropped = None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                dropped = (key, self._unlink(key).value)
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+            else:
+                self._touch(key, entry)
+                self.stats["hits"] += 1
+        metrics.incr("cache_hits" if entry is not None else "cache_misses", namespace=self.name)
+        if dropped is not None:
+            self._evicted([dropped])
+        return default if entry is None else entry.value
+
+    def set(self, key, value, ttl: Optional[float] = _MISSING):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        dropped = []
+        with self._lock:
+            if key in self._data:
+                old = self._unlink(key)
+                if old.value is not value:
+                    dropped.append((key, old.value))
+            if self.max_bytes is not None and size > self.max_bytes:
+                # would evict everything and still not fit
+                self.stats["evictions"] += 1
+            else:
+                while self._data and self._full(size):
+                    victim = self._victim()
+                    dropped.append((victim, self._unlink(victim).value))
+                    self.stats["evictions"] += 1
+                self._data[key] = Entry(value, size, expires_at)
+                self.bytes += size
+                if self.policy == "lfu":
+                    self._buckets.setdefault(1, OrderedDict())[key] = None
+                    self._min_freq = 1
+                self.stats["sets"] += 1
+        if dropped:
+            metrics.incr("cache_evictions", len(dropped), namespace=self.name)
+            self._evicted(dropped)
+
+    def get_or_set(self, key, factory: Callable[[], Any], ttl: Optional[float] = _MISSING):
+        """
+            Returns the cached value, computing and storing it on a miss
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._unlink(key).value
+
+    def clear(self):
+        with self._lock:
+            dropped = [(key, entry.value) for key, entry in self._data.items()]
+            self._data.clear()
+            self._buckets.clear()
+            self._min_freq = 0
+            self.bytes = 0
+        self._evicted(dropped)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (entry.expires_at is None or entry.expires_at > time.monotonic())
+
+    def _evicted(self, dropped: list):
+        if self.on_evict is None:
+            return
+        for key, value in dropped:
+            self.on_evict(key, value)
+
+    def info(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                hit_rate=self.stats["hits"] / lookups if lookups else 0.0,
+                entries=len(self._data),
+                bytes=self.bytes,
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes,
+                ttl=self.ttl,
+                policy=self.policy,
+            )
+
+
+class Cacher(metaclass=Singleton):
+    """
+    named, independently locked namespaces; item access and get/set without
+    a namespace go to the default one
+    """
+    default_options: dict = {}
+
     def __init__(self):
-        self.__dict = dict()
-    
+        self._lock = Lock()
+        self._namespaces: Dict[str, Namespace] = dict()
+
+    def namespace(self, name: str = DEFAULT_NAMESPACE, **options) -> Namespace:
+        """
+        Returns the namespace, created with `options` (Namespace arguments)
+        the first time it is asked for
+        """
+        ns = self._namespaces.get(name)
+        if ns is not None:
+            return ns
+        with self._lock:
+            ns = self._namespaces.get(name)
+            if ns is None:
+                ns = self._namespaces[name] = Namespace(name, **dict(self.default_options, **options))
+            return ns
+
     def __getitem__(self, key):
-        return self.__dict[key]
-    
-    def __setitem__(self, key, value): 
-        self.__dict[key] = value
-    
-    def get(self, key):
-        return self.__dict.get(key)
+        value = self.namespace().get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.namespace().set(key, value)
+
+    def get(self, key, default=None, namespace: str = DEFAULT_NAMESPACE):
+        return self.namespace(namespace).get(key, default)
+
+    def set(self, key, value, namespace: str = DEFAULT_NAMESPACE, ttl: Optional[float] = _MISSING):
+        self.namespace(namespace).set(key, value, ttl)
 
     def __contains__(self, key):
-        return key in self.__dict
+        return key in self.namespace()
 
-class EngineCacher(Cacher):
-    pass 
-    
-class SessionCacher(Cacher):
-    pass
+    def info(self) -> Dict[str, dict]:
+        return {name: ns.info() for name, ns in list(self._namespaces.items())}
 
+    def clear(self):
+        for ns in list(self._namespaces.values()):
+            ns.clear()
 
-engine_cacher = EngineCacher()
-session_cacher = SessionCacher() 
+
+def _dispose_engine(key, engine):
+    engine.dispose()
 
 
-if __name__ == "__main__":
-    engine_cacher["a"] = "b"
-    print(engine_cacher.get("a"))
-    engine_cacher["a"] = "c"
+def _close_session(key, session):
+    session.close()
 
 
+class EngineCacher(Cacher):
+    default_options = dict(on_evict=_dispose_engine)
+
+class SessionCacher(Cacher):
+    default_options = dict(max_entries=256, on_evict=_close_session)
+
+
+engine_cacher = EngineCacher()
+session_cacher = SessionCacher()
@@ -0,0 +1,31 @@
+"""
+fast block compression, zstd when `zstandard` is installed, zlib otherwise
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+
+def compress(data: bytes, codec: str = DEFAULT_CODEC, level: int = 3) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "none":
+        return bytes(data)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "none":
+        return bytes(data)
+    raise ValueError(f"unknown codec: {codec}")
@@ -4,7 +4,8 @@ from typing import Any, Optional, List, Union
 
 import pandas as pd 
 from decimal import Decimal
-from utils.pd_utils import pd_is_not_null
+from utils import pd_is_not_null
+from core.metrics import metrics
 
 
 class Handler(ABC):
@@ -29,6 +30,13 @@ class AbstractHandler(Handler):
     """
 
     _next_handler: Handler = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # every concrete handle is timed, self time leaves out the rest of the chain
+        if "handle" in cls.__dict__:
+            cls.handle = metrics.timed("handler", handler=cls.__name__)(cls.__dict__["handle"])
+
     @property 
     def parent(self) -> AbstractHandler:
         return self._parent
@@ -132,7 +140,7 @@ class DfRenamer(AbstractHandler):
     def __init__(self, rename_map):
         self.rename_map = rename_map
     def handle(self, data):
-        return super().handle(data.rename(columns=self.rename_map, inplace=True))
+        return super().handle(data.rename(columns=self.rename_map))
 
 class DictAdder(AbstractHandler):
     def __init__(self, add_map):
@@ -146,9 +154,8 @@ class DfAdder(AbstractHandler):
     def __init__(self, add_map):
         self.add_map = add_map
     def handle(self, data): 
-        keys = self.add_map.keys()
-        values = self.add_map.values()
-        data[keys] = values
+        for k, v in self.add_map.items():
+            data[k] = v
         return super().handle(data) 
         
 class DictFormatModifier(AbstractHandler):
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+from typing import Optional
+from urllib.parse import urlencode
+
+from core.compress import DEFAULT_CODEC, compress, decompress
+from logger import LOG
+
+# query parameters that never take part in a cache key
+PRIVATE_PARAMS = ("api_token", "apikey", "api_key", "token")
+
+
+def cache_key(url: str, params: Optional[dict] = None) -> str:
+    params = {k: v for k, v in (params or {}).items() if k not in PRIVATE_PARAMS and v is not None}
+    if not params:
+        return url
+    return url + "?" + urlencode(sorted(params.items()))
+
+
+class CachedResponse:
+    """
+    the parts of requests.Response the formats read
+    """
+    __slots__ = ("content", "status_code", "encoding")
+
+    def __init__(self, content: bytes, status_code: int = 200, encoding: str = "utf-8"):
+        self.content = content
+        self.status_code = status_code
+        self.encoding = encoding
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding)
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    """
+    sqlite response cache with content-addressed, compressed payloads
+
+    responses map a request key to a payload digest and an optional expiry
+    (NULL = never expires); blobs hold each distinct payload once. When the
+    compressed size goes over `max_bytes` the least recently used responses
+    are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024 ** 3, codec: str = DEFAULT_CODEC):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                raw_size INTEGER NOT NULL,
+                refs INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+            """
+        )
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        self._stats = dict(hits=0, misses=0, expired=0, stores=0, dedups=0, evictions=0)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT r.digest, r.status, r.expires_at, b.codec, b.data FROM responses r "
+                "JOIN blobs b ON b.digest = r.digest WHERE r.key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            digest, status, expires_at, codec, data = row
+            if expires_at is not None and expires_at <= now:
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                self._delete(key, digest)
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._stats["hits"] += 1
+        return CachedResponse(decompress(data, codec), status)
+
+    def put(self, key: str, content: bytes, expires_at: Optional[float] = None, status: int = 200):
+        digest = hashlib.sha256(content).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                old = self._conn.execute("SELECT digest FROM responses WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    self._delete(key, old[0])
+                if self._conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone():
+                    self._conn.execute("UPDATE blobs SET refs = refs + 1 WHERE digest = ?", (digest,))
+                    self._stats["dedups"] += 1
+                else:
+                    data = compress(content, self.codec)
+                    self._conn.execute(
+                        "INSERT INTO blobs VALUES (?, ?, ?, ?, ?, 1)",
+                        (digest, self.codec, data, len(data), len(content)),
+                    )
+                    self._bytes += len(data)
+                self._conn.execute(
+                    "INSERT INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, digest, status, expires_at, now),
+                )
+                self._stats["stores"] += 1
+                if self._bytes > self.max_bytes:
+                    self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+                raise
+
+    def _delete(self, key: str, digest: str):
+        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._conn.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", (digest,))
+        row = self._conn.execute("SELECT size FROM blobs WHERE digest = ? AND refs <= 0", (digest,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self._bytes -= row[0]
+
+    def _evict(self, batch: int = 256):
+        target = self.max_bytes * 0.9
+        while self._bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, digest FROM responses ORDER BY last_access LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            for key, digest in rows:
+                self._delete(key, digest)
+                self._stats["evictions"] += 1
+                if self._bytes <= target:
+                    break
+        LOG.debug(f"http cache evicted down to {self._bytes} bytes")
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, digest FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),),
+            ).fetchall()
+            self._conn.execute("BEGIN")
+            for key, digest in rows:
+                self._delete(key, digest)
+            self._conn.execute("COMMIT")
+            self._stats["expired"] += len(rows)
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, permanent = self._conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(expires_at) FROM responses"
+            ).fetchone()
+            blobs, raw_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(raw_size), 0) FROM blobs"
+            ).fetchone()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_rate=self._stats["hits"] / lookups if lookups else 0.0,
+                entries=entries,
+                permanent=permanent,
+                blobs=blobs,
+                bytes=self._bytes,
+                raw_bytes=raw_bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
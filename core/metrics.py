@@ -0,0 +1,321 @@
+import os
+import json
+import math
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from conf import METRICS_ENABLED, METRICS_PATH
+from logger import LOG
+
+PREFIX = "tiger_quant"
+# seconds
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+Key = Tuple[str, tuple]
+
+
+def _key(name: str, labels: dict) -> Key:
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, bounds: tuple = TIME_BUCKETS):
+        self.bounds = bounds
+        # last slot is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+            Returns the upper bound of the bucket holding the q-quantile
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            min=self.min if self.count else 0.0,
+            max=self.max if self.count else 0.0,
+            p50=self.quantile(0.5),
+            p99=self.quantile(0.99),
+            buckets=dict(zip([str(b) for b in self.bounds] + ["+Inf"], self.counts)),
+        )
+
+
+class TimerStat(Histogram):
+    """
+    histogram of wall times plus the self time, i.e. without nested timers
+    """
+    __slots__ = ("self_sum",)
+
+    def __init__(self, bounds: tuple = TIME_BUCKETS):
+        super().__init__(bounds)
+        self.self_sum = 0.0
+
+    def to_dict(self) -> dict:
+        return dict(super().to_dict(), self_sum=self.self_sum)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("metrics", "key", "start", "children")
+
+    def __init__(self, metrics: "Metrics", key: Key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.children = 0.0
+        self.metrics._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.metrics._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.metrics._record(self.key, elapsed, elapsed - self.children)
+        return False
+
+
+class Metrics:
+    """
+    process wide timers, counters and histograms
+
+    Disabled, every entry point returns after one attribute check. Timers
+    nest per thread, a timer's self time leaves out the timers opened inside
+    it, so a handler chain or an http get wrapping its parse splits cleanly.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = Lock()
+        self._local = threading.local()
+        self.counters: Dict[Key, float] = dict()
+        self.timers: Dict[Key, TimerStat] = dict()
+        self.histograms: Dict[Key, Histogram] = dict()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+            self.histograms.clear()
+
+    def _stack(self) -> list:
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, key: Key, elapsed: float, self_time: float):
+        with self._lock:
+            stat = self.timers.get(key)
+            if stat is None:
+                stat = self.timers[key] = TimerStat()
+            stat.observe(elapsed)
+            stat.self_sum += self_time
+
+    def incr(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, bounds: tuple = SIZE_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(bounds)
+            hist.observe(value)
+
+    def record_time(self, name: str, elapsed: float, **labels):
+        """
+        record a duration measured elsewhere, e.g. across awaits where the
+        per thread stack does not apply; self time is the whole duration
+        """
+        if not self.enabled:
+            return
+        self._record(_key(name, labels), elapsed, elapsed)
+
+    def timer(self, name: str, **labels):
+        """
+            Returns a context manager timing its block
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, _key(name, labels))
+
+    def timed(self, name: str, **labels):
+        """
+        decorator timing every call of the function
+        """
+        key = _key(name, labels)
+
+        def decor(fun):
+            @wraps(fun)
+            def inner(*args, **kwargs):
+                if not self.enabled:
+                    return fun(*args, **kwargs)
+                with _Timer(self, key):
+                    return fun(*args, **kwargs)
+            return inner
+        return decor
+
+    def wrap(self, name: str, fun, **labels):
+        """
+            Returns fun timed under name, or fun itself when disabled
+        """
+        if not self.enabled:
+            return fun
+        return self.timed(name, **labels)(fun)
+
+    def snapshot(self) -> dict:
+        def flat(key: Key) -> str:
+            name, labels = key
+            if not labels:
+                return name
+            return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+        with self._lock:
+            return dict(
+                time=time.time(),
+                counters={flat(k): v for k, v in self.counters.items()},
+                timers={flat(k): v.to_dict() for k, v in self.timers.items()},
+                histograms={flat(k): v.to_dict() for k, v in self.histograms.items()},
+            )
+
+    def to_prometheus(self) -> str:
+        """
+            Returns the metrics in the prometheus text exposition format
+        """
+        def labels_of(labels: tuple, **extra) -> str:
+            pairs = list(labels) + list(extra.items())
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        def histogram_lines(metric: str, labels: tuple, hist: Histogram) -> list:
+            lines, seen = [], 0
+            for bound, count in zip(list(hist.bounds) + ["+Inf"], hist.counts):
+                seen += count
+                lines.append(f"{metric}_bucket{labels_of(labels, le=bound)} {seen}")
+            lines.append(f"{metric}_sum{labels_of(labels)} {hist.sum}")
+            lines.append(f"{metric}_count{labels_of(labels)} {hist.count}")
+            return lines
+
+        lines, typed = [], set()
+
+        def declare(metric: str, kind: str):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{PREFIX}_{name}_total"
+                declare(metric, "counter")
+                lines.append(f"{metric}{labels_of(labels)} {value}")
+            for (name, labels), stat in sorted(self.timers.items()):
+                metric = f"{PREFIX}_{name}_seconds"
+                declare(metric, "histogram")
+                lines.extend(histogram_lines(metric, labels, stat))
+                self_metric = f"{PREFIX}_{name}_self_seconds_total"
+                declare(self_metric, "counter")
+                lines.append(f"{self_metric}{labels_of(labels)} {stat.self_sum}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                metric = f"{PREFIX}_{name}"
+                declare(metric, "histogram")
+                lines.extend(histogram_lines(metric, labels, hist))
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self):
+        """
+        one LOG line per timer, slowest self time first, then the counters
+        """
+        with self._lock:
+            timers = sorted(self.timers.items(), key=lambda item: -item[1].self_sum)
+            counters = sorted(self.counters.items())
+        for (name, labels), stat in timers:
+            label = "".join(f" {k}={v}" for k, v in labels)
+            LOG.info(
+                f"[metrics] {name}{label}: n={stat.count} total={stat.sum:.3f}s self={stat.self_sum:.3f}s "
+                f"mean={stat.sum / stat.count * 1e3:.2f}ms p50<={stat.quantile(0.5) * 1e3:.2f}ms "
+                f"p99<={stat.quantile(0.99) * 1e3:.2f}ms max={stat.max * 1e3:.2f}ms"
+            )
+        for (name, labels), value in counters:
+            label = "".join(f" {k}={v}" for k, v in labels)
+            LOG.info(f"[metrics] {name}{label}: {value}")
+
+    def _write(self, path: str, text: str):
+        # written aside and renamed so a scraper never reads half a file
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def write_prometheus(self, path: Optional[str] = None) -> str:
+        path = path or os.path.join(METRICS_PATH, f"{PREFIX}.prom")
+        self._write(path, self.to_prometheus())
+        return path
+
+    def write_json(self, path: Optional[str] = None) -> str:
+        path = path or os.path.join(METRICS_PATH, f"{PREFIX}.json")
+        self._write(path, json.dumps(self.snapshot(), indent=2, default=str))
+        return path
+
+
+metrics = Metrics()
@@ -1,12 +1,20 @@
 import os
+import json
 import asyncio
+import sqlite3
+import multiprocessing
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 from tqdm import tqdm
-from multiprocessing import Pool, Process, Manager
+from multiprocessing import Pool, Process, Manager, shared_memory
 
-from conf import PRODUCER_NO, CONSUMER_NO
-from logger import init_logger
+import numpy as np
+import pandas as pd
 
-log = init_logger(__name__)
+from conf import PRODUCER_NO, CONSUMER_NO, SWEEP_FLUSH_ROWS, SWEEP_PATH
+from core.metrics import metrics
+from logger import LOG
+
+log = LOG
 
 class SelfMultiple:
     def __init__(self, func, process: int, params: list, custom_callback=False, callback=None):
@@ -93,4 +101,231 @@ class ProducerConsumerHandler:
             consumer_process.join()
 
 
+class SharedArrays:
+    """
+    numpy arrays copied once into shared memory blocks; `spec` is small and
+    picklable, workers `attach` it and get read-only views of the same pages
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self.arrays: Dict[str, np.ndarray] = dict()
+        self.spec: Dict[str, Tuple[str, tuple, str]] = dict()
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            view[...] = array
+            self._blocks.append(block)
+            self.arrays[name] = view
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(spec: Dict[str, Tuple[str, tuple, str]]) -> Tuple[Dict[str, np.ndarray], list]:
+        """
+            Returns read-only views of the arrays of spec and the blocks backing them
+        """
+        arrays, blocks = dict(), []
+        for name, (block_name, shape, dtype) in spec.items():
+            # workers share the resource tracker of the creating process, which unlinks the block
+            block = shared_memory.SharedMemory(name=block_name)
+            view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            view.flags.writeable = False
+            arrays[name] = view
+            blocks.append(block)
+        return arrays, blocks
+
+    def close(self):
+        self.arrays.clear()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# the arrays a pool worker attached in its initializer
+_shared: Dict[str, np.ndarray] = dict()
+_shared_blocks: list = []
+
+
+def _attach_shared(spec):
+    arrays, blocks = SharedArrays.attach(spec)
+    _shared.update(arrays)
+    _shared_blocks.extend(blocks)
+
+
+def _call_shared(task):
+    func, key, param = task
+    return key, param, func(_shared, param)
+
+
+def _quote(name: str) -> str:
+    # result fields become sqlite column names, whatever characters they hold
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SweepResults:
+    """
+    results of parameter sweeps in sqlite, one row per (run, task) with the
+    parameters as json and one REAL column per result field, added as new
+    fields show up; rows go in as they arrive so an interrupted run resumes
+    """
+
+    def __init__(self, path: str = SWEEP_PATH, table: str = "sweep_results"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.table = table
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (run TEXT NOT NULL, task INTEGER NOT NULL, "
+            f"params TEXT NOT NULL, PRIMARY KEY (run, task))"
+        )
+        self._columns = self._read_columns()
+
+    def _read_columns(self) -> List[str]:
+        return [row[1] for row in self._conn.execute(f"PRAGMA table_info({self.table})")]
+
+    @staticmethod
+    def encode(params: dict) -> str:
+        return json.dumps(params, sort_keys=True, default=str)
+
+    def done(self, run: str) -> set:
+        """
+            Returns the tasks of run already stored
+        """
+        return {row[0] for row in self._conn.execute(f"SELECT task FROM {self.table} WHERE run = ?", (run,))}
+
+    def write(self, run: str, rows: List[Tuple[int, dict, dict]]) -> int:
+        """
+            store (task, params, result) rows of run in one transaction; returns the rows stored
+        """
+        if not rows:
+            return 0
+        fields = sorted({field for _, _, result in rows for field in result})
+        known = {column.lower() for column in self._columns}
+        for field in fields:
+            if field.lower() in ("run", "task", "params"):
+                raise ValueError(f"result field {field!r} clashes with a key column of {self.table}")
+            if field.lower() not in known:
+                self._conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {_quote(field)} REAL")
+                self._columns.append(field)
+                known.add(field.lower())
+        names = ", ".join(_quote(field) for field in fields)
+        marks = ", ".join("?" * (len(fields) + 3))
+        values = [(run, int(task), self.encode(params),
+                   *(result.get(field) for field in fields)) for task, params, result in rows]
+        self._conn.execute("BEGIN")
+        self._conn.executemany(f"INSERT OR REPLACE INTO {self.table} (run, task, params, {names}) "
+                               f"VALUES ({marks})", values)
+        self._conn.execute("COMMIT")
+        return len(rows)
+
+    def rows(self, run: str) -> List[Tuple[int, dict, dict]]:
+        """
+            Returns the stored (task, params, result) rows of run by task, result without the fields it lacks
+        """
+        cursor = self._conn.execute(f"SELECT * FROM {self.table} WHERE run = ? ORDER BY task", (run,))
+        names = [column[0] for column in cursor.description]
+        fields = names[3:]
+        return [(task, json.loads(params), {field: value for field, value in zip(fields, values) if value is not None})
+                for _, task, params, *values in cursor]
+
+    def read(self, run: str) -> pd.DataFrame:
+        """
+            Returns the results of run by task, the parameters spread into columns
+        """
+        df = pd.read_sql_query(f"SELECT * FROM {self.table} WHERE run = ? ORDER BY task", self._conn, params=(run,))
+        params = pd.DataFrame([json.loads(value) for value in df.pop("params")], index=df.index)
+        result = df.drop(columns=["run"]).dropna(axis=1, how="all")
+        return pd.concat([result[["task"]], params, result.drop(columns=["task"])], axis=1)
+
+    def close(self):
+        self._conn.close()
+
+
+class SweepRunner:
+    """
+    runs func(arrays, params) over many parameter sets in a forked pool: the
+    arrays are placed in shared memory once and attached zero-copy by every
+    worker, tasks are handed out in small chunks from one queue so a fast
+    worker takes over what a slow one has not started, and results stream
+    back as they finish, into `results` every `flush_rows` rows when given.
+    func must be a module level function
+    """
+
+    def __init__(self, func: Callable, arrays: Dict[str, np.ndarray], processes: int = None,
+                 results: SweepResults = None, flush_rows: int = SWEEP_FLUSH_ROWS):
+        self.func = func
+        self.arrays = arrays
+        self.processes = processes or os.cpu_count() or 1
+        self.results = results
+        self.flush_rows = flush_rows
+
+    def _chunksize(self, tasks: int) -> int:
+        # a few chunks per worker balance the load, one task each would flood the queue
+        return max(1, min(16, tasks // (self.processes * 8)))
+
+    def imap(self, params: Iterable[dict]) -> Iterator[Tuple[int, dict, object]]:
+        """
+            Yields (task, params, result) in completion order, task being the position in params
+        """
+        tasks = [(self.func, key, param) for key, param in enumerate(params)]
+        with SharedArrays(self.arrays) as shared:
+            if self.processes == 1 or len(tasks) <= 1:
+                for func, key, param in tasks:
+                    yield key, param, func(shared.arrays, param)
+                return
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            with context.Pool(self.processes, initializer=_attach_shared, initargs=(shared.spec,)) as pool:
+                yield from pool.imap_unordered(_call_shared, tasks, chunksize=self._chunksize(len(tasks)))
+
+    @metrics.timed("sweep")
+    def run(self, params: Iterable[dict], run: str = None) -> List[Tuple[int, dict, object]]:
+        """
+        Returns (task, params, result) of every task by task; with a results
+        table and a run name, tasks the run already stored are read back
+        instead of run and the rest written as they finish. Raises
+        ValueError when a stored task has other params than the one at its
+        position now
+        """
+        params = list(params)
+        store = self.results is not None and run is not None
+        stored = self.results.rows(run) if store else []
+        done = {row[0] for row in stored}
+        # tasks are keyed by position, a reordered or edited grid must not pick up other parameters' results
+        for task, stored_params, _ in stored:
+            if task < len(params) and json.loads(self.results.encode(params[task])) != stored_params:
+                raise ValueError(f"sweep {run}: task {task} was stored with {stored_params}, now {params[task]}; "
+                                 f"the grid changed, rerun it under a new run name")
+        todo = [(key, param) for key, param in enumerate(params) if key not in done]
+        if done:
+            LOG.info(f"sweep {run}: {len(done)} of {len(params)} tasks already stored")
+        rows = [(task, params[task], result) for task, _, result in stored if task < len(params)]
+        pending = []
+        for pos, param, result in self.imap([param for _, param in todo]):
+            row = (todo[pos][0], param, result)
+            rows.append(row)
+            pending.append(row)
+            if store and len(pending) >= self.flush_rows:
+                self.results.write(run, pending)
+                pending = []
+        if store:
+            self.results.write(run, pending)
+        metrics.incr("sweep_tasks", len(todo))
+        return sorted(rows, key=lambda row: row[0])
+
 
+def shared_map(func: Callable, arrays: Dict[str, np.ndarray], params: Iterable, processes: int = None) -> list:
+    """
+    Returns [func(arrays, param) for param in params] computed by a
+    SweepRunner, arrays go to shared memory once instead of being pickled per task
+    """
+    return [result for _, _, result in SweepRunner(func, arrays, processes).run(params)]
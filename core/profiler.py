@@ -0,0 +1,236 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import pstats
+import socket
+import cProfile
+import argparse
+import itertools
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from functools import wraps
+from typing import Callable, Iterable, Literal, Optional
+
+from logger import LOG, LOG_DIR
+
+ProfileMode = Literal["cprofile", "sample"]
+PROFILE_DIR = os.path.join(LOG_DIR, "profiles")
+# seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+_sequence = itertools.count()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or os.path.basename(code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    background thread recording the stacks of the watched threads every
+    `interval` seconds, counted as collapsed stacks (`a;b;c count`) which
+    flamegraph.pl / speedscope read directly
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, thread_ids: Optional[Iterable[int]] = None):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    """
+    profile a block with cProfile or the stack sampler, on exit the profile
+    and a json of the job metadata are written to PROFILE_DIR:
+
+        cprofile: <name>.prof (pstats) and <name>.txt (top functions)
+        sample:   <name>.collapsed (flamegraph input) and <name>.txt (top stacks)
+
+    cProfile only sees the thread entering the block, use the sampler for jobs
+    fanned out to a thread pool. `current_thread_only` restricts sampling to
+    the entering thread, which is what per task profiles in a pool want
+    """
+
+    def __init__(
+        self,
+        name: str,
+        mode: ProfileMode = "sample",
+        out_dir: str = PROFILE_DIR,
+        interval: float = SAMPLE_INTERVAL,
+        current_thread_only: bool = False,
+        **meta,
+    ):
+        if mode not in ("cprofile", "sample"):
+            raise ValueError(f"unknown profile mode {mode}")
+        self.name = name
+        self.mode = mode
+        self.out_dir = out_dir
+        self.interval = interval
+        self.current_thread_only = current_thread_only
+        self.meta = meta
+        self.paths = []
+
+    def __enter__(self):
+        self._started = time.time()
+        self._start = time.perf_counter()
+        self._cpu = time.process_time()
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # python >= 3.12 allows a single active cProfile per process
+                LOG.warning(f"{self.name}: another cProfile is active, sampling instead")
+                self.mode = "sample"
+        if self.mode == "sample":
+            ids = [threading.get_ident()] if self.current_thread_only else None
+            self._sampler = StackSampler(self.interval, ids)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.mode == "cprofile":
+            self._profile.disable()
+        else:
+            self._sampler.stop()
+        wall = time.perf_counter() - self._start
+        try:
+            self._write(wall, time.process_time() - self._cpu, exc_type)
+        except OSError:
+            LOG.exception(f"failed to write profile {self.name}")
+        return False
+
+    def _base_path(self) -> str:
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started))
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in self.name)
+        return os.path.join(self.out_dir, f"{safe}-{stamp}-{os.getpid()}-{next(_sequence)}")
+
+    def _write(self, wall: float, cpu: float, exc_type):
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = self._base_path()
+        meta = dict(
+            name=self.name,
+            mode=self.mode,
+            started=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started)),
+            wall_seconds=round(wall, 4),
+            cpu_seconds=round(cpu, 4),
+            pid=os.getpid(),
+            host=socket.gethostname(),
+            argv=sys.argv,
+            python=sys.version.split()[0],
+            failed=exc_type.__name__ if exc_type else None,
+            **self.meta,
+        )
+        if self.mode == "cprofile":
+            self._profile.dump_stats(base + ".prof")
+            text = io.StringIO()
+            pstats.Stats(self._profile, stream=text).sort_stats("cumulative").print_stats(50)
+            self._write_text(base + ".txt", text.getvalue())
+            self.paths = [base + ".prof", base + ".txt"]
+        else:
+            meta.update(interval=self.interval, samples=self._sampler.samples)
+            self._write_text(base + ".collapsed", self._sampler.collapsed())
+            top = "".join(
+                f"{count:>8} {stack.rsplit(';', 1)[-1]}  <- {stack}\n"
+                for stack, count in self._sampler.stacks.most_common(50)
+            )
+            self._write_text(base + ".txt", top)
+            self.paths = [base + ".collapsed", base + ".txt"]
+        self._write_text(base + ".json", json.dumps(meta, indent=2, default=str))
+        self.paths.append(base + ".json")
+        LOG.info(f"profile {self.name} ({self.mode}, {wall:.2f}s) written to {base}.*")
+
+    @staticmethod
+    def _write_text(path: str, text: str):
+        with open(path, "w") as f:
+            f.write(text)
+
+
+class TaskSampler:
+    """
+    profile a random `rate` share of per symbol tasks, each to its own file
+    """
+
+    def __init__(self, job: str, mode: ProfileMode = "sample", rate: float = 0.01,
+                 seed: Optional[int] = None, **meta):
+        self.job = job
+        self.mode = mode
+        self.rate = rate
+        self.meta = meta
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _pick(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.rate
+
+    def wrap(self, fun: Callable, task_name: Callable = None) -> Callable:
+        """
+            Returns fun profiled on the sampled calls, `task_name(*args, **kwargs)` names the file
+        """
+        if self.rate <= 0:
+            return fun
+
+        @wraps(fun)
+        def inner(*args, **kwargs):
+            if not self._pick():
+                return fun(*args, **kwargs)
+            task = task_name(*args, **kwargs) if task_name else fun.__name__
+            with Profiler(f"{self.job}.{task}", self.mode, current_thread_only=True,
+                          job=self.job, task=str(task), **self.meta):
+                return fun(*args, **kwargs)
+        return inner
+
+
+def profiled(name: str, mode: Optional[ProfileMode], **meta):
+    """
+        Returns a Profiler for the block, or a no-op context when mode is None
+    """
+    if not mode:
+        return nullcontext()
+    return Profiler(name, mode, **meta)
+
+
+def add_profile_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument("--profile", choices=["cprofile", "sample"],
+                        help="profile the whole run with cProfile or the stack sampler")
+    parser.add_argument("--profile-tasks", type=float, default=0.0, metavar="RATE",
+                        help="profile this share of per symbol tasks instead, e.g. 0.01")
+    return parser
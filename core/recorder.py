@@ -1,17 +1,35 @@
 from __future__ import annotations
 import os 
 import abc 
-import tqdm 
+import time
+import random
+import tempfile
+import pandas as pd
+from tqdm import tqdm 
 from datetime import date, timedelta 
-from typing import List, Dict, Any, Callable, Generator, Type
+from typing import List, Dict, Any, Callable, Generator, Optional, Type
 
 from core.api import get_session
+from core.profiler import ProfileMode, TaskSampler, profiled
 from concurrent.futures import ThreadPoolExecutor
 
 from utils import chunks, get_latest_trade_date
 from logger import LOG
 
 class DataCollector:
+    # whole run profile mode, or the mode of per task profiles when profile_tasks > 0
+    profile: Optional[ProfileMode] = None
+    # share of batch job tasks profiled individually
+    profile_tasks: float = 0.0
+
+    def run_profiled(self, *args, **kwargs):
+        """
+            Returns run(), profiled as a whole unless only tasks are sampled
+        """
+        mode = None if self.profile_tasks else self.profile
+        with profiled(self.__class__.__name__, mode):
+            return self.run(*args, **kwargs)
+
     def run_batch_jobs(
         self,
         jobs: list[Any],
@@ -23,6 +41,9 @@ class DataCollector:
         tempd = tempfile.TemporaryDirectory()
 
         kls = self.__class__.__name__
+        if self.profile_tasks:
+            sampler = TaskSampler(kls, self.profile or "sample", self.profile_tasks)
+            fun = sampler.wrap(fun, task_name=lambda *args, **kwargs: kwargs.get("code", "task"))
         LOG.info(
             f"""
         [{kls}]:
@@ -1,17 +1,21 @@
 import os 
 import time
+import json
 import asyncio 
 import aiohttp
 import requests 
 import traceback 
 import pandas as pd 
-from io import StringIO 
+from io import BytesIO 
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse 
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 
 from logger import LOG
-from conf import CONN_TIMEOUT, READ_TIMEOUT, PROXY
+from conf import CONN_TIMEOUT, READ_TIMEOUT, PROXY, EXPIRE_AFTER, CSV_ENGINE, PARSE_WORKERS
+from core.http_cache import ResponseCache, cache_key
+from core.metrics import metrics
 
 
 def retry(max_retries=3, wait_interval=5):
@@ -51,6 +55,7 @@ def async_retry(max_retries=3, wait_interval=5):
 class Requester:   
     format = format
     session = requests.Session()
+    cache: Optional[ResponseCache] = None
 
     def _create_params(self, *args, **kwargs) -> Tuple[str, Dict[str, str], Dict[str, str]]:
         """
@@ -65,19 +70,47 @@ class Requester:
                 will create parameters to pass into request session
         """
         raise NotImplementedError
+
+    def _cache_expiry(self, url, params=None) -> Optional[float]:
+        """
+            Returns the unix time a response expires at, None to keep it forever
+        """
+        return time.time() + EXPIRE_AFTER.total_seconds()
+
+    def _cache_get(self, url, params):
+        if self.cache is None:
+            return None, None
+        key = cache_key(url, params)
+        return key, self.cache.get(key)
+
+    def _cache_put(self, key, url, params, content: bytes, status: int):
+        if key is not None and status < 400:
+            self.cache.put(key, content, self._cache_expiry(url, params), status)
         
     @retry()
     def _get(self, url, params=None, data=None,
                 proxy=PROXY, conn_timeout=CONN_TIMEOUT, 
-                read_timeout=READ_TIMEOUT):
-        resp = self.session.get(
-                url, 
-                proxies= proxy, 
-                params=params,
-                timeout=(conn_timeout, read_timeout) 
-                )
-        data = self.format.form(resp)
-        return data 
+                read_timeout=READ_TIMEOUT, fmt=None):
+        # `fmt` overrides the requester's format for endpoints answering in another one
+        fmt = fmt or self.format
+        with metrics.timer("http_get", requester=self.__class__.__name__):
+            key, cached = self._cache_get(url, params)
+            if cached is not None:
+                metrics.incr("http_cache_hits")
+                with metrics.timer("http_parse"):
+                    return fmt.parse(cached.content)
+            resp = self.session.get(
+                    url, 
+                    proxies= proxy, 
+                    params=params,
+                    timeout=(conn_timeout, read_timeout) 
+                    )
+            metrics.incr("http_responses", status=resp.status_code)
+            metrics.observe("http_response_bytes", len(resp.content))
+            self._cache_put(key, url, params, resp.content, resp.status_code)
+            with metrics.timer("http_parse"):
+                data = fmt.form(resp)
+            return data 
         
 
     @retry()
@@ -97,15 +130,32 @@ class Requester:
     async def _async_get(self, url, params=None, data=None, 
                 proxy=PROXY, conn_timeout=CONN_TIMEOUT, 
                 read_timeout=READ_TIMEOUT):
-        async with aiohttp.ClientSession() as session:
-            timeout = aiohttp.ClientTimeout(total=conn_timeout, sock_read=read_timeout)
-            async with session.get(
-                urlparse(url).geturl(), 
-                params=params, 
-                data=data,
-                timeout=timeout, 
-                proxy=proxy) as resp:
-                return await self.format.form(resp)
+        # coroutines interleave on one thread, so this is timed outside the timer stack
+        start = time.perf_counter()
+        parse = metrics.wrap("http_parse", self.format.parse)
+        try:
+            key, cached = self._cache_get(url, params)
+            if cached is not None:
+                metrics.incr("http_cache_hits")
+                return await async_parse(parse, cached.content)
+            async with aiohttp.ClientSession() as session:
+                timeout = aiohttp.ClientTimeout(total=conn_timeout, sock_read=read_timeout)
+                async with session.get(
+                    urlparse(url).geturl(), 
+                    params=params, 
+                    data=data,
+                    timeout=timeout, 
+                    proxy=proxy) as resp:
+                    metrics.incr("http_responses", status=resp.status)
+                    if key is None:
+                        return await self.format.form(resp)
+                    content = await resp.read()
+                    metrics.observe("http_response_bytes", len(content))
+                    self._cache_put(key, url, params, content, resp.status)
+                    return await async_parse(parse, content)
+        finally:
+            metrics.record_time("http_async_get", time.perf_counter() - start,
+                                requester=self.__class__.__name__)
             
     @async_retry()
     async def _async_post(self, url, params=None, data=None, 
@@ -123,22 +173,83 @@ class Requester:
     
                 
 class JsonFormat:
+    @staticmethod
+    def parse(content: bytes):
+        return json.loads(content)
+
+    @staticmethod
     def form(resp):
         return resp.json()
 
 class AsyncJsonFormat:
+    parse = staticmethod(JsonFormat.parse)
+
+    @staticmethod
     async def form(resp):
         return await resp.json()
 
+# EOD csv columns, everything else is left to the parser
+CSV_DTYPES = {
+    "Open": "float64",
+    "High": "float64",
+    "Low": "float64",
+    "Close": "float64",
+    "Adjusted_close": "float64",
+    "Volume": "float64",
+}
+CSV_DATE_FORMAT = "%Y-%m-%d"
+# intraday csv repeats its unix Timestamp as a Datetime string, never parse it
+CSV_SKIP_COLUMNS = frozenset(["Gmtoffset", "Datetime"])
+
+# csv parsing of async requests runs here so the event loop keeps issuing requests
+_parse_pool = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+
+
+async def async_parse(parse, content: bytes):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_parse_pool, parse, content)
+
+
+def read_csv(content: bytes, dtype: dict = CSV_DTYPES, date_format: str = CSV_DATE_FORMAT) -> pd.DataFrame:
+    """
+    parse an EOD csv response, indexed by its first (date) column
+    """
+    if CSV_ENGINE == "c":
+        df = pd.read_csv(BytesIO(content), engine=CSV_ENGINE, dtype=dtype,
+                         usecols=lambda col: col not in CSV_SKIP_COLUMNS)
+    else:
+        df = pd.read_csv(BytesIO(content), engine=CSV_ENGINE, dtype=dtype)
+        df = df.drop(columns=list(CSV_SKIP_COLUMNS), errors="ignore")
+    if not len(df.columns):
+        return df
+    dates = df.iloc[:, 0]
+    if pd.api.types.is_integer_dtype(dates):
+        # intraday csv leads with unix seconds
+        index = pd.to_datetime(dates, unit="s")
+    else:
+        try:
+            index = pd.to_datetime(dates, format=date_format)
+        except (ValueError, TypeError):
+            index = pd.to_datetime(dates, format="ISO8601")
+    df = df.iloc[:, 1:]
+    df.index = pd.DatetimeIndex(index, name=dates.name)
+    return df
+
 class TextFormat:
+    @staticmethod
+    def parse(content: bytes):
+        return read_csv(content)
+
+    @staticmethod
     def form(resp):
-        data = resp.text
-        return pd.read_csv(StringIO(data), engine='python', skipfooter=0, parse_dates=[0], index_col=0)
+        return read_csv(resp.content)
 
 class AsyncTextFormat:
+    parse = staticmethod(TextFormat.parse)
+
+    @staticmethod
     async def form(resp):
-        data = await resp.text()
-        # Here we're not using await with pd.read_csv as it's not an async function
-        return pd.read_csv(StringIO(data), engine='python', skipfooter=0, parse_dates=[0], index_col=0)
+        content = await resp.read()
+        return await async_parse(read_csv, content)
 
         
\ No newline at end of file
@@ -0,0 +1,263 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Callable, Dict, List, Literal, Optional
+
+import pandas as pd
+
+from check import IntervalType, ProviderType, StartEndType
+from core.metrics import metrics
+from logger import LOG
+
+# provider(code, interval, start, end) -> DataFrame
+Source = Callable[[str, IntervalType, StartEndType, StartEndType], Optional[pd.DataFrame]]
+RouteMode = Literal["hedge", "race", "first"]
+
+EWMA_ALPHA = 0.2
+# hedge once the primary runs past srtt + HEDGE_VARIANCE * rttvar, like a tcp retransmit timeout
+HEDGE_VARIANCE = 4.0
+HEDGE_MIN = 0.05
+HEDGE_MAX = 5.0
+# before a provider has any history
+HEDGE_DEFAULT = 0.5
+# a failure costs this many seconds of ranking score, decaying with the error rate
+ERROR_PENALTY = 10.0
+
+
+class NoValidResponse(Exception):
+    pass
+
+
+class ProviderStats:
+    """
+    ewma latency (successes only), its mean deviation and ewma error rate
+    """
+    __slots__ = ("name", "srtt", "rttvar", "error_rate", "calls", "errors", "wins")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.error_rate = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+
+    def success(self, latency: float):
+        self.calls += 1
+        if self.srtt is None:
+            self.srtt, self.rttvar = latency, latency / 2
+        else:
+            self.rttvar += EWMA_ALPHA * (abs(latency - self.srtt) - self.rttvar)
+            self.srtt += EWMA_ALPHA * (latency - self.srtt)
+        self.error_rate *= 1 - EWMA_ALPHA
+
+    def failure(self):
+        self.calls += 1
+        self.errors += 1
+        self.error_rate += EWMA_ALPHA * (1 - self.error_rate)
+
+    def score(self) -> float:
+        """
+            Returns the ranking score, lower is better, unknown providers rank first
+        """
+        if self.srtt is None:
+            return ERROR_PENALTY * self.error_rate
+        return self.srtt + ERROR_PENALTY * self.error_rate
+
+    def hedge_delay(self) -> float:
+        if self.srtt is None:
+            return HEDGE_DEFAULT
+        return min(max(self.srtt + HEDGE_VARIANCE * self.rttvar, HEDGE_MIN), HEDGE_MAX)
+
+    def to_dict(self) -> dict:
+        return dict(
+            srtt=self.srtt,
+            rttvar=self.rttvar,
+            error_rate=self.error_rate,
+            calls=self.calls,
+            errors=self.errors,
+            wins=self.wins,
+            score=self.score(),
+        )
+
+
+def _valid(df) -> bool:
+    return df is not None and not (isinstance(df, pd.DataFrame) and df.empty)
+
+
+class ProviderRouter:
+    """
+    route a (code, interval, range) request to the configured providers,
+    best ranked first
+
+        hedge: ask the best provider, add the next one each time the running
+               ones pass the hedge delay or fail, first valid response wins
+        race:  ask every provider at once, first valid response wins
+        first: ask one provider at a time, moving on only on failure
+
+    Losing requests run to completion in the pool and still update the
+    stats, so a slow provider keeps being measured and can rank back up.
+    Requests still running `timeout` after their fetch started count as
+    errors, checked when the fetch gives up or, for losers of a won fetch,
+    by the next fetch; a result arriving later is not recorded again.
+    Threads can't be interrupted, so Sources should bound their own calls
+    (see eod_source).
+    """
+
+    def __init__(
+        self,
+        providers: Dict[ProviderType, Source],
+        mode: RouteMode = "hedge",
+        hedge_after: Optional[float] = None,
+        timeout: float = 30.0,
+        validate: Callable[[object], bool] = _valid,
+        max_workers: int = 16,
+    ):
+        if not providers:
+            raise ValueError("no providers")
+        self.providers = dict(providers)
+        self.mode = mode
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.validate = validate
+        self.stats = {name: ProviderStats(name) for name in self.providers}
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="router")
+        # (deadline, code, calls, state) of losing calls left running by a won fetch
+        self._losers: list = []
+
+    def ranked(self) -> List[ProviderType]:
+        with self._lock:
+            return sorted(self.providers, key=lambda name: self.stats[name].score())
+
+    def _call(self, name: ProviderType, code, interval, start, end, state: Dict[ProviderType, str]):
+        started = time.perf_counter()
+        try:
+            data = self.providers[name](code, interval, start, end)
+        except Exception as e:
+            LOG.warning(f"provider {name} failed for {code}: {e!r}")
+            self._record(name, None, state)
+            raise
+        latency = time.perf_counter() - started
+        valid = self.validate(data)
+        self._record(name, latency if valid else None, state)
+        metrics.record_time("provider_fetch", latency, provider=name)
+        return data
+
+    def _record(self, name: ProviderType, latency: Optional[float], state: Dict[ProviderType, str]):
+        with self._lock:
+            # a call fetch gave up on was already counted as an error
+            if state.get(name) == "timeout":
+                return
+            state[name] = "done"
+            if latency is None:
+                self.stats[name].failure()
+            else:
+                self.stats[name].success(latency)
+        if latency is None:
+            metrics.incr("provider_errors", provider=name)
+
+    def _give_up(self, code: str, running: Dict[Future, ProviderType], state: Dict[ProviderType, str]):
+        """
+            count every call still running at the deadline as an error
+        """
+        for future, name in running.items():
+            # calls still queued behind busy pool threads never reached the provider
+            if future.cancel():
+                continue
+            with self._lock:
+                if state.get(name) == "done":
+                    continue
+                state[name] = "timeout"
+                self.stats[name].failure()
+            metrics.incr("provider_errors", provider=name)
+            metrics.incr("provider_timeouts", provider=name)
+            LOG.warning(f"provider {name} timed out for {code} after {self.timeout}s")
+
+    def _expire(self):
+        """
+            give up on losing calls of earlier fetches that ran past their deadline
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [loser for loser in self._losers if loser[0] <= now]
+            self._losers = [loser for loser in self._losers if loser[0] > now and not all(
+                future.done() for future in loser[2])]
+        for _, code, running, state in expired:
+            self._give_up(code, running, state)
+
+    def _delay(self, name: ProviderType) -> float:
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            return self.stats[name].hedge_delay()
+
+    def fetch(self, code: str, interval: IntervalType = "d", start: StartEndType = None,
+              end: StartEndType = None, mode: Optional[RouteMode] = None):
+        """
+            Returns the first valid response, raises NoValidResponse when every provider failed
+        """
+        mode = mode or self.mode
+        self._expire()
+        pending = self.ranked()
+        deadline = time.monotonic() + self.timeout
+        running: Dict[Future, ProviderType] = dict()
+        state: Dict[ProviderType, str] = dict()
+
+        def launch():
+            name = pending.pop(0)
+            running[self._pool.submit(self._call, name, code, interval, start, end, state)] = name
+            return name
+
+        launch()
+        if mode == "race":
+            while pending:
+                launch()
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._give_up(code, running, state)
+                break
+            wait_for = remaining
+            if mode == "hedge" and pending:
+                wait_for = min(remaining, min(self._delay(name) for name in running.values()))
+            done, _ = wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is None and self.validate(future.result()):
+                    with self._lock:
+                        self.stats[name].wins += 1
+                    if len(self.providers) > 1:
+                        metrics.incr("provider_wins", provider=name)
+                    if running:
+                        with self._lock:
+                            self._losers.append((deadline, code, running, state))
+                    return future.result()
+            if pending and (done or mode == "hedge"):
+                # a failure or invalid response moves on at once, hedging on a timeout
+                hedged = launch()
+                if not done:
+                    metrics.incr("provider_hedges", provider=hedged)
+        raise NoValidResponse(f"no valid response for {code} {interval} {start}~{end}")
+
+    def report(self) -> Dict[ProviderType, dict]:
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def eod_source(requester=None, exchange: str = "US", timeout: Optional[float] = None) -> Source:
+    """
+        Returns an EODRequester backed source for the router, `timeout`
+        bounds the connect and read of each of its requests
+    """
+    from api.eod.base import EODRequester
+
+    requester = requester or EODRequester()
+
+    def fetch(code, interval, start, end):
+        return requester.eod_get_historical_data(code, exchange, start, end, interval, timeout=timeout)
+    return fetch
@@ -0,0 +1,185 @@
+from array import array
+from threading import Lock
+from typing import Dict, Iterable, Optional
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from check import AdjustType
+from context import tg_context
+
+BAR_FIELDS = ["open", "high", "low", "close", "volume"]
+# backtrader.date2num(datetime(1970, 1, 1))
+_BT_EPOCH = 719163.0
+_NS_PER_DAY = 86400 * 10**9
+
+
+def _to_bt_datetime(timestamp) -> np.ndarray:
+    ns = pd.to_datetime(timestamp).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    return _BT_EPOCH + ns / _NS_PER_DAY
+
+
+class BarArrays:
+    """
+    read-only contiguous arrays of one symbol, shared by every feed built on it
+    """
+    __slots__ = ("code", "datetime", "fields")
+
+    def __init__(self, code: str, datetime: np.ndarray, fields: Dict[str, np.ndarray]):
+        self.code = code
+        self.datetime = np.ascontiguousarray(datetime, dtype=np.float64)
+        self.fields = {}
+        for name, values in fields.items():
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            values.flags.writeable = False
+            self.fields[name] = values
+        self.datetime.flags.writeable = False
+
+    @classmethod
+    def from_df(cls, code: str, df: pd.DataFrame, time_field: str = "timestamp") -> "BarArrays":
+        timestamp = df[time_field] if time_field in df.columns else df.index
+        return cls(
+            code,
+            _to_bt_datetime(timestamp),
+            {name: df[name].to_numpy() for name in BAR_FIELDS if name in df.columns},
+        )
+
+    def __len__(self):
+        return len(self.datetime)
+
+    def to_df(self) -> pd.DataFrame:
+        """
+            Returns a DataFrame viewing the shared arrays, indexed by datetime
+        """
+        index = pd.to_datetime((self.datetime - _BT_EPOCH) * _NS_PER_DAY, unit="ns")
+        return pd.DataFrame(self.fields, index=index, copy=False)
+
+
+class ArrayData(bt.feed.DataBase):
+    """
+    backtrader feed over BarArrays
+
+    With preload (the cerebro default) lines are filled by bulk array copies,
+    otherwise `_load` indexes the arrays bar by bar without building rows.
+    """
+    params = (("bars", None),)
+
+    def start(self):
+        super().start()
+        self._idx = -1
+
+    def _bulk_loadable(self) -> bool:
+        return not self._filters and not self._tzinput
+
+    def preload(self):
+        if not self._bulk_loadable():
+            return super().preload()
+
+        bars: BarArrays = self.p.bars
+        lo = np.searchsorted(bars.datetime, self.fromdate, side="left")
+        hi = np.searchsorted(bars.datetime, self.todate, side="right")
+        size = int(hi - lo)
+        columns = dict(bars.fields, datetime=bars.datetime)
+        for alias in self.getlinealiases():
+            line = getattr(self.lines, alias)
+            values = columns.get(alias)
+            if values is None:
+                values = np.full(size, np.nan)
+            else:
+                values = values[lo:hi]
+            # same bookkeeping as LineBuffer.forward, without a per-bar append
+            line.array.extend(array("d", values.tobytes()))
+            line.idx += size
+            line.lencount += size
+
+        self._last()
+        self.home()
+
+    def _load(self):
+        self._idx += 1
+        bars: BarArrays = self.p.bars
+        if self._idx >= len(bars):
+            return False
+        self.lines.datetime[0] = bars.datetime[self._idx]
+        for name, values in bars.fields.items():
+            getattr(self.lines, name)[0] = values[self._idx]
+        self.lines.openinterest[0] = 0.0
+        return True
+
+
+class FeedStore:
+    """
+    lazily loaded per-symbol bar arrays, kept for the life of the process so
+    every strategy run of a parameter sweep feeds from the same memory
+    """
+
+    def __init__(
+        self,
+        schema,
+        start=None,
+        end="2050-01-01",
+        adjust: Optional[AdjustType] = None,
+        batch_size: int = 200,
+    ):
+        self.schema = schema
+        self.start = start
+        self.end = end
+        self.adjust = adjust
+        self.batch_size = batch_size
+        self._bars: Dict[str, BarArrays] = dict()
+        self._lock = Lock()
+
+    def _load(self, codes: list):
+        df = tg_context.get_data(
+            self.schema,
+            code=codes,
+            start=self.start,
+            end=self.end,
+            columns=["code", "timestamp"] + BAR_FIELDS,
+            adjust=self.adjust,
+        )
+        loaded = dict()
+        if not df.empty:
+            df = df.sort_values(["code", "timestamp"], kind="stable")
+            for code, idx in df.groupby("code", sort=False).indices.items():
+                loaded[code] = BarArrays.from_df(code, df.iloc[idx])
+        return loaded
+
+    def load(self, codes: Iterable[str]):
+        """
+        load every missing code, `batch_size` codes per query
+        """
+        with self._lock:
+            missing = [code for code in dict.fromkeys(codes) if code not in self._bars]
+            for i in range(0, len(missing), self.batch_size):
+                self._bars.update(self._load(missing[i: i + self.batch_size]))
+
+    def get(self, code: str) -> BarArrays:
+        if code not in self._bars:
+            self.load([code])
+        return self._bars[code]
+
+    def __contains__(self, code):
+        return code in self._bars
+
+    def feed(self, code: str, **kwargs) -> ArrayData:
+        """
+            Returns a new feed object over the shared arrays of `code`
+        """
+        return ArrayData(bars=self.get(code), name=code, **kwargs)
+
+    def pandas_feed(self, code: str, **kwargs) -> bt.feeds.PandasData:
+        return bt.feeds.PandasData(dataname=self.get(code).to_df(), name=code, **kwargs)
+
+    def add_feeds(self, cerebro: bt.Cerebro, codes: Iterable[str], **kwargs) -> bt.Cerebro:
+        codes = list(codes)
+        self.load(codes)
+        for code in codes:
+            if code in self._bars:
+                cerebro.adddata(self.feed(code, **kwargs), name=code)
+        return cerebro
+
+    def clear(self):
+        with self._lock:
+            self._bars.clear()
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, Float, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+
+AdjFactorBase = declarative_base()
+
+
+class AdjFactor:
+    """
+    cumulative hfq factor per code, one row per corporate action (ex-date)
+    """
+    id = Column(String(length=64), primary_key=True)
+    code = Column(String(length=32), index=True)
+    exchange = Column(String(length=16))
+    timestamp = Column(DateTime)
+    dividend = Column(Float)
+    split = Column(Float)
+    factor = Column(Float)
+
+
+class EodAdjFactor(AdjFactorBase, AdjFactor):
+    __tablename__ = "eod_adj_factor"
@@ -0,0 +1,39 @@
+class Bar:
+    """
+    lightweight kdata row returned by get_data(return_type="domain"),
+    no __dict__ and no ORM instance state
+    """
+    __slots__ = (
+        "id",
+        "code",
+        "exchange",
+        "timestamp",
+        "open",
+        "high",
+        "low",
+        "close",
+        "adjusted_close",
+        "volume",
+    )
+
+    def __init__(self, id=None, code=None, exchange=None, timestamp=None, open=None,
+                 high=None, low=None, close=None, adjusted_close=None, volume=None):
+        self.id = id
+        self.code = code
+        self.exchange = exchange
+        self.timestamp = timestamp
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.adjusted_close = adjusted_close
+        self.volume = volume
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"Bar({self.code}, {self.timestamp}, o={self.open}, h={self.high}, l={self.low}, c={self.close}, v={self.volume})"
+
+
+BAR_REQUIRED_FIELDS = {"code", "timestamp", "open", "high", "low", "close"}
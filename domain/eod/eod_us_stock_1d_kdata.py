@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, Float, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+
+EodUSStockKdataBase = declarative_base()
+
+
+class EodUSStock1dKdata(EodUSStockKdataBase):
+    __tablename__ = "eod_us_stock_1d_kdata"
+
+    id = Column(String(length=64), primary_key=True)
+    code = Column(String(length=32), index=True)
+    exchange = Column(String(length=16))
+    timestamp = Column(DateTime, index=True)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    adjusted_close = Column(Float)
+    volume = Column(Float)
@@ -0,0 +1,368 @@
+"""
+EOD fundamentals flattened to long rows:
+
+    code | statement | freq | period | filing_date | field | value | currency
+
+statement is income_statement / balance_sheet / cash_flow (freq quarterly or
+yearly, period the fiscal period end) or highlights (freq snapshot, period
+and filing_date the day it was fetched, stored again only when a number
+moved). Values are float64, non numeric fields are dropped.
+
+filing_date is when a number became public, point in time reads only see
+rows filed by their date. Statements without a filing date are taken as
+filed FILING_LAG days after the period; a later fetch changing a number
+already stored is a restatement, kept next to the original and filed on the
+fetch day, so reads before it still get what was reported then.
+
+rows live in one parquet file per (statement, freq) holding every code,
+sorted by (field, filing_date, code) in small row groups: a point in time
+screen of a few fields over the whole universe reads only the row groups of
+those fields filed by its date, the row group statistics are the index.
+"""
+import os
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from check import ProviderType, StartEndType
+from conf import DATA_PATH, FUNDAMENTALS_COMPRESSION, FUNDAMENTALS_ROW_GROUP
+from core.metrics import metrics
+
+STATEMENTS = {
+    "Income_Statement": "income_statement",
+    "Balance_Sheet": "balance_sheet",
+    "Cash_Flow": "cash_flow",
+}
+FREQS = ("quarterly", "yearly")
+SNAPSHOT = "snapshot"
+# statements a field can be qualified with, "cash_flow.netIncome"
+QUALIFIERS = set(STATEMENTS.values()) | {"highlights"}
+# days after the period end a statement without a filing date is assumed public
+FILING_LAG = {"quarterly": 45, "yearly": 90}
+META_FIELDS = {"date", "filing_date", "currency_symbol"}
+SORT = ["field", "filing_date", "code", "period"]
+
+_dict = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ("code", _dict),
+    ("statement", _dict),
+    ("freq", _dict),
+    ("period", pa.date32()),
+    ("filing_date", pa.date32()),
+    ("field", _dict),
+    ("value", pa.float64()),
+    ("currency", _dict),
+])
+
+
+def flatten_fundamentals(docs: Dict[str, dict], fetched: StartEndType = None) -> pd.DataFrame:
+    """
+    Returns the statements and highlights of EOD fundamentals documents
+    (code -> document) as long rows; values and dates are gathered as they
+    come and converted once for all documents
+    """
+    fetched = pd.Timestamp(fetched or date.today()).strftime("%Y-%m-%d")
+    cols = {name: [] for name in ("code", "statement", "freq", "period", "filing_date", "field", "value", "currency")}
+
+    def add(code, statement, freq, period, filing, currency, items):
+        fields = [(k, v) for k, v in items if k not in META_FIELDS and v is not None]
+        n = len(fields)
+        cols["code"] += [code] * n
+        cols["statement"] += [statement] * n
+        cols["freq"] += [freq] * n
+        cols["period"] += [period] * n
+        cols["filing_date"] += [filing] * n
+        cols["currency"] += [currency] * n
+        cols["field"] += [k for k, _ in fields]
+        cols["value"] += [v for _, v in fields]
+
+    for code, doc in docs.items():
+        financials = doc.get("Financials") or {}
+        for key, statement in STATEMENTS.items():
+            for freq in FREQS:
+                for period, row in ((financials.get(key) or {}).get(freq) or {}).items():
+                    if isinstance(row, dict):
+                        add(code, statement, freq, row.get("date") or period, row.get("filing_date"),
+                            row.get("currency_symbol"), row.items())
+        highlights = doc.get("Highlights")
+        if isinstance(highlights, dict):
+            add(code, "highlights", SNAPSHOT, fetched, fetched, None, highlights.items())
+
+    # the api sends numbers and dates as strings
+    value = pd.to_numeric(np.asarray(cols.pop("value"), dtype=object), errors="coerce")
+    period = pd.to_datetime(np.asarray(cols.pop("period"), dtype=object), errors="coerce", format="%Y-%m-%d")
+    filed = pd.to_datetime(np.asarray(cols.pop("filing_date"), dtype=object), errors="coerce", format="%Y-%m-%d")
+    lag = pd.to_timedelta(pd.Series(cols["freq"], dtype=object).map(FILING_LAG).fillna(0).to_numpy(), unit="D")
+    df = pd.DataFrame(cols)
+    df["period"] = period
+    df["filing_date"] = filed.where(filed.notna(), period + lag)
+    df["value"] = value
+    keep = np.isfinite(value) & period.notna()
+    return df[keep].reset_index(drop=True)[SCHEMA.names]
+
+
+def _to_table(df: pd.DataFrame) -> pa.Table:
+    return pa.Table.from_pandas(df[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+
+
+def _date(value: StartEndType):
+    return pa.scalar(pd.Timestamp(value).date(), pa.date32())
+
+
+def _to_frame(table: pa.Table) -> pd.DataFrame:
+    df = table.to_pandas()
+    for col in ("period", "filing_date"):
+        df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def _split_fields(fields: Optional[Iterable[str]]) -> Tuple[Optional[List[str]], Dict[str, set]]:
+    """
+        Returns the field names to read and, for the ones given as statement.field, the statements asked for
+    """
+    if fields is None:
+        return None, dict()
+    names, pinned = set(), dict()
+    for field in fields:
+        statement, dot, name = field.partition(".")
+        if dot and statement in QUALIFIERS:
+            pinned.setdefault(name, set()).add(statement)
+            names.add(name)
+        else:
+            names.add(field)
+    plain = {field for field in fields if "." not in field}
+    # a field also asked for plainly is read from every statement
+    return sorted(names), {name: wanted for name, wanted in pinned.items() if name not in plain}
+
+
+def _sorted(table: pa.Table) -> pa.Table:
+    # arrow can't sort dictionary columns, sort on the decoded strings
+    keys = pa.table({name: table[name].cast(pa.string()) if pa.types.is_dictionary(table.schema.field(name).type)
+                     else table[name] for name in SORT})
+    return table.take(pc.sort_indices(keys, sort_keys=[(name, "ascending") for name in SORT]))
+
+
+def _row_keys(stored: pa.Table, new: pa.Table, by_period: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+        Returns int64 (code, period, field) keys of the rows of both tables, comparable across them
+    """
+    def column(name):
+        return np.concatenate([t[name].cast(pa.string()).to_numpy(zero_copy_only=False) for t in (stored, new)])
+
+    code_ids, _ = pd.factorize(column("code"))
+    field_ids, fields = pd.factorize(column("field"))
+    days = np.concatenate([t["period"].to_numpy().astype("datetime64[D]").astype(np.int64) for t in (stored, new)])
+    days = days - days.min(initial=0) if by_period else np.zeros_like(days)
+    span = int(days.max(initial=0)) + 1
+    keys = (code_ids.astype(np.int64) * len(fields) + field_ids) * span + days
+    return keys[:stored.num_rows], keys[stored.num_rows:]
+
+
+class FundamentalStore:
+    """
+    long format fundamentals of one provider, a zstd parquet file per
+    statement and freq, sorted so the row group statistics act as the
+    (field, filing_date) index of point in time reads
+    """
+
+    def __init__(self, provider: ProviderType = "EOD", root: str = None):
+        self.root = root or os.path.join(DATA_PATH, "fundamentals", provider.lower())
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, statement: str, freq: str) -> str:
+        return os.path.join(self.root, f"{statement}.{freq}.parquet")
+
+    def partitions(self) -> List[Tuple[str, str]]:
+        """
+            Returns the stored (statement, freq) pairs
+        """
+        names = sorted(name[:-8] for name in os.listdir(self.root) if name.endswith(".parquet"))
+        return [tuple(name.split(".", 1)) for name in names]
+
+    def _merge(self, statement: str, freq: str, df: pd.DataFrame, fetched: pd.Timestamp) -> int:
+        """
+        merge the rows of one partition into its file; returns the rows added
+        """
+        path = self.path(statement, freq)
+        new = _to_table(df)
+        if os.path.exists(path):
+            old = pq.read_table(path)
+            stored = old.filter(pc.is_in(old["code"].cast(pa.string()), new["code"].cast(pa.string()).unique()))
+            # a snapshot is only stored again when a number moved
+            skey, nkey = _row_keys(stored, new, by_period=freq != SNAPSHOT)
+            # latest filing of every stored (code, period, field)
+            order = np.lexsort((stored["filing_date"].to_numpy().astype(np.int64), skey))
+            sk = skey[order]
+            last = np.r_[sk[1:] != sk[:-1], True]
+            ukey, uval = sk[last], stored["value"].to_numpy()[order][last]
+            pos = np.minimum(np.searchsorted(ukey, nkey), max(len(ukey) - 1, 0))
+            known = ukey[pos] == nkey if len(ukey) else np.zeros(len(nkey), dtype=bool)
+            value = new["value"].to_numpy()
+            same = known & np.isclose(value, uval[pos] if len(ukey) else value, rtol=1e-9, atol=0.0)
+            if same.all():
+                return 0
+            restated = known & ~same
+            if restated.any():
+                # a changed number is public from the day it was seen
+                filed = new["filing_date"].to_numpy().astype("datetime64[D]")
+                filed[restated] = np.maximum(filed[restated], np.datetime64(fetched.date(), "D"))
+                new = new.set_column(new.schema.get_field_index("filing_date"), "filing_date",
+                                     pa.array(filed, pa.date32()))
+            new = new.filter(pa.array(~same))
+            table = pa.concat_tables([old, new]).unify_dictionaries()
+        else:
+            table = new
+        tmp = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(_sorted(table).combine_chunks(), tmp, compression=FUNDAMENTALS_COMPRESSION,
+                       row_group_size=FUNDAMENTALS_ROW_GROUP)
+        os.replace(tmp, path)
+        return new.num_rows
+
+    @metrics.timed("fundamentals_write")
+    def write(self, df: pd.DataFrame, fetched: StartEndType = None) -> int:
+        """
+        merge freshly flattened rows of any number of codes with the stored
+        ones, every file rewritten once; returns the rows added (new periods,
+        fields and restatements)
+        """
+        if df is None or df.empty:
+            return 0
+        fetched = pd.Timestamp(fetched or date.today()).normalize()
+        added = 0
+        for (statement, freq), part in df.groupby(["statement", "freq"], sort=False):
+            added += self._merge(statement, freq, part, fetched)
+        metrics.incr("fundamental_rows_written", added)
+        return added
+
+    @metrics.timed("fundamentals_read")
+    def read(
+        self,
+        codes: Optional[Iterable[str]] = None,
+        fields: Optional[Iterable[str]] = None,
+        statements: Optional[Iterable[str]] = None,
+        freq: Optional[str] = None,
+        filed_by: StartEndType = None,
+    ) -> pd.DataFrame:
+        """
+            Returns the stored rows matching every given filter, `filed_by` keeps rows public by that day
+        """
+        statements = set(statements) if statements is not None else None
+        paths = [self.path(s, f) for s, f in self.partitions()
+                 if (statements is None or s in statements) and (freq is None or f == freq)]
+        fields = sorted(set(fields)) if fields is not None else None
+        codes = sorted(set(codes)) if codes is not None else None
+        filed_by = pd.Timestamp(filed_by).date() if filed_by is not None else None
+        tables = [self._read_file(path, fields, codes, filed_by) for path in paths]
+        return _to_frame(pa.concat_tables(tables) if tables else SCHEMA.empty_table())
+
+    @staticmethod
+    def _read_file(path: str, fields: Optional[List[str]], codes: Optional[List[str]],
+                   filed_by: Optional[date]) -> pa.Table:
+        f = pq.ParquetFile(path)
+        field_col, filed_col = SCHEMA.get_field_index("field"), SCHEMA.get_field_index("filing_date")
+
+        def wanted(i):
+            # rows are sorted by (field, filing_date): the min/max statistics
+            # skip the groups of other fields and the ones filed after filed_by
+            group = f.metadata.row_group(i)
+            stats = group.column(field_col).statistics
+            if fields is not None and stats is not None and stats.has_min_max:
+                lo, hi = stats.min, stats.max
+                if not any(lo <= name <= hi for name in fields):
+                    return False
+            stats = group.column(filed_col).statistics
+            if filed_by is not None and stats is not None and stats.has_min_max:
+                if stats.min > filed_by:
+                    return False
+            return True
+
+        table = f.read_row_groups([i for i in range(f.metadata.num_row_groups) if wanted(i)]).cast(SCHEMA)
+        mask = None
+        for cond in (
+            pc.is_in(table["field"].cast(pa.string()), pa.array(fields, pa.string())) if fields is not None else None,
+            pc.less_equal(table["filing_date"], _date(filed_by)) if filed_by is not None else None,
+            pc.is_in(table["code"].cast(pa.string()), pa.array(codes, pa.string())) if codes is not None else None,
+        ):
+            if cond is not None:
+                mask = cond if mask is None else pc.and_(mask, cond)
+        return table if mask is None else table.filter(mask)
+
+    def _latest(self, codes, fields, statements, freq, on, by: List[str]) -> pd.DataFrame:
+        """
+        Returns the rows of fields filed by `on`, the newest of each `by` +
+        (statement, field), with a `column` naming each row as asked for
+        """
+        names, pinned = _split_fields(fields)
+        df = self.read(codes, names, statements, freq=freq, filed_by=on)
+        column = df["field"].astype("category")
+        if pinned:
+            # a qualified field keeps its statement's rows, a plain one every statement's
+            statement, field = df["statement"], df["field"]
+            keep = ~field.isin(list(pinned))
+            column = column.cat.add_categories(
+                sorted(f"{s}.{name}" for name, wanted in pinned.items() for s in wanted))
+            for name, wanted in pinned.items():
+                for s in wanted:
+                    hit = (field == name) & (statement == s)
+                    keep |= hit
+                    column[hit] = f"{s}.{name}"
+            df, column = df[keep], column[keep]
+        df = df.assign(column=column.cat.remove_unused_categories())
+        return df.sort_values(["period", "filing_date"], kind="stable") \
+            .drop_duplicates(by + ["statement", "column"], keep="last")
+
+    @staticmethod
+    def _unambiguous(df: pd.DataFrame):
+        pairs = df[["column", "statement"]].drop_duplicates().astype(str)
+        ambiguous = pairs[pairs["column"].duplicated(keep=False)]
+        if not ambiguous.empty:
+            found = ambiguous.groupby("column")["statement"].agg(lambda s: "/".join(sorted(s)))
+            raise ValueError(
+                "fields reported in more than one statement: "
+                + ", ".join(f"{field} ({where})" for field, where in found.items())
+                + "; qualify them as statement.field, pass statements or read long rows with wide=False"
+            )
+
+    def as_of(
+        self,
+        on: StartEndType,
+        fields: Optional[Iterable[str]] = None,
+        codes: Optional[Iterable[str]] = None,
+        freq: str = "quarterly",
+        wide: bool = True,
+        statements: Optional[Iterable[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Returns the latest value of every (code, statement, field) as reported
+        on `on`: the newest period filed by then, its latest filing if
+        restated. A field given as statement.field (e.g.
+        "cash_flow.netIncome") only comes from that statement. wide gives a
+        code x field frame and raises when a field comes from more than one
+        statement, else long rows with statement, period and filing_date
+        """
+        df = self._latest(codes, fields, statements, freq, on, ["code"])
+        if not wide:
+            return df.drop(columns="column").reset_index(drop=True)
+        self._unambiguous(df)
+        return df.pivot(index="code", columns="column", values="value").rename_axis(columns="field")
+
+    def history(
+        self,
+        code: str,
+        fields: Optional[Iterable[str]] = None,
+        freq: str = "quarterly",
+        on: StartEndType = None,
+        statements: Optional[Iterable[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Returns a period x field frame of code, each period as reported on
+        `on` (default: latest); fields and statements as in as_of
+        """
+        df = self._latest([code], fields, statements, freq, on, ["period"])
+        self._unambiguous(df)
+        return df.pivot(index="period", columns="column", values="value").rename_axis(columns="field").sort_index()
@@ -0,0 +1,270 @@
+"""
+intraday bars on disk, one directory per utc day holding parquet parts of
+every symbol:
+
+    <DATA_PATH>/intraday/<provider>/<interval>/2024-01-02/<created ns>-<pid>-<seq>.parquet
+
+every write adds one part per day it touches and never rewrites the old
+ones, compact() merges the parts of a day into one; reads and compactions
+alike keep the last written row of every (code, ts). Rows are sorted by
+(code, ts) so the per code row groups stay contiguous, ts is epoch seconds
+in int64 and prices are float32, half the size of the float64/datetime
+frames the api returns and plenty for quoted prices
+"""
+import os
+import json
+import time
+import shutil
+import itertools
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from check import IntervalType, ProviderType, StartEndType
+from conf import DATA_PATH, INTRADAY_COMPACT_MIN_PARTS, INTRADAY_COMPRESSION, INTRADAY_ROW_GROUP
+from core.metrics import metrics
+from logger import LOG
+
+SCHEMA = pa.schema([
+    ("code", pa.dictionary(pa.int32(), pa.string())),
+    ("ts", pa.int64()),
+    ("open", pa.float32()),
+    ("high", pa.float32()),
+    ("low", pa.float32()),
+    ("close", pa.float32()),
+    ("volume", pa.int64()),
+])
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+DAY = 86400
+SUFFIX = ".parquet"
+_sequence = itertools.count()
+
+
+def _to_epoch(value: StartEndType) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(pd.Timestamp(value).timestamp())
+
+
+def _day_name(day: int) -> str:
+    return pd.Timestamp(day * DAY, unit="s").strftime("%Y-%m-%d")
+
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """
+        Returns df (code, ts, ohlc, volume; ts as epoch seconds or datetimes) in the store schema
+    """
+    ts = df["ts"]
+    if pd.api.types.is_datetime64_any_dtype(ts):
+        ts = ts.to_numpy("datetime64[s]").astype(np.int64)
+    columns = dict(
+        code=pa.array(df["code"].astype(str).to_numpy(), pa.string()).dictionary_encode(),
+        ts=pa.array(np.asarray(ts, dtype=np.int64)),
+        volume=pa.array(pd.to_numeric(df["volume"]).fillna(0).to_numpy(np.int64)),
+    )
+    for col in PRICE_COLUMNS:
+        columns[col] = pa.array(df[col].to_numpy(np.float32))
+    return pa.table([columns[name] for name in SCHEMA.names], schema=SCHEMA)
+
+
+def _sorted(table: pa.Table) -> pa.Table:
+    # arrow can't sort dictionary columns, sort on the decoded codes
+    keys = pa.table({"code": table["code"].cast(pa.string()), "ts": table["ts"]})
+    return table.take(pc.sort_indices(keys, sort_keys=[("code", "ascending"), ("ts", "ascending")]))
+
+
+def _merge(tables: List[pa.Table]) -> pa.Table:
+    """
+        Returns tables as one sorted table, the last row of every (code, ts) kept
+    """
+    merged = pa.concat_tables([table.cast(tables[0].schema) for table in tables]).combine_chunks()
+    frame = merged.select(["code", "ts"]).to_pandas()
+    keep = ~frame.duplicated(keep="last").to_numpy()
+    return _sorted(merged if keep.all() else merged.filter(pa.array(keep)))
+
+
+def _sources(part: pq.ParquetFile) -> List[str]:
+    meta = part.schema_arrow.metadata or {}
+    return json.loads(meta.get(b"sources", b"[]"))
+
+
+class IntradayStore:
+    """
+    day partitioned intraday bars of one provider and interval
+    """
+
+    def __init__(self, interval: IntervalType = "1m", provider: ProviderType = "EOD", root: str = None):
+        self.interval = interval
+        self.root = root or os.path.join(DATA_PATH, "intraday", provider.lower(), interval)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _day_dir(self, day: str) -> str:
+        return os.path.join(self.root, day)
+
+    def days(self) -> List[str]:
+        """
+            Returns the stored days, oldest first
+        """
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(self._day_dir(name)))
+
+    def _days_within(self, start_ts: Optional[int], end_ts: Optional[int]) -> List[str]:
+        days = []
+        for name in self.days():
+            day_ts = int(pd.Timestamp(name).timestamp())
+            if start_ts is not None and day_ts + DAY <= start_ts:
+                continue
+            if end_ts is not None and day_ts > end_ts:
+                continue
+            days.append(name)
+        return days
+
+    def parts(self, day: str) -> List[Tuple[str, pq.ParquetFile]]:
+        """
+            Returns (name, file) of the live parts of a day, oldest first; those a compaction replaced are left out
+        """
+        path = self._day_dir(day)
+        if not os.path.isdir(path):
+            return []
+        parts = [(name, pq.ParquetFile(os.path.join(path, name)))
+                 for name in sorted(os.listdir(path)) if name.endswith(SUFFIX)]
+        replaced = {name for _, part in parts for name in _sources(part)}
+        return [(name, part) for name, part in parts if name not in replaced]
+
+    @metrics.timed("intraday_write")
+    def write(self, df: pd.DataFrame) -> int:
+        """
+        add bars as one new part per day they fall on, a (code, ts) already
+        stored is replaced by the new row; returns the rows written
+        """
+        if df is None or df.empty:
+            return 0
+        table = to_table(df)
+        days = pc.divide(table["ts"], DAY).to_numpy()
+        written = 0
+        for day in np.unique(days):
+            part = table.filter(pa.array(days == day))
+            written += part.num_rows
+            self._write(self._day_dir(_day_name(int(day))), _merge([part]))
+        metrics.incr("intraday_rows_written", written, interval=self.interval)
+        return written
+
+    def _write(self, path: str, table: pa.Table, sources: Iterable[str] = (), name: str = None) -> str:
+        os.makedirs(path, exist_ok=True)
+        name = name or f"{time.time_ns()}-{os.getpid()}-{next(_sequence)}{SUFFIX}"
+        table = table.unify_dictionaries().combine_chunks()
+        table = table.replace_schema_metadata({"sources": json.dumps(sorted(sources))})
+        # written aside and renamed so readers never see half a part
+        tmp = os.path.join(path, f"{name}.tmp")
+        pq.write_table(
+            table, tmp,
+            compression=INTRADAY_COMPRESSION,
+            row_group_size=INTRADAY_ROW_GROUP,
+            use_dictionary=["code"],
+        )
+        os.replace(tmp, os.path.join(path, name))
+        return name
+
+    @metrics.timed("intraday_compact")
+    def compact(self, start: StartEndType = None, end: StartEndType = None,
+                min_parts: int = INTRADAY_COMPACT_MIN_PARTS) -> int:
+        """
+        merge the parts of every day within [start, end] holding at least
+        `min_parts` into one; returns the days compacted
+
+        the merged part lists the ones it replaces, so a reader racing the
+        compaction never sees them twice, and the replaced files are removed
+        after it is in place (or by the next compaction after a crash)
+        """
+        compacted = 0
+        for day in self._days_within(_to_epoch(start), _to_epoch(end)):
+            path = self._day_dir(day)
+            names = {name for name in os.listdir(path) if name.endswith(SUFFIX)}
+            parts = self.parts(day)
+            live = {name for name, _ in parts}
+            if len(parts) >= min_parts:
+                merged = _merge([part.read() for _, part in parts])
+                # sorts right before its newest source, so parts written meanwhile still come after it
+                name = f"{max(live)[:-len(SUFFIX)]}-compacted{SUFFIX}"
+                self._write(path, merged, sources=live, name=name)
+                compacted += 1
+                stale = names
+            else:
+                stale = names - live
+            del parts
+            for name in stale:
+                os.remove(os.path.join(path, name))
+        if compacted:
+            LOG.info(f"intraday {self.interval}: compacted {compacted} days")
+        return compacted
+
+    @metrics.timed("intraday_read")
+    def read(
+        self,
+        codes: Optional[Iterable[str]] = None,
+        start: StartEndType = None,
+        end: StartEndType = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+            Returns bars of `codes` with start <= ts <= end, sorted by day, code and ts
+        """
+        start_ts, end_ts = _to_epoch(start), _to_epoch(end)
+        if columns is not None:
+            columns = list(dict.fromkeys(["code", "ts"] + list(columns)))
+        codes = sorted(set(codes)) if codes is not None else None
+        tables = []
+        for day in self._days_within(start_ts, end_ts):
+            parts = [self._read_part(part, codes, start_ts, end_ts, columns) for _, part in self.parts(day)]
+            if len(parts) > 1:
+                tables.append(_merge(parts))
+            elif parts:
+                tables.append(parts[0])
+        if not tables:
+            return to_table(pd.DataFrame(columns=SCHEMA.names)).select(columns or SCHEMA.names).to_pandas()
+        table = pa.concat_tables(tables).unify_dictionaries()
+        metrics.incr("intraday_rows_read", table.num_rows, interval=self.interval)
+        return table.to_pandas()
+
+    @staticmethod
+    def _read_part(f: pq.ParquetFile, codes: Optional[List[str]], start_ts: Optional[int],
+                   end_ts: Optional[int], columns: Optional[List[str]]) -> pa.Table:
+        groups = list(range(f.metadata.num_row_groups))
+        if codes is not None:
+            # rows are sorted by code, so the row group code ranges barely overlap
+            # and the min/max statistics skip all but the groups holding `codes`
+            lo, hi = codes[0], codes[-1]
+            groups = [
+                i for i in groups
+                if (stats := f.metadata.row_group(i).column(0).statistics) is None
+                or not stats.has_min_max or (stats.min <= hi and stats.max >= lo)
+            ]
+        table = f.read_row_groups(groups, columns=columns).cast(
+            SCHEMA if columns is None else pa.schema([SCHEMA.field(name) for name in columns])
+        )
+        mask = None
+        if codes is not None:
+            mask = pc.is_in(table["code"].cast(pa.string()), pa.array(codes, pa.string()))
+        for cond in (
+            pc.greater_equal(table["ts"], start_ts) if start_ts is not None else None,
+            pc.less_equal(table["ts"], end_ts) if end_ts is not None else None,
+        ):
+            if cond is not None:
+                mask = cond if mask is None else pc.and_(mask, cond)
+        return table if mask is None else table.filter(mask)
+
+    def delete(self, start: StartEndType = None, end: StartEndType = None):
+        """
+        drop whole days within [start, end]
+        """
+        start_ts, end_ts = _to_epoch(start), _to_epoch(end)
+        for name in self.days():
+            day_ts = int(pd.Timestamp(name).timestamp())
+            if (start_ts is None or day_ts >= start_ts - start_ts % DAY) and (end_ts is None or day_ts <= end_ts):
+                shutil.rmtree(self._day_dir(name))
+                LOG.info(f"intraday {self.interval}: dropped {name}")
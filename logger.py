@@ -1,10 +1,16 @@
 import os
+import json
+import time
+import queue
+import atexit
+import datetime
 import logging
 import logging.handlers
+from threading import Lock
 from concurrent_log_handler import ConcurrentTimedRotatingFileHandler
 from typing import TYPE_CHECKING
 from colorlog import ColoredFormatter
-from conf import LOG_LEVEL, LOG_DIR
+from conf import LOG_LEVEL, LOG_DIR, LOG_QUEUE, LOG_FORMAT, LOG_DEDUP_WINDOW, LOG_DEDUP_BURST
 
 LOG_DIR = os.path.expanduser("~/tiger_quant/logs")
 LOG_FILENAME = os.path.join(LOG_DIR, "tiger_quant.log")
@@ -13,13 +19,123 @@ LOG_FILENAME = os.path.join(LOG_DIR, "tiger_quant.log")
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
+# attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class DedupFilter(logging.Filter):
+    """
+    rate limit repeated messages: per call site and first line of the message
+    template (record.msg before %-args, so `LOG.warning("%s failed", code)`
+    is one key while f-string messages naming different codes stay apart),
+    `burst` records pass every `window` seconds, the first record after a
+    quiet window carries the count of the ones dropped
+    """
+
+    def __init__(self, window: float = LOG_DEDUP_WINDOW, burst: int = LOG_DEDUP_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = Lock()
+        # key -> [window start, passed, suppressed]
+        self._seen = dict()
+
+    def _key(self, record: logging.LogRecord):
+        msg = record.msg if isinstance(record.msg, str) else str(record.msg)
+        first = msg.split("\n", 1)[0]
+        return record.pathname, record.lineno, record.levelno, first
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.window <= 0:
+            return True
+        key = self._key(record)
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state is not None else 0
+                self._seen[key] = [now, 1, 0]
+                if len(self._seen) > 10_000:
+                    self._forget(now)
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+    def _forget(self, now: float):
+        for key in [k for k, state in self._seen.items() if now - state[0] >= self.window and not state[2]]:
+            del self._seen[key]
+
+
+class SuppressedFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" [{suppressed} similar messages suppressed]"
+        return text
+
+
+class ColoredSuppressedFormatter(ColoredFormatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" [{suppressed} similar messages suppressed]"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    one json object per line, fields passed with `extra` are kept
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        for k, v in record.__dict__.items():
+            if k not in _RECORD_ATTRS and k not in data:
+                data[k] = v
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class FastQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for an in-process listener: the record is only merged with
+    its args (so later mutation of the args can't leak in) and put on the
+    queue, formatting and exception text happen on the listener thread
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
 
 class TigerLogger:
     def __init__(self, logger: logging.Logger) -> None:
         self._logger = logger
         self.info = logger.info
         self.debug = logger.debug
-        self.warn = logger.warn
+        self.warn = logger.warning
+        self.warning = logger.warning
         self.error = logger.error
         self.exception = logger.exception
 
@@ -37,8 +153,32 @@ class Logging:
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._logger = None
+            cls._instance._listener = None
         return cls._instance
 
+    def _handlers(self) -> list:
+        # Set up file handler
+        file_handler = ConcurrentTimedRotatingFileHandler(
+            LOG_FILENAME, when="D", interval=1, backupCount=365
+        )
+        file_handler.setLevel(LOG_LEVEL)
+        if LOG_FORMAT == "json":
+            file_formatter = JsonFormatter()
+        else:
+            file_formatter = SuppressedFormatter(
+                "[%(module)s] [%(asctime)s] [%(levelname)s]: %(message)s"
+            )
+        file_handler.setFormatter(file_formatter)
+
+        # Add colorlog formatter to console handler
+        color_formatter = ColoredSuppressedFormatter(
+            fmt="%(log_color)s[%(module)s] [%(asctime)s] [%(levelname)s]: %(message)s%(reset)s"
+        )
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(color_formatter)
+        console_handler.setLevel(logging.DEBUG)
+        return [file_handler, console_handler]
+
     def get_logger(self) -> TigerLogger:
         if self._logger is not None:
             return self._logger
@@ -53,29 +193,31 @@ class Logging:
         logger = logging.getLogger("tiger_quant")
         logger.setLevel(LOG_LEVEL)
 
-        # Set up file handler
-        file_handler = ConcurrentTimedRotatingFileHandler(
-            LOG_FILENAME, when="D", interval=1, backupCount=365
-        )
-        file_handler.setLevel(LOG_LEVEL)
-        file_formatter = logging.Formatter(
-            "[%(module)s] [%(asctime)s] [%(levelname)s]: %(message)s"
-        )
-
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
-
-        # Add colorlog formatter to console handler
-        color_formatter = ColoredFormatter(
-            fmt="%(log_color)s[%(module)s] [%(asctime)s] [%(levelname)s]: %(message)s%(reset)s"
-        )
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(color_formatter)
-        console_handler.setLevel(logging.DEBUG)
-        logger.addHandler(console_handler)
+        logger.addFilter(DedupFilter())
+        handlers = self._handlers()
+        if LOG_QUEUE:
+            # callers only pay for a queue put, one listener thread does the (file locked) writes
+            log_queue = queue.SimpleQueue()
+            logger.addHandler(FastQueueHandler(log_queue))
+            self._listener = logging.handlers.QueueListener(
+                log_queue, *handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            atexit.register(self.shutdown)
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
 
         self._logger = TigerLogger(logger)
         return self._logger
 
+    def shutdown(self):
+        """
+        drain the queue and stop the listener thread
+        """
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
 
-LOG = Logging().get_logger()
\ No newline at end of file
+LOG = Logging().get_logger()
@@ -0,0 +1,279 @@
+"""
+session phases of an exchange, precomputed per trading day: every phase
+boundary of every trading day in the calendar as one sorted UTC array, so
+the phase of any number of timestamps is one binary search
+
+    clock = market_clock("SH")
+    clock.phase(ts)              # MarketPhase values
+    clock.next_boundary(ts)      # UTC datetime64 the phase changes at
+    clock.minutes_to_close(ts)   # to the close of the current or next session
+    clock.seconds_until_active() # 0.0 while trading, what to sleep otherwise
+
+timestamps are epoch seconds (ints, as the intraday stores keep them) or
+anything pandas parses, naive ones taken as UTC; a scalar in gives a scalar out
+"""
+import ast
+import time
+import importlib.util
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar, GoodFriday, Holiday, USLaborDay, USMartinLutherKingJr, USMemorialDay,
+    USPresidentsDay, USThanksgivingDay, nearest_workday, sunday_to_monday,
+)
+
+from check import MarketPhase, StartEndType
+from conf import MARKET_CALENDAR_END, MARKET_CLOSURES
+from logger import LOG
+
+# phases start at the local time they are listed with and last until the next one
+SESSIONS: Dict[str, dict] = {
+    "CN": dict(tz="Asia/Shanghai", close="15:00", phases=[
+        ("09:00", MarketPhase.PRE_OPEN),
+        ("09:15", MarketPhase.PRE_OPEN_CALL_P1),
+        ("09:25", MarketPhase.PRE_OPEN_CALL_P2),
+        ("09:30", MarketPhase.CONT_TRADE),
+        ("11:30", MarketPhase.LUNCHBREAK),
+        ("13:00", MarketPhase.CONT_TRADE),
+        ("14:53", MarketPhase.CONT_TRADE_PRE_CLOSE),
+        ("14:57", MarketPhase.PRE_CLOSE_CALL),
+        ("15:00", MarketPhase.CLOSED),
+    ]),
+    "US": dict(tz="America/New_York", close="16:00", phases=[
+        ("04:00", MarketPhase.PRE_OPEN),
+        ("09:30", MarketPhase.CONT_TRADE),
+        ("16:00", MarketPhase.POST_CLOSE),
+        ("20:00", MarketPhase.CLOSED),
+    ]),
+}
+EXCHANGES = {"SH": "CN", "SZ": "CN", "BJ": "CN", "CN": "CN", "US": "US"}
+# phases new trades and bars come in
+ACTIVE_PHASES: FrozenSet[str] = frozenset({
+    MarketPhase.PRE_OPEN_CALL_P1,
+    MarketPhase.PRE_OPEN_CALL_P2,
+    MarketPhase.CONT_TRADE,
+    MarketPhase.CONT_TRADE_PRE_CLOSE,
+    MarketPhase.PRE_CLOSE_CALL,
+})
+# calendars start here when none is given, and reach conf.MARKET_CALENDAR_END
+CALENDAR_START = "2000-01-01"
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """
+    full day NYSE holidays; a new year's day falling on a saturday is not
+    made up on the friday before
+    """
+    rules = [
+        Holiday("New Years Day", month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday("Juneteenth", month=6, day=19, start_date="2022-01-01", observance=nearest_workday),
+        Holiday("Independence Day", month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday("Christmas", month=12, day=25, observance=nearest_workday),
+    ]
+
+
+def _utc_ns(values) -> np.ndarray:
+    values = np.atleast_1d(np.asarray(values))
+    if values.dtype.kind in "iu":
+        return values.astype(np.int64) * 10 ** 9
+    if values.dtype.kind == "f":
+        return (values * 1e9).astype(np.int64)
+    return pd.DatetimeIndex(pd.to_datetime(values, utc=True)).as_unit("ns").asi8
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def cn_trade_cal() -> np.ndarray:
+    """
+    Returns the days of trade_cal.cn_trade_cal as sorted datetime64[D]; read
+    from its source, importing trade_cal raises once the list has run out
+    """
+    path = importlib.util.find_spec("trade_cal").origin
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "cn_trade_cal" for t in node.targets):
+            return np.sort(np.array(ast.literal_eval(node.value), dtype="datetime64[D]"))
+    raise ValueError(f"no cn_trade_cal list in {path}")
+
+
+def default_calendar(market: str) -> np.ndarray:
+    """
+    Returns the trading days of market as datetime64[D] through
+    MARKET_CALENDAR_END: weekdays minus MARKET_CLOSURES, minus the NYSE
+    holidays for US, and for CN the days of trade_cal where it has them.
+    Raises once today is past the end rather than guess at holidays
+    """
+    if market not in MARKET_CALENDAR_END:
+        raise ValueError(f"no trading calendar for market {market}, pass calendar=")
+    end = pd.Timestamp(MARKET_CALENDAR_END[market])
+    if pd.Timestamp.today().normalize() > end:
+        raise RuntimeError(f"market clock {market}: trading calendar ends {end.date()}, "
+                           "extend conf.MARKET_CALENDAR_END and MARKET_CLOSURES")
+    days = pd.bdate_range(CALENDAR_START, end)
+    if market == "US":
+        days = days.difference(NYSEHolidayCalendar().holidays(CALENDAR_START, end))
+    days = days.difference(pd.DatetimeIndex(MARKET_CLOSURES.get(market, []))).to_numpy("datetime64[D]")
+    if market != "CN":
+        return days
+    listed = cn_trade_cal()
+    return np.r_[listed, days[days > listed[-1]]]
+
+
+class MarketClock:
+    """
+    phase lookups for one market; `bounds` holds the UTC ns every phase of
+    every trading day starts at, `phase_ids` the phase it starts, `closes`
+    the UTC ns of every session close
+    """
+
+    def __init__(self, exchange: str = "CN", calendar: Optional[Iterable[StartEndType]] = None):
+        self.market = EXCHANGES.get(exchange, exchange)
+        if self.market not in SESSIONS:
+            raise ValueError(f"no session times for exchange {exchange}")
+        session = SESSIONS[self.market]
+        self.tz = session["tz"]
+        if calendar is None:
+            days = default_calendar(self.market)
+        else:
+            days = np.unique(pd.to_datetime(list(calendar)).to_numpy("datetime64[D]"))
+        self.days = days
+        self.names = np.array([MarketPhase.CLOSED] + [phase for _, phase in session["phases"]], dtype=object)
+        offsets = np.array([_minutes(start) for start, _ in session["phases"]], dtype="timedelta64[m]")
+        self.bounds = self._utc(days, offsets).ravel()
+        self.phase_ids = np.tile(np.arange(1, len(offsets) + 1, dtype=np.int8), len(days))
+        self.closes = self._utc(days, np.array([_minutes(session["close"])], dtype="timedelta64[m]")).ravel()
+
+    def _utc(self, days: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """
+            Returns (len(days), len(offsets)) UTC ns of the local times day + offset
+        """
+        local = (days.astype("datetime64[m]")[:, None] + offsets[None, :]).ravel()
+        utc = pd.DatetimeIndex(local).tz_localize(self.tz)
+        return utc.tz_convert("UTC").as_unit("ns").asi8.reshape(len(days), len(offsets))
+
+    @staticmethod
+    def _out(values: np.ndarray, like):
+        return values if np.ndim(like) else values[0]
+
+    def _positions(self, ns: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.bounds, ns, side="right") - 1
+
+    def phase(self, ts):
+        """
+            Returns the MarketPhase of each timestamp
+        """
+        pos = self._positions(_utc_ns(ts))
+        # before the first boundary, after the last close and on days off the market is closed
+        ids = np.where(pos >= 0, self.phase_ids[np.maximum(pos, 0)], 0)
+        return self._out(self.names[ids], ts)
+
+    def next_boundary(self, ts):
+        """
+            Returns the UTC time the phase of each timestamp ends, NaT past the calendar
+        """
+        pos = self._positions(_utc_ns(ts)) + 1
+        ns = np.where(pos < len(self.bounds), self.bounds[np.minimum(pos, len(self.bounds) - 1)],
+                      np.iinfo(np.int64).min)
+        return self._out(ns.astype("datetime64[ns]"), ts)
+
+    def _to_close(self, ns: np.ndarray) -> np.ndarray:
+        pos = np.searchsorted(self.closes, ns, side="left")
+        close = self.closes[np.minimum(pos, len(self.closes) - 1)]
+        return np.where(pos < len(self.closes), (close - ns) / 6e10, np.nan)
+
+    def minutes_to_close(self, ts):
+        """
+            Returns the minutes from each timestamp to the close of its session or the next one
+        """
+        return self._out(self._to_close(_utc_ns(ts)), ts)
+
+    def is_active(self, ts, phases: Iterable[str] = ACTIVE_PHASES):
+        return self._out(np.isin(np.atleast_1d(self.phase(ts)), list(phases)), ts)
+
+    def state(self, ts) -> pd.DataFrame:
+        """
+            Returns phase, next_boundary, next_phase and minutes_to_close per timestamp
+        """
+        ns = _utc_ns(ts)
+        pos = self._positions(ns)
+        nxt = np.minimum(pos + 1, len(self.bounds) - 1)
+        past = pos + 1 >= len(self.bounds)
+        return pd.DataFrame({
+            "phase": self.names[np.where(pos >= 0, self.phase_ids[np.maximum(pos, 0)], 0)],
+            "next_boundary": np.where(past, np.iinfo(np.int64).min, self.bounds[nxt]).astype("datetime64[ns]"),
+            "next_phase": np.where(past, None, self.names[self.phase_ids[nxt]]),
+            "minutes_to_close": self._to_close(ns),
+        }, index=pd.DatetimeIndex(ns.astype("datetime64[ns]"), name="utc"))
+
+    def sessions(self, day: StartEndType) -> pd.DataFrame:
+        """
+            Returns the phases of day with their local start and end, empty on a day off
+        """
+        k = int(np.searchsorted(self.days, np.datetime64(pd.Timestamp(day).date(), "D")))
+        if k >= len(self.days) or self.days[k] != np.datetime64(pd.Timestamp(day).date(), "D"):
+            return pd.DataFrame(columns=["phase", "start", "end"])
+        per_day = len(self.bounds) // len(self.days)
+        starts = pd.DatetimeIndex(self.bounds[k * per_day:(k + 1) * per_day]).tz_localize("UTC").tz_convert(self.tz)
+        names = self.names[self.phase_ids[k * per_day:(k + 1) * per_day]]
+        # the last entry of a day is the market closing, not a phase of the session
+        return pd.DataFrame({"phase": names[:-1], "start": starts[:-1], "end": starts[1:]})
+
+    def seconds_until_active(self, now=None, phases: Iterable[str] = ACTIVE_PHASES) -> float:
+        """
+            Returns 0.0 when now is in one of phases, else the seconds until one starts, inf past the calendar
+        """
+        ns = int(_utc_ns(time.time() if now is None else now)[0])
+        pos = int(self._positions(np.array([ns]))[0])
+        active = np.isin(self.names[self.phase_ids], list(phases))
+        if pos >= 0 and active[pos]:
+            return 0.0
+        ahead = np.flatnonzero(active[pos + 1:])
+        if not len(ahead):
+            return float("inf")
+        return (int(self.bounds[pos + 1 + ahead[0]]) - ns) / 1e9
+
+    def seconds_to_boundary(self, now=None) -> float:
+        """
+            Returns the seconds until the phase of now changes, inf past the calendar
+        """
+        ns = int(_utc_ns(time.time() if now is None else now)[0])
+        pos = int(self._positions(np.array([ns]))[0]) + 1
+        return (int(self.bounds[pos]) - ns) / 1e9 if pos < len(self.bounds) else float("inf")
+
+    def sleep_until_active(self, phases: Iterable[str] = ACTIVE_PHASES, sleep: Callable[[float], None] = time.sleep,
+                           now: Callable[[], float] = time.time) -> float:
+        """
+            block until one of phases starts; returns the seconds slept
+        """
+        wait = self.seconds_until_active(now(), phases)
+        if wait == float("inf"):
+            raise RuntimeError(f"market clock {self.market}: no active phase left in the calendar")
+        if wait > 0:
+            LOG.info(f"market clock {self.market}: {self.phase(now())}, sleeping {wait:.0f}s until active")
+            sleep(wait)
+        return wait
+
+
+@lru_cache(maxsize=None)
+def _market_clock(market: str) -> MarketClock:
+    return MarketClock(market)
+
+
+def market_clock(exchange: str = "CN") -> MarketClock:
+    """
+        Returns the shared clock of the market exchange trades on
+    """
+    return _market_clock(EXCHANGES.get(exchange, exchange))
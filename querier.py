@@ -0,0 +1,461 @@
+"""
+small predicate DSL compiled into parametrized statements
+
+    from querier import F, Query
+
+    where = F("code").isin(codes) & F("timestamp").between("2020-01-01", "2021-01-01")
+    where &= F("close").gt(10)
+    Query(schema, columns=["code", "timestamp", "close"], where=where).read_df(bind)
+
+Numeric predicates follow utils.gt/lt/eq/between, i.e. they hold beyond
+`precision`; dates and strings compare exactly, strings compared with a
+Date or DateTime column are parsed as dates when bound. Predicates only carry
+values, the statement itself is built and compiled once per query shape and
+every call binds its own values.
+"""
+import numbers
+import operator
+from collections import namedtuple
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Date, DateTime, TypeDecorator, and_, bindparam, not_, or_, select
+from sqlalchemy.engine import Engine
+
+PRECISION = 1e-4
+
+_SQL_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _normalize(value):
+    if isinstance(value, (np.generic,)):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+
+class Predicate:
+    """
+    primitive predicates are ("in", field) and ("cmp", field, op), composed
+    with ("and", ...), ("or", ...) and ("not", child)
+    """
+    __slots__ = ("kind", "field", "op", "values", "children")
+
+    def __init__(self, kind: str, field: str = None, op: str = None, values: tuple = (), children: tuple = ()):
+        self.kind = kind
+        self.field = field
+        self.op = op
+        self.values = values
+        self.children = children
+
+    def __and__(self, other: "Predicate") -> "Predicate":
+        return _combine("and", self, other)
+
+    def __or__(self, other: "Predicate") -> "Predicate":
+        return _combine("or", self, other)
+
+    def __invert__(self) -> "Predicate":
+        return Predicate("not", children=(self,))
+
+    def shape(self) -> tuple:
+        """
+            Returns the hashable structure of the predicate, without values
+        """
+        if self.kind == "in":
+            return ("in", self.field)
+        if self.kind == "cmp":
+            return ("cmp", self.field, self.op)
+        return (self.kind,) + tuple(child.shape() for child in self.children)
+
+    def params(self) -> list:
+        """
+            Returns bound values in the order of `shape`
+        """
+        if self.kind in ("in", "cmp"):
+            return list(self.values)
+        params = []
+        for child in self.children:
+            params.extend(child.params())
+        return params
+
+    def fields(self) -> set:
+        if self.field is not None:
+            return {self.field}
+        return set().union(*(child.fields() for child in self.children))
+
+    def to_mask(self, frame) -> np.ndarray:
+        """
+        evaluate on a columnar frame (DataFrame, dict of arrays, structured array)
+        """
+        if self.kind == "in":
+            return np.isin(np.asarray(frame[self.field]), list(self.values[0]))
+        if self.kind == "cmp":
+            column = np.asarray(frame[self.field])
+            value = self.values[0]
+            if np.issubdtype(column.dtype, np.datetime64):
+                value = np.datetime64(pd.Timestamp(value))
+            return _SQL_OPS[self.op](column, value)
+        masks = [child.to_mask(frame) for child in self.children]
+        if self.kind == "and":
+            return np.logical_and.reduce(masks)
+        if self.kind == "or":
+            return np.logical_or.reduce(masks)
+        return ~masks[0]
+
+
+def _combine(kind: str, left: Optional[Predicate], right: Optional[Predicate]) -> Optional[Predicate]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    children = []
+    for pred in (left, right):
+        children.extend(pred.children if pred.kind == kind else (pred,))
+    return Predicate(kind, children=tuple(children))
+
+
+def all_of(*preds: Optional[Predicate]) -> Optional[Predicate]:
+    where = None
+    for pred in preds:
+        where = _combine("and", where, pred)
+    return where
+
+
+class Field:
+    def __init__(self, name: str):
+        self.name = name
+
+    def _cmp(self, op: str, value) -> Predicate:
+        return Predicate("cmp", self.name, op, (_normalize(value),))
+
+    def isin(self, values: Iterable) -> Predicate:
+        if isinstance(values, str):
+            values = [values]
+        return Predicate("in", self.name, values=([_normalize(v) for v in values],))
+
+    def gt(self, value, precision: float = PRECISION) -> Predicate:
+        if _is_number(value):
+            return self._cmp(">", value + precision)
+        return self._cmp(">", value)
+
+    def lt(self, value, precision: float = PRECISION) -> Predicate:
+        if _is_number(value):
+            return self._cmp("<", value - precision)
+        return self._cmp("<", value)
+
+    def gte(self, value, precision: float = PRECISION) -> Predicate:
+        if _is_number(value):
+            return self._cmp(">", value - precision)
+        return self._cmp(">=", value)
+
+    def lte(self, value, precision: float = PRECISION) -> Predicate:
+        if _is_number(value):
+            return self._cmp("<", value + precision)
+        return self._cmp("<=", value)
+
+    def eq(self, value, precision: float = PRECISION) -> Predicate:
+        if _is_number(value):
+            return self._cmp(">", value - precision) & self._cmp("<", value + precision)
+        return self._cmp("=", value)
+
+    def between(self, lower, upper, precision: float = PRECISION) -> Predicate:
+        return self.gte(lower, precision) & self.lte(upper, precision)
+
+    __gt__ = gt
+    __lt__ = lt
+    __ge__ = gte
+    __le__ = lte
+    __eq__ = eq
+
+    def __ne__(self, value) -> Predicate:
+        return ~self.eq(value)
+
+    __hash__ = None
+
+
+F = Field
+
+OrderType = Union[str, List[str], Tuple[str, ...]]
+
+
+def _column_name(col) -> str:
+    if isinstance(col, str):
+        return col
+    # InstrumentedAttribute / Column
+    return col.key
+
+
+def _order_clause(table, order: str):
+    if order.startswith("-"):
+        return table.c[order[1:]].desc()
+    return table.c[order].asc()
+
+
+class _DateTimeBind(TypeDecorator):
+    """
+    DateTime bind that also takes strings, parsed when the value is bound
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return pd.Timestamp(value).to_pydatetime() if isinstance(value, str) else value
+
+
+class _DateBind(TypeDecorator):
+    impl = Date
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return pd.Timestamp(value).date() if isinstance(value, str) else value
+
+
+def _bind_type(column):
+    """
+        Returns the type values compared with column are bound as
+    """
+    if isinstance(column.type, DateTime):
+        return _DateTimeBind(timezone=column.type.timezone)
+    if isinstance(column.type, Date):
+        return _DateBind()
+    return column.type
+
+
+def _where_clause(table, shape: tuple, names: Iterable[str]):
+    kind = shape[0]
+    if kind == "in":
+        return table.c[shape[1]].in_(bindparam(next(names), expanding=True))
+    if kind == "cmp":
+        column = table.c[shape[1]]
+        return _SQL_OPS[shape[2]](column, bindparam(next(names), type_=_bind_type(column)))
+    clauses = [_where_clause(table, child, names) for child in shape[1:]]
+    if kind == "and":
+        return and_(*clauses)
+    if kind == "or":
+        return or_(*clauses)
+    return not_(clauses[0])
+
+
+def _param_names():
+    i = 0
+    while True:
+        yield f"p{i}"
+        i += 1
+
+
+@lru_cache(maxsize=1024)
+def build_statement(schema, columns: Optional[tuple], where_shape: Optional[tuple],
+                    order: tuple, has_limit: bool):
+    """
+    build the select of one query shape, cached for every later call
+    """
+    table = schema.__table__
+    if columns:
+        stmt = select(*[table.c[col] for col in columns])
+    else:
+        stmt = select(schema)
+    if where_shape:
+        stmt = stmt.where(_where_clause(table, where_shape, _param_names()))
+    if order:
+        stmt = stmt.order_by(*[_order_clause(table, o) for o in order])
+    if has_limit:
+        stmt = stmt.limit(bindparam("limit"))
+    return stmt
+
+
+_PLACEHOLDERS = {"qmark": "?", "format": "%s"}
+_POSTCOMPILE = "__[POSTCOMPILE_{}]"
+
+
+def _iso_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _iso_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=256)
+def row_type(name: str, columns: tuple) -> type:
+    """
+        Returns the namedtuple used for rows of `columns`
+    """
+    return namedtuple(name, columns, rename=True)
+
+
+class CompiledQuery:
+    """
+    SQL of one query shape rendered for one dialect, executed on the raw
+    DBAPI cursor so a repeated query only pays for binding its values
+    """
+    __slots__ = ("sql", "positions", "expanding", "processors", "defaults",
+                 "placeholder", "columns", "date_columns", "converters")
+
+    def __init__(self, stmt, dialect):
+        compiled = stmt.compile(dialect=dialect)
+        binds = compiled.binds
+        self.sql = compiled.string
+        self.positions = tuple(compiled.positiontup)
+        self.expanding = frozenset(name for name in self.positions if binds[name].expanding)
+        self.processors = {
+            name: binds[name].type.dialect_impl(dialect).bind_processor(dialect)
+            for name in self.positions
+        }
+        self.defaults = {name: binds[name].value for name in self.positions if not binds[name].required}
+        self.placeholder = _PLACEHOLDERS[dialect.paramstyle]
+        self.columns = [col.name for col in stmt.selected_columns]
+        self.date_columns = [
+            col.name for col in stmt.selected_columns if isinstance(col.type, (Date, DateTime))
+        ]
+        # sqlite hands dates back as ISO strings
+        self.converters = tuple(
+            (i, _iso_datetime if isinstance(col.type, DateTime) else _iso_date)
+            for i, col in enumerate(stmt.selected_columns)
+            if isinstance(col.type, (Date, DateTime))
+        )
+
+    def render(self, params: dict) -> Tuple[str, list]:
+        sql = self.sql
+        args = []
+        for name in self.positions:
+            value = params[name] if name in params else self.defaults[name]
+            process = self.processors[name]
+            if name in self.expanding:
+                values = [process(v) for v in value] if process else list(value)
+                marks = ", ".join([self.placeholder] * len(values)) or "NULL"
+                sql = sql.replace(_POSTCOMPILE.format(name), marks)
+                args.extend(values)
+            else:
+                args.append(process(value) if process else value)
+        return sql, args
+
+    def fetchall(self, engine: Engine, params: dict) -> list:
+        sql, args = self.render(params)
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, args)
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        return rows
+
+    def fetch_rows(self, engine: Engine, params: dict) -> list:
+        """
+            Returns plain tuples with dates converted
+        """
+        rows = self.fetchall(engine, params)
+        if not rows or not self.converters:
+            return rows
+        cols = list(zip(*rows))
+        for i, convert in self.converters:
+            cols[i] = map(convert, cols[i])
+        return list(zip(*cols))
+
+    def read_df(self, engine: Engine, params: dict) -> pd.DataFrame:
+        df = pd.DataFrame.from_records(self.fetchall(engine, params), columns=self.columns)
+        for col in self.date_columns:
+            df[col] = pd.to_datetime(df[col], format="ISO8601")
+        return df
+
+
+@lru_cache(maxsize=1024)
+def compile_query(schema, columns: Optional[tuple], where_shape: Optional[tuple],
+                  order: tuple, has_limit: bool, dialect) -> CompiledQuery:
+    stmt = build_statement(schema, columns, where_shape, order, has_limit)
+    return CompiledQuery(stmt, dialect)
+
+
+class Query:
+    def __init__(
+        self,
+        schema,
+        columns: Optional[list] = None,
+        where: Optional[Predicate] = None,
+        order: Optional[OrderType] = None,
+        limit: Optional[int] = None,
+    ):
+        self.schema = schema
+        self.columns = tuple(_column_name(col) for col in columns) if columns else None
+        self.where = where
+        if isinstance(order, str):
+            order = (order,)
+        self.order = tuple(order) if order else ()
+        self.limit = limit
+
+    def shape(self) -> tuple:
+        return (
+            self.schema.__tablename__,
+            self.columns,
+            self.where.shape() if self.where is not None else None,
+            self.order,
+            self.limit is not None,
+        )
+
+    @property
+    def statement(self):
+        return build_statement(*self.shape_args())
+
+    def shape_args(self) -> tuple:
+        return (
+            self.schema,
+            self.columns,
+            self.where.shape() if self.where is not None else None,
+            self.order,
+            self.limit is not None,
+        )
+
+    def compiled(self, dialect) -> Optional[CompiledQuery]:
+        """
+            Returns the cached compiled query, None when the dialect's
+            paramstyle is not rendered by CompiledQuery
+        """
+        if dialect.paramstyle not in _PLACEHOLDERS:
+            return None
+        return compile_query(*self.shape_args(), dialect)
+
+    def params(self) -> dict:
+        params = {}
+        if self.where is not None:
+            params = {f"p{i}": v for i, v in enumerate(self.where.params())}
+        if self.limit is not None:
+            params["limit"] = self.limit
+        return params
+
+    def read_df(self, bind) -> pd.DataFrame:
+        compiled = self.compiled(bind.dialect) if isinstance(bind, Engine) else None
+        if compiled is None:
+            return pd.read_sql(self.statement, bind, params=self.params())
+        return compiled.read_df(bind, self.params())
+
+    def evaluate(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        same query over an in-memory columnar frame
+        """
+        if self.where is not None:
+            frame = frame[self.where.to_mask(frame)]
+        if self.order:
+            by = [o.lstrip("-") for o in self.order]
+            ascending = [not o.startswith("-") for o in self.order]
+            frame = frame.sort_values(by, ascending=ascending, kind="stable")
+        if self.columns:
+            frame = frame[list(self.columns)]
+        if self.limit is not None:
+            frame = frame.iloc[: self.limit]
+        return frame
@@ -0,0 +1,53 @@
+import argparse
+from typing import Optional
+
+import pandas as pd
+
+from api.eod.base import EODRequester
+from constituent_store import ConstituentStore, intervals_from_eod
+from logger import LOG
+
+SECTION = "HistoricalTickerComponents"
+
+
+class EodUSIndexConstituentsRecorder:
+    """
+    the full membership history of an index comes in one document, every
+    run replaces the stored intervals of the index with it
+    """
+    exchange = "INDX"
+
+    def __init__(self, requester: EODRequester = None, store: ConstituentStore = None):
+        self.requester = requester or EODRequester()
+        self.store = store or ConstituentStore("EOD")
+
+    def fetch(self, index: str) -> Optional[pd.DataFrame]:
+        """
+            Returns the membership intervals of index
+        """
+        doc = self.requester.eod_get_fundamental_data(index, self.exchange, SECTION)
+        if not isinstance(doc, dict):
+            return None
+        # a single section filter returns the section itself
+        components = doc.get(SECTION, doc)
+        return intervals_from_eod(index, components)
+
+    def run(self, indexes: list) -> int:
+        """
+            Returns the intervals stored
+        """
+        stored = 0
+        for index in indexes:
+            df = self.fetch(index)
+            if df is None or df.empty:
+                LOG.warning(f"{index}: no constituents")
+                continue
+            stored += self.store.write(index, df)
+        return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("indexes", nargs="*", default=["GSPC"], help="EOD index codes, e.g. GSPC NDX")
+    args = parser.parse_args()
+    EodUSIndexConstituentsRecorder().run(args.indexes)
@@ -0,0 +1,91 @@
+import argparse
+
+import pandas as pd
+
+from adjuster import compute_adj_factors
+from api.eod.base import EODRequester
+from context import tg_context
+from core.profiler import ProfileMode, TaskSampler, add_profile_args, profiled
+from domain.adj_factor import AdjFactorBase, EodAdjFactor
+from logger import LOG
+
+
+class EodUSStockAdjFactorRecorder:
+    """
+    refresh cumulative adjustment factors from EOD dividends/splits,
+    only codes with new corporate actions are recomputed and invalidated
+    """
+    factor_schema = EodAdjFactor
+    exchange = "US"
+
+    def __init__(self, kdata_schema, requester: EODRequester = None):
+        self.kdata_schema = kdata_schema
+        self.requester = requester or EODRequester()
+        tg_context.register_schema("eod", AdjFactorBase)
+
+    def _fetch_actions(self, code: str):
+        dividends = self.requester.eod_get_dividends(code, self.exchange)
+        splits = self.requester.eod_get_splits(code, self.exchange)
+        if dividends is not None and not dividends.empty:
+            dividends = pd.DataFrame({
+                "code": code,
+                "timestamp": pd.to_datetime(dividends.index),
+                "dividend": pd.to_numeric(dividends.iloc[:, 0], errors="coerce").fillna(0.0).to_numpy(),
+            })
+        if splits is not None and not splits.empty:
+            splits = pd.DataFrame({
+                "code": code,
+                "timestamp": pd.to_datetime(splits.index),
+                "split": splits.iloc[:, 0].to_numpy(),
+            })
+        return dividends, splits
+
+    def _stored_event_dates(self, code: str) -> set:
+        df = tg_context.get_data(self.factor_schema, code=code, columns=["timestamp"])
+        return set(pd.to_datetime(df["timestamp"]))
+
+    def record(self, code: str) -> bool:
+        """
+            Returns True when new corporate actions landed and factors were rebuilt
+        """
+        dividends, splits = self._fetch_actions(code)
+        dates = set()
+        for actions in (dividends, splits):
+            if actions is not None and not actions.empty:
+                dates.update(actions["timestamp"])
+        if not dates or dates <= self._stored_event_dates(code):
+            return False
+
+        bars = tg_context.get_data(self.kdata_schema, code=code, columns=["code", "timestamp", "close"])
+        factors = compute_adj_factors(bars, dividends, splits)
+        factors["exchange"] = self.exchange
+        factors["id"] = factors["code"] + "_" + factors["timestamp"].dt.strftime("%Y-%m-%d")
+        tg_context.del_data(self.factor_schema, filters=[self.factor_schema.code == code])
+        tg_context.save(factors, self.factor_schema)
+        LOG.info(f"{code}: {len(factors)} adj factors rebuilt")
+        return True
+
+    def run(self, codes: list, profile: ProfileMode = None, profile_tasks: float = 0.0):
+        """
+        `profile` profiles the whole run, with `profile_tasks` only that share
+        of the per code records is profiled instead
+        """
+        kls = self.__class__.__name__
+        record = self.record
+        if profile_tasks:
+            record = TaskSampler(kls, profile or "sample", profile_tasks).wrap(record, task_name=lambda code: code)
+            profile = None
+        with profiled(kls, profile, codes=len(codes), exchange=self.exchange):
+            updated = [code for code in codes if record(code)]
+        LOG.info(f"adj factors updated for {len(updated)}/{len(codes)} codes")
+        return updated
+
+
+if __name__ == "__main__":
+    from domain.eod.eod_us_stock_1d_kdata import EodUSStock1dKdata, EodUSStockKdataBase
+
+    parser = add_profile_args(argparse.ArgumentParser())
+    parser.add_argument("codes", nargs="+")
+    args = parser.parse_args()
+    tg_context.register_schema("eod", EodUSStockKdataBase)
+    EodUSStockAdjFactorRecorder(EodUSStock1dKdata).run(args.codes, args.profile, args.profile_tasks)
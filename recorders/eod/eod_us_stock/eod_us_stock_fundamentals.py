@@ -0,0 +1,68 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import pandas as pd
+
+from api.eod.base import EODRequester
+from check import StartEndType
+from core.profiler import ProfileMode, add_profile_args, profiled
+from fundamental_store import FundamentalStore, flatten_fundamentals
+from logger import LOG
+from utils import chunks
+
+# only what gets flattened, the rest of the document is not downloaded
+SECTIONS = "Highlights,Financials"
+
+
+class EodUSStockFundamentalsRecorder:
+    """
+    pull the fundamentals document of many symbols, `workers` at a time,
+    flatten every batch of documents to long rows at once and merge it into
+    the store in one pass per file; unchanged numbers are not rewritten,
+    changed ones are kept as restatements
+    """
+    exchange = "US"
+
+    def __init__(self, requester: EODRequester = None, store: FundamentalStore = None, workers: int = 16):
+        self.requester = requester or EODRequester()
+        self.store = store or FundamentalStore("EOD")
+        self.workers = workers
+
+    def fetch(self, code: str) -> Optional[dict]:
+        """
+            Returns the fundamentals document of code
+        """
+        doc = self.requester.eod_get_fundamental_data(code, self.exchange, SECTIONS)
+        return doc if isinstance(doc, dict) else None
+
+    def run(self, codes: list, fetched: StartEndType = None, batch_size: int = 500,
+            profile: ProfileMode = None) -> int:
+        """
+            Returns the rows added to the store
+        """
+        fetched = pd.Timestamp(fetched or pd.Timestamp.today()).normalize()
+
+        def safe_fetch(code):
+            try:
+                return code, self.fetch(code)
+            except Exception as e:
+                LOG.warning(f"{code}: fundamentals fetch failed: {e!r}")
+                return code, None
+
+        added = 0
+        with profiled(self.__class__.__name__, profile, codes=len(codes)), \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fundamentals") as executor:
+            for batch in chunks(codes, batch_size):
+                docs = {code: doc for code, doc in executor.map(safe_fetch, batch) if doc is not None}
+                if docs:
+                    added += self.store.write(flatten_fundamentals(docs, fetched), fetched)
+        LOG.info(f"fundamentals: {added} rows added for {len(codes)} codes")
+        return added
+
+
+if __name__ == "__main__":
+    parser = add_profile_args(argparse.ArgumentParser())
+    parser.add_argument("codes", nargs="+")
+    args = parser.parse_args()
+    EodUSStockFundamentalsRecorder().run(args.codes, profile=args.profile)
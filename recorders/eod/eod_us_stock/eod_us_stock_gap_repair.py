@@ -0,0 +1,89 @@
+import argparse
+from typing import Optional
+
+import pandas as pd
+
+from api.eod.base import EODRequester
+from cleaners.gaps import refetch_jobs, stored_gaps
+from context import tg_context
+from core.profiler import add_profile_args
+from core.recorder import DataCollector
+from domain.eod.eod_us_stock_1d_kdata import EodUSStock1dKdata, EodUSStockKdataBase
+from logger import LOG
+
+RENAME_MAP = {
+    "Date": "timestamp",
+    "Open": "open",
+    "High": "high",
+    "Low": "low",
+    "Close": "close",
+    "Adjusted_close": "adjusted_close",
+    "Volume": "volume",
+}
+
+
+class EodUSStockGapRecorder(DataCollector):
+    """
+    refetch only the trade days missing from the stored daily bars: the gap
+    scan turns the holes of every code into the fewest date ranges, each
+    range is one batch job, so repair traffic follows what is missing
+    """
+    exchange = "US"
+
+    def __init__(self, kdata_schema=EodUSStock1dKdata, requester: EODRequester = None,
+                 batch_size: int = 50, join_within: int = 2):
+        self.kdata_schema = kdata_schema
+        self.requester = requester or EODRequester()
+        self.batch_size = batch_size
+        # holes this close together are fetched as one range
+        self.join_within = join_within
+        tg_context.register_schema("eod", EodUSStockKdataBase)
+
+    def fetch(self, code: str, start_date: str, end_date: str) -> Optional[pd.DataFrame]:
+        df = self.requester.eod_get_historical_data(code, self.exchange, start_date, end_date, "d")
+        if df is None or df.empty:
+            return None
+        df = df.reset_index().rename(columns=RENAME_MAP)
+        df["code"] = code
+        df["exchange"] = self.exchange
+        df["id"] = code + "_" + df["timestamp"].dt.strftime("%Y-%m-%d")
+        return df
+
+    def run(self, codes: list = None, end=None) -> int:
+        """
+            Returns the bars saved
+        """
+        gaps = stored_gaps(self.kdata_schema, codes, self.exchange, end, self.join_within)
+        jobs = refetch_jobs(gaps)
+        if not jobs:
+            return 0
+        saved, frames = 0, []
+
+        def flush():
+            nonlocal saved, frames
+            if frames:
+                batch = pd.concat(frames, ignore_index=True)
+                tg_context.save(batch, self.kdata_schema)
+                saved += len(batch)
+                frames = []
+
+        for job, df in self.run_batch_jobs(jobs, self.batch_size, self.fetch):
+            if isinstance(df, pd.DataFrame) and not df.empty:
+                frames.append(df)
+            if len(frames) >= self.batch_size:
+                flush()
+        flush()
+        tg_context.flush()
+        LOG.info(f"gap repair: {len(jobs)} ranges refetched, {saved} bars saved")
+        return saved
+
+
+if __name__ == "__main__":
+    parser = add_profile_args(argparse.ArgumentParser())
+    parser.add_argument("codes", nargs="*", help="all stored codes when empty")
+    parser.add_argument("--end", help="expect bars up to this date, default the latest trade date")
+    parser.add_argument("--join-within", type=int, default=2)
+    args = parser.parse_args()
+    recorder = EodUSStockGapRecorder(join_within=args.join_within)
+    recorder.profile, recorder.profile_tasks = args.profile, args.profile_tasks
+    recorder.run_profiled(args.codes or None, args.end)
@@ -0,0 +1,172 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+import pandas as pd
+
+from api.eod.base import EODRequester, INTRADAY_MAX_DAYS
+from check import IntervalType, StartEndType
+from conf import INTRADAY_FOLLOW_COMPACT_PARTS
+from core.profiler import ProfileMode, TaskSampler, add_profile_args, profiled
+from intraday_store import IntradayStore
+from logger import LOG
+from market_clock import ACTIVE_PHASES, market_clock
+from utils import chunks
+
+# seconds between passes while following the market, one bar
+POLL_SECONDS = {"1m": 60, "5m": 300, "1h": 3600}
+
+
+class EodUSStockIntradayRecorder:
+    """
+    pull intraday bars for many symbols, `workers` symbols at a time (each
+    symbol's range is itself split into api sized windows), write every
+    batch as one part per day and compact the days of the run once at its end
+    """
+    exchange = "US"
+
+    def __init__(self, interval: IntervalType = "1m", requester: EODRequester = None,
+                 store: IntradayStore = None, workers: int = 16):
+        self.interval = interval
+        self.requester = requester or EODRequester()
+        self.store = store or IntradayStore(interval, "EOD")
+        self.workers = workers
+        # epoch seconds of the last bar fetched per code
+        self.last_ts: Dict[str, int] = dict()
+
+    def fetch(self, code: str, start: StartEndType, end: StartEndType) -> Optional[pd.DataFrame]:
+        """
+            Returns the bars of code as (code, ts, open, high, low, close, volume)
+        """
+        df = self.requester.eod_get_intraday_data(code, self.exchange, start, end, self.interval)
+        if df is None or df.empty:
+            return None
+        return pd.DataFrame({
+            "code": code,
+            "ts": df.index.to_numpy("datetime64[s]").astype("int64"),
+            "open": df["Open"].to_numpy(),
+            "high": df["High"].to_numpy(),
+            "low": df["Low"].to_numpy(),
+            "close": df["Close"].to_numpy(),
+            "volume": df["Volume"].to_numpy(),
+        })
+
+    def default_start(self) -> pd.Timestamp:
+        """
+            Returns the last stored day, refetched as it may be partial, or the api's max range back
+        """
+        days = self.store.days()
+        if days:
+            return pd.Timestamp(days[-1])
+        return pd.Timestamp.utcnow().tz_localize(None).normalize() - pd.Timedelta(days=INTRADAY_MAX_DAYS[self.interval])
+
+    def stored_until(self, codes: list) -> Dict[str, int]:
+        """
+            Returns the epoch seconds of the last stored bar of each of codes found on the last stored day
+        """
+        days = self.store.days()
+        if not days:
+            return dict()
+        df = self.store.read(codes, start=days[-1], columns=["ts"])
+        return {str(code): int(ts) for code, ts in df.groupby("code", observed=True)["ts"].max().items()}
+
+    def run(self, codes: list, start: StartEndType = None, end: StartEndType = None,
+            batch_size: int = 100, profile: ProfileMode = None, profile_tasks: float = 0.0,
+            compact: bool = True, starts: Dict[str, int] = None) -> int:
+        """
+            Returns the rows written; `starts` gives per code epoch seconds to
+            fetch from instead of start
+        """
+        starts = starts or dict()
+        if start is None:
+            start = min(starts.values()) if starts and len(starts) == len(codes) else self.default_start()
+        end = end if end is not None else pd.Timestamp.utcnow().tz_localize(None)
+        kls = self.__class__.__name__
+        fetch = self.fetch
+        if profile_tasks:
+            fetch = TaskSampler(kls, profile or "sample", profile_tasks).wrap(fetch, task_name=lambda code, *_: code)
+            profile = None
+
+        def safe_fetch(code):
+            try:
+                return fetch(code, starts.get(code, start), end)
+            except Exception as e:
+                LOG.warning(f"{code}: intraday {self.interval} fetch failed: {e!r}")
+                return None
+
+        written = 0
+        with profiled(kls, profile, codes=len(codes), interval=self.interval), \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="intraday") as executor:
+            for batch in chunks(codes, batch_size):
+                frames = [df for df in executor.map(safe_fetch, batch) if df is not None]
+                if frames:
+                    written += self.store.write(pd.concat(frames, ignore_index=True))
+                for df in frames:
+                    self.last_ts[df["code"].iat[0]] = int(df["ts"].max())
+        if compact and written:
+            self.store.compact(start, end)
+        LOG.info(f"intraday {self.interval}: {written} rows written for {len(codes)} codes")
+        return written
+
+    def follow(self, codes: list, poll: float = None, phases: Iterable[str] = ACTIVE_PHASES,
+               until: float = None, sleep: Callable[[float], None] = time.sleep,
+               now: Callable[[], float] = time.time, **kwargs) -> int:
+        """
+        run a pass every `poll` seconds while the market is in one of phases
+        and one more as it leaves them, sleep through the rest until the next
+        active phase starts; stops at the epoch seconds `until`. Returns the passes run
+
+        every pass only fetches each code from its last stored bar on (that
+        bar may have been partial) and writes one part; the day is compacted
+        once it holds INTRADAY_FOLLOW_COMPACT_PARTS parts and when the phase ends
+        """
+        clock = market_clock(self.exchange)
+        poll = poll or POLL_SECONDS[self.interval]
+        batch_size = kwargs.pop("batch_size", 100)
+        for code, ts in self.stored_until(codes).items():
+            self.last_ts.setdefault(code, ts)
+        passes, active = 0, False
+
+        def run_pass(closing: bool = False):
+            known = {code: self.last_ts[code] for code in codes if code in self.last_ts}
+            # the first pass may catch up on days and is compacted as a run, later ones hold a few bars per code
+            first = not passes
+            self.run(codes, end=int(now()), batch_size=batch_size if first else len(codes),
+                     compact=first or closing, starts=known, **kwargs)
+            if not (first or closing) and known:
+                self.store.compact(min(known.values()), None, min_parts=INTRADAY_FOLLOW_COMPACT_PARTS)
+
+        while until is None or now() < until:
+            wait = clock.seconds_until_active(now(), phases)
+            if wait > 0:
+                if active:
+                    # bars of the last minutes of the phase
+                    run_pass(closing=True)
+                    passes, active = passes + 1, False
+                if wait == float("inf"):
+                    LOG.warning(f"intraday {self.interval}: no active phase left in the {clock.market} calendar")
+                    break
+                LOG.info(f"intraday {self.interval}: market {clock.phase(now())}, sleeping {wait:.0f}s")
+                sleep(wait if until is None else max(min(wait, until - now()), 0.0))
+                continue
+            run_pass()
+            passes, active = passes + 1, True
+            # wake up for the next pass, or right when the phase ends if that comes first
+            sleep(min(poll, clock.seconds_to_boundary(now())))
+        return passes
+
+
+if __name__ == "__main__":
+    parser = add_profile_args(argparse.ArgumentParser())
+    parser.add_argument("codes", nargs="+")
+    parser.add_argument("--interval", choices=list(INTRADAY_MAX_DAYS), default="1m")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--follow", action="store_true", help="keep polling during market hours")
+    args = parser.parse_args()
+    recorder = EodUSStockIntradayRecorder(args.interval)
+    if args.follow:
+        recorder.follow(args.codes)
+    else:
+        recorder.run(args.codes, args.start, args.end, profile=args.profile, profile_tasks=args.profile_tasks)
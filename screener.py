@@ -0,0 +1,431 @@
+"""
+screens over a materialized cross section of the latest SCREENER_DAYS trade
+days of a bar table: one float64 days x codes array per field, kept in
+memory and as a snapshot file; the bars every Context.save stores are
+buffered and merged in, the snapshot is written once per ingest run by
+`Context.flush`, so a screen never goes back to the database
+
+expressions are python syntax over the fields and a few window functions,
+parsed once and checked against a whitelist, then evaluated on whole
+arrays; the last row (or the row of `on`) is the screen:
+
+    screen("close > ma(close, 20) and volume > 1e6", EodUSStock1dKdata)
+    screen("ret(close, 5) > 0.1 & rank(volume) > 0.9", EodUSStock1dKdata, pool=StocksPool())
+"""
+import ast
+import atexit
+import os
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from check import StartEndType
+from conf import DATA_PATH, SCREENER_DAYS, SCREENER_PENDING_ROWS
+from core.metrics import metrics
+from logger import LOG
+
+FIELDS = ["open", "high", "low", "close", "adjusted_close", "volume"]
+
+
+class CrossSection:
+    """
+    `values[field]` is a (len(dates), len(codes)) float64 array, NaN where a
+    code has no bar; dates and codes are sorted
+    """
+
+    def __init__(self, table: str, days: int, dates: np.ndarray, codes: np.ndarray, values: Dict[str, np.ndarray]):
+        self.table = table
+        self.days = days
+        self.dates = dates
+        self.codes = codes
+        self.values = values
+
+    @classmethod
+    def empty(cls, table: str, days: int, fields: Iterable[str]) -> "CrossSection":
+        return cls(table, days, np.array([], dtype="datetime64[D]"), np.array([], dtype=object),
+                   {field: np.empty((0, 0)) for field in fields})
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.values)
+
+    def merge(self, df: pd.DataFrame) -> "CrossSection":
+        """
+        Returns the cross section with the bars of df (code, timestamp and
+        any of the fields) in, the window rolled forward to the newest date
+        """
+        days = pd.to_datetime(df["timestamp"]).to_numpy("datetime64[D]")
+        dates = np.union1d(self.dates, days)[-self.days:]
+        if not len(dates):
+            return self
+        live = days >= dates[0]
+        incoming = df["code"].to_numpy(dtype=object)[live]
+        codes = np.union1d(self.codes, incoming) if len(incoming) else self.codes
+        # old rows still in the window land at their new positions, incoming bars on top
+        keep = np.flatnonzero(self.dates >= dates[0])
+        rows = np.searchsorted(dates, self.dates[keep])
+        cols = np.searchsorted(codes, self.codes)
+        r = np.searchsorted(dates, days[live])
+        c = np.searchsorted(codes, incoming)
+        values = dict()
+        for field, old in self.values.items():
+            new = np.full((len(dates), len(codes)), np.nan)
+            if len(keep) and len(cols):
+                new[np.ix_(rows, cols)] = old[keep]
+            if field in df.columns:
+                new[r, c] = pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=np.float64)[live]
+            values[field] = new
+        # codes without a single bar left in the window are gone
+        seen = np.isfinite(values["close"]).any(axis=0) if "close" in values else np.ones(len(codes), dtype=bool)
+        if not seen.all():
+            codes = codes[seen]
+            values = {field: array[:, seen] for field, array in values.items()}
+        return CrossSection(self.table, self.days, dates, codes, values)
+
+    def position(self, on: StartEndType = None) -> int:
+        """
+            Returns the row of the latest date not after `on`, the last row by default
+        """
+        if on is None:
+            return len(self.dates) - 1
+        pos = int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(on).date(), "D"), side="right")) - 1
+        if pos < 0:
+            raise KeyError(f"{self.table}: {on} is before the cross section starting {self.dates[0]}")
+        return pos
+
+    def save(self, path: str):
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, dates=self.dates, codes=self.codes.astype(str), days=np.int64(self.days),
+                 **{f"field_{name}": array for name, array in self.values.items()})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, table: str, path: str) -> "CrossSection":
+        with np.load(path) as data:
+            values = {name[6:]: data[name] for name in data.files if name.startswith("field_")}
+            return cls(table, int(data["days"]), data["dates"], data["codes"].astype(object), values)
+
+
+class CrossSectionCache:
+    """
+    cross sections per table, in memory and as snapshots under `root`;
+    `update` buffers freshly saved bars for the tables already materialized,
+    `flush` writes the snapshots they changed
+    """
+
+    def __init__(self, root: str = None, days: int = SCREENER_DAYS, pending_rows: int = SCREENER_PENDING_ROWS):
+        self.root = root or os.path.join(DATA_PATH, "screener")
+        self.days = days
+        self.pending_rows = pending_rows
+        # table -> (snapshot mtime, cross section)
+        self._sections: Dict[str, Tuple[Optional[float], CrossSection]] = dict()
+        # bars saved since the last merge, and tables merged since the last flush
+        self._pending: Dict[str, List[pd.DataFrame]] = dict()
+        self._pending_rows: Dict[str, int] = dict()
+        self._dirty: Set[str] = set()
+        self._lock = Lock()
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.root, f"{table}.npz")
+
+    @metrics.timed("cross_section_build")
+    def build(self, schema, days: int = None) -> CrossSection:
+        """
+            Returns a cross section of schema read from the database
+        """
+        # context saves through this module, import it late
+        from context import tg_context
+
+        days = days or self.days
+        table = schema.__tablename__
+        fields = [field for field in FIELDS if field in schema.__table__.columns.keys()]
+        section = CrossSection.empty(table, days, fields)
+        latest = tg_context.get_data(schema, columns=["timestamp"], order="-timestamp", limit=1)
+        if latest is None or latest.empty:
+            return section
+        # weekdays back from the newest bar, with room for holidays
+        start = (pd.Timestamp(latest["timestamp"].iloc[0]) - pd.offsets.BDay(days + days // 10 + 5)).strftime("%Y-%m-%d")
+        df = tg_context.get_data(schema, start=start, columns=["code", "timestamp"] + fields)
+        if df is not None and not df.empty:
+            section = section.merge(df)
+        LOG.info(f"{table}: cross section of {len(section.dates)} days x {len(section.codes)} codes")
+        return section
+
+    def _snapshot_mtime(self, table: str) -> Optional[float]:
+        path = self.path(table)
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def _loaded(self, table: str) -> Optional[CrossSection]:
+        """
+            Returns the in memory cross section of table, loaded again when its snapshot changed and nothing is pending
+        """
+        mtime = self._snapshot_mtime(table)
+        cached = self._sections.get(table)
+        if cached is not None and (cached[0] == mtime or table in self._dirty):
+            return cached[1]
+        if mtime is None:
+            return None
+        section = CrossSection.load(table, self.path(table))
+        self._sections[table] = (mtime, section)
+        return section
+
+    def _apply(self, table: str):
+        """
+            merge the bars buffered for table into its in memory cross section
+        """
+        frames = self._pending.pop(table, None)
+        self._pending_rows.pop(table, None)
+        if not frames:
+            return
+        mtime, section = self._sections[table]
+        self._sections[table] = (mtime, section.merge(pd.concat(frames, ignore_index=True)))
+        self._dirty.add(table)
+
+    def get(self, schema, refresh: bool = False) -> CrossSection:
+        """
+        Returns the cross section of schema: from memory while its snapshot is
+        unchanged or it holds bars not flushed yet, else the snapshot, else
+        built and snapshotted
+        """
+        table = schema.__tablename__
+        with self._lock:
+            if refresh:
+                self._pending.pop(table, None)
+                self._pending_rows.pop(table, None)
+                self._dirty.discard(table)
+            section = None if refresh else self._loaded(table)
+            if section is None:
+                section = self.build(schema)
+                os.makedirs(self.root, exist_ok=True)
+                section.save(self.path(table))
+                self._sections[table] = (self._snapshot_mtime(table), section)
+            self._apply(table)
+            return self._sections[table][1]
+
+    @metrics.timed("cross_section_update")
+    def update(self, table: str, df: pd.DataFrame):
+        """
+        buffer bars just saved to table for its cross section, when there is
+        one; they are merged in when the buffer fills up or the section is
+        read, and written to the snapshot by `flush`
+        """
+        if df is None or df.empty or "close" not in df.columns:
+            return
+        with self._lock:
+            section = self._loaded(table)
+            if section is None:
+                return
+            columns = ["code", "timestamp"] + [field for field in section.fields if field in df.columns]
+            if len(section.dates):
+                # bars older than the window never make it in
+                df = df[pd.to_datetime(df["timestamp"]).to_numpy("datetime64[D]") >= section.dates[0]]
+                if df.empty:
+                    return
+            self._pending.setdefault(table, []).append(df[columns])
+            self._pending_rows[table] = self._pending_rows.get(table, 0) + len(df)
+            if self._pending_rows[table] >= self.pending_rows:
+                self._apply(table)
+
+    @metrics.timed("cross_section_flush")
+    def flush(self, table: str = None) -> int:
+        """
+        write the cross sections holding bars saved since the last flush to
+        their snapshots, every table's by default; returns the snapshots written
+        """
+        with self._lock:
+            tables = [table] if table is not None else sorted(set(self._pending) | self._dirty)
+            written = 0
+            for name in tables:
+                if name not in self._pending and name not in self._dirty:
+                    continue
+                self._apply(name)
+                section = self._sections[name][1]
+                section.save(self.path(name))
+                self._sections[name] = (self._snapshot_mtime(name), section)
+                self._dirty.discard(name)
+                written += 1
+            return written
+
+    def invalidate(self, table: str):
+        with self._lock:
+            self._sections.pop(table, None)
+            self._pending.pop(table, None)
+            self._pending_rows.pop(table, None)
+            self._dirty.discard(table)
+            if os.path.exists(self.path(table)):
+                os.remove(self.path(table))
+
+
+cross_section_cache = CrossSectionCache()
+# ingest drivers flush at the end of a run, this catches the ones that don't
+atexit.register(cross_section_cache.flush)
+
+
+def _pad(window: np.ndarray, n: int, rows: int) -> np.ndarray:
+    """
+        Returns a window reduction over axis 0 with the first n - 1 rows NaN
+    """
+    out = np.full((rows,) + window.shape[1:], np.nan)
+    out[n - 1:] = window
+    return out
+
+
+def _rolling(reduce: Callable) -> Callable:
+    def rolling(x: np.ndarray, n: int) -> np.ndarray:
+        if not isinstance(n, (int, np.integer)) or n < 1:
+            raise ValueError(f"window must be a positive integer, got {n!r}")
+        if n > len(x):
+            return np.full(x.shape, np.nan)
+        return _pad(reduce(sliding_window_view(x, n, axis=0), axis=-1), n, len(x))
+    return rolling
+
+
+def _ref(x: np.ndarray, n: int = 1) -> np.ndarray:
+    out = np.full(x.shape, np.nan)
+    if 0 <= n < len(x):
+        out[n:] = x[:len(x) - n]
+    return out
+
+
+def _rank(x: np.ndarray) -> np.ndarray:
+    """
+        Returns the percentile rank of every value within its row, ties by position, NaN kept NaN
+    """
+    missing = np.isnan(x)
+    order = np.argsort(np.where(missing, np.inf, x), axis=1, kind="stable")
+    ranks = np.empty(x.shape)
+    np.put_along_axis(ranks, order, np.arange(1, x.shape[1] + 1, dtype=np.float64)[None, :], axis=1)
+    ranks /= np.maximum((~missing).sum(axis=1, keepdims=True), 1)
+    ranks[missing] = np.nan
+    return ranks
+
+
+# every function takes and returns days x codes arrays, windows are int literals
+FUNCTIONS: Dict[str, Callable] = {
+    "ma": _rolling(np.mean),
+    "sum": _rolling(np.sum),
+    "std": _rolling(lambda w, axis: np.std(w, axis=axis, ddof=1)),
+    "max": _rolling(np.max),
+    "min": _rolling(np.min),
+    "ref": _ref,
+    "ret": lambda x, n=1: x / _ref(x, n) - 1,
+    "rank": _rank,
+    "abs": np.abs,
+    "log": np.log,
+}
+_BINARY = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+    ast.Pow: np.power, ast.Mod: np.mod, ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or,
+}
+_COMPARE = {
+    ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+    ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+_UNARY = {ast.USub: np.negative, ast.UAdd: np.positive, ast.Not: np.logical_not, ast.Invert: np.logical_not}
+
+
+def _compile(node: ast.AST) -> Callable[[Dict[str, np.ndarray]], object]:
+    if isinstance(node, ast.Expression):
+        return _compile(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        value = node.value
+        return lambda env: value
+    if isinstance(node, ast.Name):
+        name = node.id
+
+        def field(env):
+            if name not in env:
+                raise KeyError(f"unknown field {name!r}, have {sorted(env)}")
+            return env[name]
+        return field
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        op, left, right = _BINARY[type(node.op)], _compile(node.left), _compile(node.right)
+        return lambda env: op(left(env), right(env))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        op, operand = _UNARY[type(node.op)], _compile(node.operand)
+        return lambda env: op(operand(env))
+    if isinstance(node, ast.BoolOp):
+        op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        values = [_compile(value) for value in node.values]
+
+        def boolop(env):
+            result = values[0](env)
+            for value in values[1:]:
+                result = op(result, value(env))
+            return result
+        return boolop
+    if isinstance(node, ast.Compare) and all(type(op) in _COMPARE for op in node.ops):
+        operands = [_compile(node.left)] + [_compile(comparator) for comparator in node.comparators]
+        ops = [_COMPARE[type(op)] for op in node.ops]
+
+        def compare(env):
+            # chained like python: a < b < c is a < b and b < c
+            values = [operand(env) for operand in operands]
+            result = ops[0](values[0], values[1])
+            for i, op in enumerate(ops[1:], 1):
+                result = np.logical_and(result, op(values[i], values[i + 1]))
+            return result
+        return compare
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS \
+            and not node.keywords:
+        fun, args = FUNCTIONS[node.func.id], [_compile(arg) for arg in node.args]
+        return lambda env: fun(*(arg(env) for arg in args))
+    raise ValueError(f"not allowed in a screen: {ast.dump(node)[:80]}")
+
+
+@lru_cache(maxsize=256)
+def compile_expression(expr: str) -> Callable[[Dict[str, np.ndarray]], object]:
+    """
+        Returns the evaluator of a screen expression, ValueError for anything outside the whitelist
+    """
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"bad screen expression {expr!r}: {e}") from e
+    return _compile(tree)
+
+
+def evaluate(expr: str, section: CrossSection, on: StartEndType = None) -> np.ndarray:
+    """
+        Returns the value of expr for every code of section on `on` (default the latest date)
+    """
+    pos = section.position(on)
+    # only the rows up to `on` take part, nothing looks ahead
+    env = {field: values[:pos + 1] for field, values in section.values.items()}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = compile_expression(expr)(env)
+    result = np.asarray(result)
+    if result.ndim < 2:
+        return np.broadcast_to(result, (len(section.codes),))
+    return result[-1]
+
+
+@metrics.timed("screen")
+def screen(
+    expr: str,
+    schema,
+    on: StartEndType = None,
+    select: Optional[Iterable[str]] = None,
+    pool=None,
+    cache: CrossSectionCache = cross_section_cache,
+) -> pd.DataFrame:
+    """
+    Returns the codes passing expr, indexed by code with a column per
+    `select` expression (default the fields expr uses), joined with the
+    listing rows of `pool` (a StocksPool) when given
+    """
+    section = cache.get(schema)
+    passed = evaluate(expr, section, on).astype(bool) if len(section.dates) else np.zeros(0, dtype=bool)
+    codes = section.codes[passed]
+    if select is None:
+        select = sorted({node.id for node in ast.walk(ast.parse(expr, mode="eval")) if isinstance(node, ast.Name)
+                         and node.id not in FUNCTIONS})
+    df = pd.DataFrame({column: evaluate(column, section, on)[passed] for column in select},
+                      index=pd.Index(codes, name="code"))
+    if pool is not None:
+        df = df.join(pool.get_many_by_code(list(codes)), how="left")
+    return df
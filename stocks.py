@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from functools import cache, cached_property
 from fuzzywuzzy import fuzz
@@ -5,6 +6,14 @@ from fuzzywuzzy import fuzz
 from tradepy.conversion import convert_code_to_market
 from tradepy.types import MarketType
 
+NGRAM_SIZE = 3
+FUZZY_CANDIDATES = 32
+
+
+def _ngrams(text: str, n: int = NGRAM_SIZE) -> set:
+    padded = " " * (n - 1) + text + " "
+    return {padded[i: i + n] for i in range(len(padded) - n + 1)}
+
 
 def _fuzzy_match(target, texts) -> str:
     return sorted(
@@ -12,6 +21,117 @@ def _fuzzy_match(target, texts) -> str:
     )[0][0]
 
 
+class NgramIndex:
+    """
+    n-gram posting lists over a list of texts, used to narrow fuzzy
+    candidates before scoring them with fuzz.ratio
+    """
+
+    def __init__(self, texts: list, n: int = NGRAM_SIZE):
+        self.texts = texts
+        self.n = n
+        postings = dict()
+        sizes = np.empty(len(texts), dtype=np.int32)
+        for i, text in enumerate(texts):
+            grams = _ngrams(text, n)
+            sizes[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.sizes = sizes
+
+    def candidates(self, target: str, limit: int = FUZZY_CANDIDATES) -> np.ndarray:
+        """
+            Returns ids of the texts whose n-gram sets are closest to target's
+            by Dice coefficient, which unlike the raw shared count does not
+            favour long texts over short close ones
+        """
+        grams = _ngrams(target, self.n)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return np.empty(0, dtype=np.int32)
+        counts = np.bincount(np.concatenate(hits), minlength=len(self.texts))
+        ids = np.flatnonzero(counts)
+        if len(ids) > limit:
+            dice = 2.0 * counts[ids] / (self.sizes[ids] + len(grams))
+            ids = ids[np.argpartition(-dice, limit - 1)[:limit]]
+        return np.sort(ids)
+
+    def match(self, target: str) -> str:
+        ids = self.candidates(target)
+        if not len(ids):
+            return _fuzzy_match(target, self.texts)
+        # first best score in listing order, same as _fuzzy_match
+        scores = [fuzz.ratio(self.texts[i], target) for i in ids]
+        return self.texts[ids[int(np.argmax(scores))]]
+
+
+def _markets_of(codes: np.ndarray) -> np.ndarray:
+    """
+    market of every code, convert_code_to_market is called once per distinct
+    code; its rules belong to tradepy, so nothing here assumes which part of
+    the code they look at
+    """
+    unique, inverse = np.unique(np.asarray(codes, dtype=str), return_inverse=True)
+    markets = np.array([convert_code_to_market(code) for code in unique], dtype=object)
+    return markets[inverse.reshape(-1)]
+
+
+class StockListing:
+    """
+    struct-of-arrays view over the listing DataFrame, Stock objects are
+    only built for the rows asked for
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.codes = df.index.to_numpy(dtype=object)
+        self.names = df["name"].to_numpy(dtype=object)
+        self.industries = df["sector"].to_numpy(dtype=object)
+        self.total_shares = df["total_share"].to_numpy(dtype=np.float64)
+        self.markets = _markets_of(self.codes)
+        self._index = pd.Index(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def positions(self, codes) -> np.ndarray:
+        """
+            Returns listing positions of the known codes, in the order given
+        """
+        positions = self._index.get_indexer_for(pd.Index(codes))
+        return positions[positions >= 0]
+
+    def stock_at(self, pos: int) -> "Stock":
+        return Stock(
+            code=self.codes[pos],
+            name=self.names[pos],
+            industry=self.industries[pos],
+            total_share=self.total_shares[pos],
+            market=self.markets[pos],
+        )
+
+    def __getitem__(self, pos: int) -> "Stock":
+        return self.stock_at(pos)
+
+    def __iter__(self):
+        return (self.stock_at(pos) for pos in range(len(self)))
+
+    def in_market(self, market: MarketType) -> np.ndarray:
+        return np.flatnonzero(self.markets == market)
+
+    def market_caps(self, prices) -> np.ndarray:
+        """
+        market caps for prices aligned with the listing, or a Series of
+        prices indexed by code (missing codes give nan)
+        """
+        if isinstance(prices, pd.Series):
+            positions = pd.Index(prices.index).get_indexer_for(pd.Index(self.codes))
+            values = prices.to_numpy(dtype=np.float64)
+            aligned = np.where(positions >= 0, values[positions], np.nan)
+            return aligned * self.total_shares
+        return np.asarray(prices, dtype=np.float64) * self.total_shares
+
+
 class StocksPool:
     @cached_property
     def df(self):
@@ -19,51 +139,76 @@ class StocksPool:
 
         return StockListingDepot.load()
 
-    @property
+    @cached_property
     def names(self) -> list[str]:
         return self.df["name"].unique().tolist()
 
-    @property
+    @cached_property
     def codes(self) -> list[str]:
         return self.df.index.unique().tolist()
 
-    def _build_stock_obj(self, row: pd.Series):
-        d = row.to_dict()
-        return Stock(
-            code=d["code"],
-            name=d["name"],
-            industry=d["sector"],
-            total_share=d["total_share"],
-        )
+    @cached_property
+    def listing(self) -> StockListing:
+        return StockListing(self.df)
+
+    @cached_property
+    def _name_positions(self) -> dict[str, int]:
+        """
+            Returns the first listing row of every name
+        """
+        positions = dict()
+        for pos, name in enumerate(self.df["name"].tolist()):
+            positions.setdefault(name, pos)
+        return positions
+
+    @cached_property
+    def _name_ngrams(self) -> NgramIndex:
+        return NgramIndex(self.names)
 
     @cache
     def get_by_name(self, name: str, fuzzy=False) -> "Stock":
         if fuzzy:
-            name = _fuzzy_match(name, self.names)
+            name = self._name_ngrams.match(name)
 
-        data = self.df.query(f'name == "{name}"')
-        return self._build_stock_obj(data.reset_index().iloc[0])
+        return self.listing.stock_at(self._name_positions[name])
 
     @cache
     def get_by_code(self, code: str) -> "Stock":
-        data = self.df.loc[code].copy()
-        data["code"] = code
-        return self._build_stock_obj(data)
+        positions = self.listing.positions([code])
+        if not len(positions):
+            raise KeyError(code)
+        return self.listing.stock_at(positions[0])
+
+    def get_many_by_code(self, codes: list[str]) -> pd.DataFrame:
+        """
+            Returns listing rows of the known codes, in the order given
+        """
+        return self.df.iloc[self.listing.positions(codes)]
+
+    def get_many_by_name(self, names: list[str], fuzzy=False) -> pd.DataFrame:
+        if fuzzy:
+            match = self._name_ngrams.match
+            names = [name if name in self._name_positions else match(name) for name in names]
+        positions = [self._name_positions[name] for name in names if name in self._name_positions]
+        return self.df.iloc[positions]
 
     def has_code(self, code: str) -> bool:
-        return code in self.df.index
+        return code in self.listing._index
 
     def export(self, path: str):
         self.df.to_csv(path)
 
 
 class Stock:
-    def __init__(self, code: str, name: str, industry: str, total_share: float) -> None:
+    __slots__ = ("code", "name", "industry", "total_share", "market")
+
+    def __init__(self, code: str, name: str, industry: str, total_share: float,
+                 market: MarketType = None) -> None:
         self.code = code
         self.name = name
         self.industry = industry
         self.total_share = float(total_share)  # in 100 millions
-        self.market: MarketType = convert_code_to_market(code)
+        self.market: MarketType = market or convert_code_to_market(code)
 
     def get_market_cap_at(self, price):
         return price * self.total_share
@@ -0,0 +1,266 @@
+"""
+tick data as append-only segment files, one directory per symbol and utc day:
+
+    <DATA_PATH>/ticks/<provider>/<CODE>/2024-01-02/<created ns>-<pid>-<seq>.seg
+
+a segment holds contiguous ts (int64 epoch ns), price (float64) and size
+(int64) column blocks followed by a json footer indexing them:
+
+    MAGIC | ts block | price block | size block | footer json | footer length, MAGIC
+
+every append writes a new segment and never touches the old ones, compact()
+merges a day's segments into one so a day of one symbol is a single mmap.
+With codec "none" the columns are numpy views straight onto the map, the
+other codecs decompress the blocks (ts delta encoded first, which is what
+makes tick timestamps compress)
+"""
+import os
+import json
+import mmap
+import time
+import struct
+import itertools
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from check import ProviderType, StartEndType
+from conf import DATA_PATH, TICK_CODEC, TICK_COMPACT_MIN_SEGMENTS
+from core.compress import DEFAULT_CODEC, compress, decompress
+from core.metrics import metrics
+from logger import LOG
+
+MAGIC = b"TQTK"
+VERSION = 1
+# footer length, magic
+TRAILER = struct.Struct("<I4s")
+COLUMNS = (("ts", "<i8"), ("price", "<f8"), ("size", "<i8"))
+SUFFIX = ".seg"
+DAY_NS = 86400 * 10 ** 9
+_sequence = itertools.count()
+
+
+def _to_ns(value: StartEndType) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return pd.Timestamp(value).value
+
+
+def write_segment(path: str, columns: Dict[str, np.ndarray], codec: str = DEFAULT_CODEC,
+                  sources: Iterable[str] = ()) -> dict:
+    """
+    write one segment atomically, `sources` names the segments it replaces;
+    returns its footer
+    """
+    ts = np.ascontiguousarray(columns["ts"], dtype="<i8")
+    meta = dict(
+        version=VERSION,
+        rows=len(ts),
+        codec=codec,
+        min_ts=int(ts.min()) if len(ts) else None,
+        max_ts=int(ts.max()) if len(ts) else None,
+        sorted=bool(len(ts) < 2 or (ts[1:] >= ts[:-1]).all()),
+        sources=sorted(sources),
+        columns=[],
+    )
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        for name, dtype in COLUMNS:
+            values = ts if name == "ts" else np.ascontiguousarray(columns[name], dtype=dtype)
+            delta = codec != "none" and name == "ts"
+            if delta:
+                values = np.diff(values, prepend=np.int64(0))
+            data = memoryview(values).cast("B") if codec == "none" else compress(values.tobytes(), codec)
+            # keep raw blocks 8 byte aligned for the zero copy views
+            pad = -offset % 8
+            f.write(b"\0" * pad)
+            offset += pad
+            f.write(data)
+            meta["columns"].append(dict(name=name, dtype=dtype, offset=offset, length=len(data), delta=delta))
+            offset += len(data)
+        footer = json.dumps(meta).encode()
+        f.write(footer)
+        f.write(TRAILER.pack(len(footer), MAGIC))
+    os.replace(tmp, path)
+    return meta
+
+
+class Segment:
+    """
+    a memory mapped segment, only the footer is read on open
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = len(self._map) - TRAILER.size
+        length, magic = TRAILER.unpack_from(self._map, end)
+        if magic != MAGIC or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a tick segment")
+        self.meta = json.loads(self._map[end - length:end])
+        self._columns = {col["name"]: col for col in self.meta["columns"]}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def column(self, name: str) -> np.ndarray:
+        col = self._columns[name]
+        block = memoryview(self._map)[col["offset"]:col["offset"] + col["length"]]
+        codec = self.meta["codec"]
+        if codec == "none":
+            return np.frombuffer(block, dtype=col["dtype"])
+        values = np.frombuffer(decompress(block, codec), dtype=col["dtype"])
+        return np.cumsum(values) if col["delta"] else values
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: self.column(name) for name, _ in COLUMNS}
+
+
+def _merge(segments: List[Segment]) -> Dict[str, np.ndarray]:
+    if len(segments) == 1:
+        arrays = segments[0].arrays()
+        if segments[0].meta["sorted"]:
+            return arrays
+    else:
+        parts = [seg.arrays() for seg in segments]
+        arrays = {name: np.concatenate([p[name] for p in parts]) for name, _ in COLUMNS}
+    # stable, so ticks sharing a timestamp keep their arrival order
+    order = np.argsort(arrays["ts"], kind="stable")
+    return {name: values[order] for name, values in arrays.items()}
+
+
+class TickStore:
+    """
+    append-only tick segments of one provider
+    """
+
+    def __init__(self, provider: ProviderType = "EOD", root: str = None, codec: str = TICK_CODEC or DEFAULT_CODEC):
+        self.root = root or os.path.join(DATA_PATH, "ticks", provider.lower())
+        self.codec = codec
+        os.makedirs(self.root, exist_ok=True)
+
+    def _day_dir(self, code: str, day: str) -> str:
+        return os.path.join(self.root, code, day)
+
+    def codes(self) -> List[str]:
+        return sorted(os.listdir(self.root))
+
+    def days(self, code: str) -> List[str]:
+        """
+            Returns the days stored for code, oldest first
+        """
+        path = os.path.join(self.root, code)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def segments(self, code: str, day: str) -> List[Segment]:
+        """
+            Returns the live segments of a day, oldest first; those a compaction replaced are left out
+        """
+        path = self._day_dir(code, day)
+        if not os.path.isdir(path):
+            return []
+        segments = [Segment(os.path.join(path, name)) for name in sorted(os.listdir(path)) if name.endswith(SUFFIX)]
+        replaced = {name for seg in segments for name in seg.meta["sources"]}
+        return [seg for seg in segments if seg.name not in replaced]
+
+    @metrics.timed("tick_append")
+    def append(self, code: str, df: pd.DataFrame) -> int:
+        """
+        write ticks (ts as datetimes or epoch ns, price, size) as one new
+        segment per day they fall on; returns the ticks written
+        """
+        if df is None or df.empty:
+            return 0
+        ts = df["ts"]
+        ts = ts.to_numpy("datetime64[ns]").view("i8") if pd.api.types.is_datetime64_any_dtype(ts) \
+            else ts.to_numpy(np.int64)
+        price = df["price"].to_numpy(np.float64)
+        size = df["size"].to_numpy(np.int64)
+        days = ts // DAY_NS
+        if (days[1:] >= days[:-1]).all():
+            # the usual case, a batch of ticks in arrival order
+            cuts = np.flatnonzero(np.diff(days)) + 1
+            parts = [slice(lo, hi) for lo, hi in zip(np.r_[0, cuts], np.r_[cuts, len(days)])]
+        else:
+            parts = [np.flatnonzero(days == day) for day in np.unique(days)]
+        for part in parts:
+            self._append_day(code, int(days[part][0]), ts[part], price[part], size[part])
+        metrics.incr("ticks_written", len(ts))
+        return len(ts)
+
+    def _append_day(self, code: str, day: int, ts, price, size):
+        path = self._day_dir(code, pd.Timestamp(day * DAY_NS).strftime("%Y-%m-%d"))
+        os.makedirs(path, exist_ok=True)
+        name = f"{time.time_ns()}-{os.getpid()}-{next(_sequence)}{SUFFIX}"
+        write_segment(os.path.join(path, name), dict(ts=ts, price=price, size=size), self.codec)
+
+    def read_day(self, code: str, day: StartEndType) -> Dict[str, np.ndarray]:
+        """
+            Returns the ticks of one day as ts / price / size arrays sorted by ts
+        """
+        segments = self.segments(code, pd.Timestamp(day).strftime("%Y-%m-%d"))
+        if not segments:
+            return {name: np.empty(0, dtype) for name, dtype in COLUMNS}
+        return _merge(segments)
+
+    @metrics.timed("tick_read")
+    def read(self, code: str, start: StartEndType = None, end: StartEndType = None) -> pd.DataFrame:
+        """
+            Returns ticks of code with start <= ts <= end, ts in epoch ns
+        """
+        start_ns, end_ns = _to_ns(start), _to_ns(end)
+        frames = []
+        for day in self.days(code):
+            day_ns = pd.Timestamp(day).value
+            if start_ns is not None and day_ns + DAY_NS <= start_ns:
+                continue
+            if end_ns is not None and day_ns > end_ns:
+                break
+            arrays = self.read_day(code, day)
+            lo = 0 if start_ns is None else np.searchsorted(arrays["ts"], start_ns, side="left")
+            hi = len(arrays["ts"]) if end_ns is None else np.searchsorted(arrays["ts"], end_ns, side="right")
+            frames.append(pd.DataFrame({name: values[lo:hi] for name, values in arrays.items()}))
+        if not frames:
+            return pd.DataFrame({name: np.empty(0, dtype) for name, dtype in COLUMNS})
+        df = pd.concat(frames, ignore_index=True)
+        metrics.incr("ticks_read", len(df))
+        return df
+
+    @metrics.timed("tick_compact")
+    def compact(self, codes: Optional[Iterable[str]] = None,
+                min_segments: int = TICK_COMPACT_MIN_SEGMENTS) -> int:
+        """
+        merge the segments of every day holding at least `min_segments` into
+        one; returns the days compacted
+
+        the merged segment lists the ones it replaces, so a reader racing the
+        compaction never sees a tick twice, and the replaced files are removed
+        after it is in place (or by the next compaction after a crash)
+        """
+        compacted = 0
+        for code in codes if codes is not None else self.codes():
+            for day in self.days(code):
+                path = self._day_dir(code, day)
+                names = {name for name in os.listdir(path) if name.endswith(SUFFIX)}
+                segments = self.segments(code, day)
+                live = {seg.name for seg in segments}
+                if len(segments) >= min_segments:
+                    name = f"{time.time_ns()}-{os.getpid()}-{next(_sequence)}{SUFFIX}"
+                    write_segment(os.path.join(path, name), _merge(segments), self.codec, sources=live)
+                    compacted += 1
+                    stale = names
+                else:
+                    stale = names - live
+                del segments
+                for stale_name in stale:
+                    os.remove(os.path.join(path, stale_name))
+        if compacted:
+            LOG.info(f"ticks: compacted {compacted} symbol days")
+        return compacted
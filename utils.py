@@ -141,8 +141,8 @@ def _sanitize_dates(start: Union[int, date, datetime], end: Union[int, date, dat
         Return (datetime_start, datetime_end) tuple
     """
     if start and end:
-        if start >= end:
-            raise ValueError("end must be after start")
+        if start > end:
+            raise ValueError("end must not be before start")
     else:
         raise ValueError("start and or end must contain valid str, int, date or datetime object")
 
@@ -198,6 +198,30 @@ def previous_day_last_minute():
     yesterday = datetime.today() - timedelta(days=1)
     return str(yesterday.date()) + " 23:59:00"
 
+def get_latest_trade_date(trade_cal: list = None) -> date:
+    """
+        Returns the latest trade date up to today, weekdays when no calendar is given
+    """
+    today = date.today()
+    if trade_cal:
+        today_str = str(today)
+        past = [trade_date for trade_date in trade_cal if trade_date <= today_str]
+        if past:
+            return date_parser.parse(max(past)).date()
+    return pd.offsets.BDay().rollback(pd.Timestamp(today)).date()
+
+def trade_dates(start, end, trade_cal: list = None) -> np.ndarray:
+    """
+        Returns the trade dates in [start, end] as sorted datetime64[D], weekdays when no calendar is given
+    """
+    start = np.datetime64(pd.Timestamp(start).date(), "D")
+    end = np.datetime64(pd.Timestamp(end).date(), "D")
+    if trade_cal:
+        cal = np.unique(np.asarray(trade_cal, dtype="datetime64[D]"))
+        return cal[(cal >= start) & (cal <= end)]
+    days = np.arange(start, end + 1, dtype="datetime64[D]")
+    return days[np.is_busday(days)]
+
 def get_today_latest_time() -> datetime: 
     return pd.to_datetime(datetime.today().date()) + timedelta(hours=23, minutes=59, seconds=59)
 